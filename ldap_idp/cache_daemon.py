@@ -0,0 +1,738 @@
+#!/usr/bin/env python3
+"""
+Directory cache daemon - Shared LDAP cache for multi-session deployments
+
+The daemon listens on a Unix socket and holds, per bind identity, a pool of
+bound LDAP connections, an entry store and a query cache. Sessions of
+`ldapcp-serve` talk to it through `CacheDaemonClient`, a drop-in replacement
+for the python-ldap connection object, so one fetch serves many sessions
+while each identity only ever sees what its own bind is allowed to read.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+from ldap_idp.config import settings
+from ldap_idp.ldap_backend import apply_modlist, get_parent_dn
+from ldap_idp.ldap_filter import match_filter, parse_filter
+
+logger = logging.getLogger(__name__)
+
+SCOPE_BASE = 0
+SCOPE_ONELEVEL = 1
+RES_SEARCH_RESULT = 101
+MATCH_ALL_FILTERS = ("(objectclass=*)", "objectclass=*")
+
+
+# =============================================================
+# Wire helpers
+# =============================================================
+
+
+def encode_results(results: List[Tuple[str, Dict[str, List[bytes]]]]) -> list:
+    """Encode python-ldap search results for JSON transport."""
+    return [
+        [dn, {name: [base64.b64encode(v).decode("ascii") for v in values]
+              for name, values in attrs.items()}]
+        for dn, attrs in results
+    ]
+
+
+def decode_results(payload: list) -> List[Tuple[str, Dict[str, List[bytes]]]]:
+    """Decode JSON transported search results back to python-ldap format."""
+    return [
+        (dn, {name: [base64.b64decode(v) for v in values]
+              for name, values in attrs.items()})
+        for dn, attrs in payload
+    ]
+
+
+def encode_error(err: Exception) -> Dict[str, Any]:
+    """Serialize an LDAP exception so the client can raise the same type."""
+    info = err.args[0] if err.args and isinstance(err.args[0], dict) else {"desc": str(err)}
+    info = {k: v for k, v in info.items() if isinstance(v, (str, int, float))}
+    return {"type": type(err).__name__, "info": info}
+
+
+def encode_modlist(modlist: List[tuple]) -> list:
+    """Encode a python-ldap modlist for JSON transport."""
+    return [
+        [mod_op, attr, [base64.b64encode(v).decode("ascii") for v in values] if values else None]
+        for mod_op, attr, values in modlist
+    ]
+
+
+def decode_modlist(payload: list) -> List[tuple]:
+    """Decode a JSON transported modlist back to python-ldap format."""
+    return [
+        (mod_op, attr, [base64.b64decode(v) for v in values] if values else None)
+        for mod_op, attr, values in payload
+    ]
+
+
+def in_scope(dn: str, base: str, scope: int) -> bool:
+    """Tell if a search of base and scope can return dn, both lowercase."""
+    if scope == SCOPE_BASE:
+        return dn == base
+    if scope == SCOPE_ONELEVEL:
+        return get_parent_dn(dn).lower() == base
+    return not base or dn == base or dn.endswith("," + base)
+
+
+def identity_key(uri: str, bind_dn: str, bind_password: str) -> str:
+    """Return the cache partition key of a bind identity."""
+    raw = "\0".join([uri, bind_dn.lower(), bind_password])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# =============================================================
+# Per identity cache
+# =============================================================
+
+
+class Flight:
+    """A server fetch in progress, whose result concurrent misses wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.results: Any = None
+        self.error: Optional[Exception] = None
+
+    def finish(self, results: Any = None, error: Optional[Exception] = None) -> None:
+        self.results = results
+        self.error = error
+        self.done.set()
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+
+class PagedSearch:
+    """A search paged on the server, holding its pooled connection between pages."""
+
+    def __init__(self, conn, request: tuple):
+        self.conn = conn
+        self.request = request
+        self.cookie = b""
+        self.expires = 0.0
+
+
+class DirectoryCache:
+    """Connection pool, entry store and query cache of one bind identity."""
+
+    def __init__(
+        self,
+        uri: str,
+        bind_dn: str,
+        bind_password: str,
+        pool_size: int = 4,
+        ttl: float = 60.0,
+        max_queries: int = 1000,
+    ):
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.max_queries = max_queries
+
+        self.lock = threading.Lock()
+        # Signaled whenever a connection is released or a slot is freed
+        self.available = threading.Condition(self.lock)
+        self.pool: List[Any] = []
+        self.opened = 0
+
+        self.queries: "OrderedDict[tuple, Tuple[float, list]]" = OrderedDict()
+        self.entries: Dict[str, Tuple[float, str, dict]] = {}
+        self.flights: Dict[tuple, Flight] = {}
+        self.paged: Dict[str, PagedSearch] = {}
+        self.stats = {"hits": 0, "misses": 0, "entry_hits": 0, "shared": 0}
+
+    # Connection pool
+    # ---------------------------
+
+    def _open(self):
+        conn = ldap.initialize(self.uri)
+        conn.simple_bind_s(self.bind_dn, self.bind_password)
+        logger.info(f"Opened pooled connection to {self.uri} as {self.bind_dn}")
+        return conn
+
+    def acquire(self):
+        """Return a bound connection, opening a new one while under pool size.
+
+        Waits for a released connection, or a slot freed by a broken one,
+        when the pool is exhausted.
+        """
+        with self.available:
+            while not self.pool and self.opened >= self.pool_size:
+                self.available.wait()
+            if self.pool:
+                return self.pool.pop()
+            self.opened += 1
+
+        try:
+            return self._open()
+        except Exception:
+            with self.available:
+                self.opened -= 1
+                self.available.notify()
+            raise
+
+    def release(self, conn, broken: bool = False) -> None:
+        """Give a connection back to the pool, or drop it if broken."""
+        with self.available:
+            if broken:
+                self.opened -= 1
+            else:
+                self.pool.append(conn)
+            self.available.notify()
+
+    # Caches
+    # ---------------------------
+
+    def search(self, base: str, scope: int, filterstr: str, attrlist: Optional[list]):
+        """Search through the caches, hitting the server on miss only.
+
+        Concurrent misses of the same query share a single server fetch.
+        """
+        key = (base.lower(), scope, filterstr, tuple(sorted(attrlist)) if attrlist else None)
+        now = time.monotonic()
+
+        with self.lock:
+            cached = self.queries.get(key)
+            if cached and cached[0] > now:
+                self.queries.move_to_end(key)
+                self.stats["hits"] += 1
+                return cached[1]
+
+            # Plain entry reads are answered from entries seen by other queries
+            if scope == SCOPE_BASE and not attrlist and filterstr.lower() in MATCH_ALL_FILTERS:
+                entry = self.entries.get(base.lower())
+                if entry and entry[0] > now:
+                    self.stats["entry_hits"] += 1
+                    return [(entry[1], entry[2])]
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                self.stats["misses"] += 1
+                flight = self.flights[key] = Flight()
+            else:
+                self.stats["shared"] += 1
+        if not leader:
+            return flight.wait()
+
+        try:
+            results = self._fetch(base, scope, filterstr, attrlist)
+        except Exception as err:
+            with self.lock:
+                del self.flights[key]
+            flight.finish(error=err)
+            raise
+
+        expires = time.monotonic() + self.ttl
+        with self.lock:
+            self.queries[key] = (expires, results)
+            while len(self.queries) > self.max_queries:
+                self.queries.popitem(last=False)
+            if not attrlist:
+                for dn, attrs in results:
+                    self.entries[dn.lower()] = (expires, dn, attrs)
+            del self.flights[key]
+        flight.finish(results)
+        return results
+
+    def _fetch(self, base: str, scope: int, filterstr: str, attrlist: Optional[list]) -> list:
+        """Run a search on a pooled connection."""
+        conn = self.acquire()
+        try:
+            results = conn.search_s(base, scope, filterstr, attrlist)
+        except ldap.SERVER_DOWN:
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        self.release(conn)
+        return [(dn, attrs) for dn, attrs in results if dn is not None]
+
+    def search_page(
+        self,
+        base: str,
+        scope: int,
+        filterstr: str,
+        attrlist: Optional[list],
+        size: int,
+        search_id: Optional[str] = None,
+    ) -> Tuple[list, Optional[str]]:
+        """Return the next page of a search paged on the server, and the id of the rest.
+
+        Bulk searches bypass the query cache: pages are read on one pooled
+        connection, kept by the search until its last page, or its expiry.
+        """
+        request = (base, scope, filterstr, tuple(attrlist) if attrlist else None)
+        search = None
+        if search_id:
+            with self.lock:
+                search = self.paged.pop(search_id, None)
+            if search is None:
+                raise ldap.UNWILLING_TO_PERFORM({"desc": "Paged search expired or unknown"})
+            if search.request != request:
+                self.release(search.conn)
+                raise ldap.PROTOCOL_ERROR({"desc": "Paged search continued with another request"})
+        else:
+            search = PagedSearch(self.acquire(), request)
+            search_id = secrets.token_hex(16)
+
+        control = SimplePagedResultsControl(True, size=size, cookie=search.cookie)
+        try:
+            msgid = search.conn.search_ext(base, scope, filterstr, attrlist, serverctrls=[control])
+            _rtype, rdata, _rmsgid, serverctrls = search.conn.result3(msgid)
+        except ldap.SERVER_DOWN:
+            self.release(search.conn, broken=True)
+            raise
+        except Exception:
+            self.release(search.conn)
+            raise
+
+        results = [(dn, attrs) for dn, attrs in rdata if dn is not None]
+        cookies = [
+            ctrl.cookie
+            for ctrl in serverctrls
+            if ctrl.controlType == SimplePagedResultsControl.controlType
+        ]
+        with self.lock:
+            if not attrlist:
+                expires = time.monotonic() + self.ttl
+                for dn, attrs in results:
+                    self.entries[dn.lower()] = (expires, dn, attrs)
+            if cookies and cookies[0]:
+                search.cookie = cookies[0]
+                search.expires = time.monotonic() + self.ttl
+                self.paged[search_id] = search
+                return results, search_id
+
+        self.release(search.conn)
+        return results, None
+
+    def end_paged(self, search_ids) -> None:
+        """Drop unfinished paged searches, giving their connections back."""
+        with self.lock:
+            searches = [self.paged.pop(search_id, None) for search_id in search_ids]
+        for search in searches:
+            if search is not None:
+                self.release(search.conn)
+
+    def modify(self, dn: str, modlist: List[tuple]) -> None:
+        """Modify an entry on the server, then patch the caches in place."""
+        conn = self.acquire()
+        try:
+            conn.modify_s(dn, modlist)
+        except ldap.SERVER_DOWN:
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        self.release(conn)
+        self._patch_entry(dn, modlist)
+
+    def _patch_entry(self, dn: str, modlist: List[tuple]) -> None:
+        """Apply a modification to cached entries and query results.
+
+        Cached results holding the full entry are patched, or lose the entry
+        if it no longer matches their filter. Other queries which could
+        return the entry are dropped.
+        """
+        key = dn.lower()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries[key] = (entry[0], entry[1], apply_modlist(entry[2], modlist))
+
+            for query_key, (expires, results) in list(self.queries.items()):
+                base, scope, filterstr, attrlist = query_key
+                if not in_scope(key, base, scope):
+                    continue
+                index = next(
+                    (i for i, item in enumerate(results) if item[0].lower() == key), None
+                )
+                if index is None or attrlist:
+                    del self.queries[query_key]
+                    continue
+
+                attrs = apply_modlist(results[index][1], modlist)
+                try:
+                    matches = match_filter(
+                        parse_filter(filterstr), {k.lower(): v for k, v in attrs.items()}
+                    )
+                except ValueError:
+                    del self.queries[query_key]
+                    continue
+                results = list(results)
+                if matches:
+                    results[index] = (results[index][0], attrs)
+                else:
+                    del results[index]
+                self.queries[query_key] = (expires, results)
+
+    def invalidate(self, dn: Optional[str] = None) -> None:
+        """Forget one entry, or everything, and all cached queries."""
+        with self.lock:
+            self.queries.clear()
+            if dn:
+                self.entries.pop(dn.lower(), None)
+            else:
+                self.entries.clear()
+
+    def expire(self) -> None:
+        """Drop expired entries from the entry store, and idle paged searches."""
+        now = time.monotonic()
+        with self.lock:
+            for dn in [dn for dn, item in self.entries.items() if item[0] <= now]:
+                del self.entries[dn]
+            idle = [key for key, search in self.paged.items() if search.expires <= now]
+        self.end_paged(idle)
+
+
+# =============================================================
+# Daemon
+# =============================================================
+
+
+class CacheDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server dispatching client requests to identity caches."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, pool_size: int = 4, ttl: float = 60.0):
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.caches: Dict[str, DirectoryCache] = {}
+        self.caches_lock = threading.Lock()
+        # Identities whose first bind is in progress
+        self.binds: Dict[str, Flight] = {}
+        self.last_expire = time.monotonic()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, CacheRequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def get_cache(self, uri: str, bind_dn: str, bind_password: str) -> DirectoryCache:
+        """Return the cache of an identity, validating credentials on first use.
+
+        The first bind runs outside the global lock: concurrent sessions of
+        the same identity wait for it, other identities are not held up.
+        """
+        key = identity_key(uri, bind_dn, bind_password)
+        with self.caches_lock:
+            cache = self.caches.get(key)
+            if cache is not None:
+                return cache
+            flight = self.binds.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.binds[key] = Flight()
+        if not leader:
+            return flight.wait()
+
+        cache = DirectoryCache(uri, bind_dn, bind_password, pool_size=self.pool_size, ttl=self.ttl)
+        try:
+            # The first pooled connection proves the credentials
+            cache.release(cache.acquire())
+        except Exception as err:
+            with self.caches_lock:
+                del self.binds[key]
+            flight.finish(error=err)
+            raise
+        with self.caches_lock:
+            self.caches[key] = cache
+            del self.binds[key]
+        flight.finish(cache)
+        return cache
+
+    def service_actions(self) -> None:
+        """Purge expired entries, called by serve_forever() between requests."""
+        if time.monotonic() - self.last_expire < self.ttl:
+            return
+        self.last_expire = time.monotonic()
+        with self.caches_lock:
+            caches = list(self.caches.values())
+        for cache in caches:
+            cache.expire()
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class CacheRequestHandler(socketserver.StreamRequestHandler):
+    """Serve one client session: JSON requests and responses, one per line."""
+
+    def handle(self) -> None:
+        # Unfinished paged searches of this session: ended with it
+        paged: Dict[str, DirectoryCache] = {}
+        try:
+            self._serve(paged)
+        finally:
+            for search_id, cache in paged.items():
+                cache.end_paged([search_id])
+
+    def _serve(self, paged: Dict[str, DirectoryCache]) -> None:
+        cache: Optional[DirectoryCache] = None
+
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise TypeError("request is not an object")
+                op = request.get("op")
+                if op == "bind":
+                    cache = self.server.get_cache(
+                        request["uri"], request["who"], request["cred"]
+                    )
+                    response = {"ok": True}
+                elif cache is None:
+                    raise ldap.OPERATIONS_ERROR({"desc": "Not bound to the cache daemon"})
+                elif op == "search":
+                    results = cache.search(
+                        request["base"],
+                        request["scope"],
+                        request["filterstr"],
+                        request.get("attrlist"),
+                    )
+                    response = {"ok": True, "results": encode_results(results)}
+                elif op == "search_page":
+                    search_id = request.get("cookie")
+                    results, next_id = cache.search_page(
+                        request["base"],
+                        request["scope"],
+                        request["filterstr"],
+                        request.get("attrlist"),
+                        int(request["size"]),
+                        search_id,
+                    )
+                    paged.pop(search_id, None)
+                    if next_id:
+                        paged[next_id] = cache
+                    response = {"ok": True, "results": encode_results(results), "cookie": next_id}
+                elif op == "modify":
+                    cache.modify(request["dn"], decode_modlist(request["modlist"]))
+                    response = {"ok": True}
+                elif op == "invalidate":
+                    cache.invalidate(request.get("dn"))
+                    response = {"ok": True}
+                elif op == "stats":
+                    response = {"ok": True, "stats": dict(cache.stats)}
+                else:
+                    raise ldap.PROTOCOL_ERROR({"desc": f"Unknown operation: {op}"})
+            except ldap.LDAPError as err:
+                response = {"ok": False, "error": encode_error(err)}
+            except (KeyError, TypeError, ValueError) as err:
+                # Malformed JSON, missing fields or values of the wrong type
+                logger.warning(f"Malformed cache daemon request: {err!r}")
+                error = ldap.PROTOCOL_ERROR({"desc": "Malformed request", "info": repr(err)})
+                response = {"ok": False, "error": encode_error(error)}
+
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+# =============================================================
+# Client
+# =============================================================
+
+
+class CacheDaemonClient:
+    """python-ldap connection lookalike which talks to the cache daemon."""
+
+    def __init__(self, socket_path: str, uri: str):
+        self.socket_path = socket_path
+        self.uri = uri
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(socket_path)
+        except OSError as err:
+            raise ldap.SERVER_DOWN(
+                {"desc": "Cache daemon unreachable", "info": f"{socket_path}: {err}", "errno": err.errno}
+            ) from err
+        self.stream = self.sock.makefile("rwb")
+        self.lock = threading.Lock()
+        # msgid -> (results, paged results control) or error of sent searches
+        self.responses: Dict[int, Any] = {}
+        self.msgids = itertools.count(1)
+
+    def _call(self, **request) -> Dict[str, Any]:
+        with self.lock:
+            self.stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            self.stream.flush()
+            line = self.stream.readline()
+        if not line:
+            raise ldap.SERVER_DOWN({"desc": "Cache daemon closed the connection", "info": self.socket_path})
+
+        response = json.loads(line)
+        if not response.get("ok"):
+            error = response["error"]
+            err_cls = getattr(ldap, error["type"], ldap.LDAPError)
+            raise err_cls(error["info"])
+        return response
+
+    def simple_bind_s(self, who: str = "", cred: str = "", *_args, **_kwargs):
+        self._call(op="bind", uri=self.uri, who=who or "", cred=cred or "")
+
+    def search_s(self, base, scope, filterstr="(objectClass=*)", attrlist=None, attrsonly=0):
+        response = self._call(
+            op="search", base=base, scope=scope, filterstr=filterstr, attrlist=attrlist
+        )
+        return decode_results(response["results"])
+
+    def search_ext(
+        self,
+        base,
+        scope,
+        filterstr="(objectClass=*)",
+        attrlist=None,
+        attrsonly=0,
+        serverctrls=None,
+        *_args,
+        **_kwargs,
+    ) -> int:
+        """Search through the daemon, which pages on the server with a paged results control.
+
+        The search runs at once, result3() returns its response.
+        """
+        msgid = next(self.msgids)
+        paging = next(
+            (
+                ctrl
+                for ctrl in serverctrls or []
+                if ctrl.controlType == SimplePagedResultsControl.controlType
+            ),
+            None,
+        )
+        try:
+            if paging is None:
+                response = (self.search_s(base, scope, filterstr, attrlist), [])
+            else:
+                cookie = paging.cookie
+                if isinstance(cookie, bytes):
+                    cookie = cookie.decode("ascii")
+                page = self._call(
+                    op="search_page",
+                    base=base,
+                    scope=scope,
+                    filterstr=filterstr,
+                    attrlist=attrlist,
+                    size=paging.size,
+                    cookie=cookie or None,
+                )
+                control = SimplePagedResultsControl(True, size=paging.size, cookie=page["cookie"] or "")
+                response = (decode_results(page["results"]), [control])
+        except ldap.LDAPError as err:
+            if err.args and isinstance(err.args[0], dict):
+                err.args[0]["msgid"] = msgid
+            response = err
+        self.responses[msgid] = response
+        return msgid
+
+    def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None):  # pylint: disable=redefined-builtin
+        """Return the response of a search sent by search_ext()."""
+        if msgid == ldap.RES_ANY:
+            msgid = next(iter(self.responses))
+        response = self.responses.pop(msgid)
+        if isinstance(response, Exception):
+            raise response
+        results, serverctrls = response
+        return RES_SEARCH_RESULT, results, msgid, serverctrls
+
+    def search_subschemasubentry_s(self, dn: str = ""):
+        results = self.search_s(dn, SCOPE_BASE, "(objectClass=*)", ["subschemaSubentry"])
+        if not results and dn:
+            results = self.search_s("", SCOPE_BASE, "(objectClass=*)", ["subschemaSubentry"])
+        for _dn, attrs in results:
+            for value in attrs.get("subschemaSubentry", []):
+                return value.decode("utf-8")
+        return None
+
+    def read_subschemasubentry_s(self, subschemasubentry_dn, attrs=None):
+        results = self.search_s(subschemasubentry_dn, SCOPE_BASE, "(objectClass=subschema)", attrs)
+        return results[0][1] if results else None
+
+    def modify_s(self, dn: str, modlist: List[tuple]) -> None:
+        """Modify an entry through the daemon, which updates the shared cache."""
+        self._call(op="modify", dn=dn, modlist=encode_modlist(modlist))
+
+    def invalidate(self, dn: Optional[str] = None) -> None:
+        """Drop an entry, or everything, from the shared cache of this identity."""
+        self._call(op="invalidate", dn=dn)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the hit and miss counters of this identity cache."""
+        return self._call(op="stats")["stats"]
+
+    def unbind_s(self) -> None:
+        self.stream.close()
+        self.sock.close()
+
+
+# =============================================================
+# CLI
+# =============================================================
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    default=lambda: settings.cache.daemon_socket or "/tmp/ldapcp-cache.sock",
+    help="Unix socket to listen on",
+)
+@click.option(
+    "--pool-size",
+    default=lambda: settings.cache.daemon_pool_size,
+    type=int,
+    help="LDAP connections per bind identity",
+)
+@click.option(
+    "--ttl",
+    default=lambda: settings.cache.daemon_ttl,
+    type=float,
+    help="Seconds before a cached query is fetched again",
+)
+def main(socket_path: str, pool_size: int, ttl: float) -> None:
+    """Run the shared directory cache daemon."""
+    logging.basicConfig(level=logging.INFO)
+
+    daemon = CacheDaemon(socket_path, pool_size=pool_size, ttl=ttl)
+    click.echo(f"Directory cache listening on {socket_path}")
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.server_close()
+
+
+if __name__ == "__main__":
+    main()
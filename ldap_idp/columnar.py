@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+Columnar store - Viewer results as per-column arrays
+
+The viewer table displays the first value of a few attributes of up to
+hundreds of thousands of entries. They are stored by column rather than as
+row lists, each column in the cheapest encoding for its values:
+
+    NumberColumn   integers (uidNumber, gidNumber...) in an array('q'), sorted numerically
+    DictColumn     low cardinality values (objectClass, ou...) as codes into a dictionary
+    StringColumn   other values, in a list
+
+Sorting and filtering return row indices: the table materializes the rows
+it displays only.
+"""
+
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+# A column is dictionary encoded when its distinct values are less than
+# this ratio of its rows
+DICT_RATIO = 0.2
+
+# Rows sampled to tell whether a column has a low cardinality
+DICT_SAMPLE = 1000
+
+LIST_TYPES = {list, type(None)}
+STR_TYPES = {str, type(None)}
+
+# Numbers stored for missing values of numeric columns, sorted first
+MISSING_NUMBER = -(2**63)
+
+
+def first_value(value: Any) -> Any:
+    """Return the first value of an attribute, None if it has none."""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    return value
+
+
+def first_values(values: List[Any]) -> List[Optional[str]]:
+    """Return the first value of each attribute, as strings."""
+    firsts = [value[0] if value else None for value in values]
+    if set(map(type, values)) <= LIST_TYPES and set(map(type, firsts)) <= STR_TYPES:
+        return firsts
+    firsts = [first_value(value) for value in values]
+    return [value if value is None or isinstance(value, str) else str(value) for value in firsts]
+
+
+def is_integer(value: str) -> bool:
+    """Tell whether a value is an integer displayed as is once converted."""
+    digits = value[1:] if value[:1] == "-" else value
+    return digits.isdigit() and digits.isascii() and (digits == "0" or digits[0] != "0")
+
+
+# =============================================================
+# Columns
+# =============================================================
+
+
+class StringColumn:
+    """Values as a list of strings, None when missing."""
+
+    kind = "string"
+
+    def __init__(self, values: List[Optional[str]]):
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def get(self, row: int) -> Optional[str]:
+        return self.values[row]
+
+    def set(self, row: int, value: Optional[str]) -> None:
+        self.values[row] = value
+
+    def append(self, value: Optional[str]) -> None:
+        self.values.append(value)
+
+    def accepts(self, value: Optional[str]) -> bool:
+        return True
+
+    def sort_keys(self) -> Sequence:
+        """Return a sequence of sortable keys indexed by row."""
+        return [value if value is not None else "" for value in self.values]
+
+    def width(self) -> int:
+        return max(map(len, filter(None, self.values)), default=0)
+
+    def distinct(self) -> int:
+        return len(set(self.values))
+
+
+class NumberColumn:
+    """Integers in an array, MISSING_NUMBER when missing."""
+
+    kind = "number"
+
+    def __init__(self, values: Iterable[Optional[str]]):
+        self.values = array(
+            "q", (MISSING_NUMBER if value is None else int(value) for value in values)
+        )
+
+    @classmethod
+    def parse(cls, values: List[Optional[str]]) -> Optional["NumberColumn"]:
+        """Return the column of values if all are integers displayed as is, else None."""
+        present = [value for value in values if value is not None]
+        if not present or not is_integer(present[0]):
+            return None
+        try:
+            numbers = list(map(int, present))
+            if list(map(str, numbers)) != present:
+                return None
+            column = cls([])
+            if len(present) == len(values):
+                column.values = array("q", numbers)
+            else:
+                numbers.reverse()
+                column.values = array(
+                    "q", (MISSING_NUMBER if value is None else numbers.pop() for value in values)
+                )
+            return column
+        except (ValueError, OverflowError):
+            return None
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def get(self, row: int) -> Optional[str]:
+        value = self.values[row]
+        return None if value == MISSING_NUMBER else str(value)
+
+    def set(self, row: int, value: Optional[str]) -> None:
+        self.values[row] = MISSING_NUMBER if value is None else int(value)
+
+    def append(self, value: Optional[str]) -> None:
+        self.values.append(MISSING_NUMBER if value is None else int(value))
+
+    def accepts(self, value: Optional[str]) -> bool:
+        return value is None or (is_integer(value) and -(2**63) < int(value) < 2**63)
+
+    def sort_keys(self) -> Sequence:
+        # Indexing a list is faster than boxing array items
+        return self.values.tolist()
+
+    def width(self) -> int:
+        present = [value for value in (min(self.values, default=0), max(self.values, default=0))
+                   if value != MISSING_NUMBER]
+        return max((len(str(value)) for value in present), default=0)
+
+    def distinct(self) -> int:
+        return len(set(self.values))
+
+
+class DictColumn:
+    """Values as codes into a dictionary of distinct values."""
+
+    kind = "dict"
+
+    def __init__(self, values: Iterable[Optional[str]]):
+        self.dictionary: List[Optional[str]] = list(dict.fromkeys(values))
+        self.index: Dict[Optional[str], int] = {
+            value: code for code, value in enumerate(self.dictionary)
+        }
+        self.codes = array("I", map(self.index.__getitem__, values))
+
+    def _code(self, value: Optional[str]) -> int:
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        return code
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def get(self, row: int) -> Optional[str]:
+        return self.dictionary[self.codes[row]]
+
+    def set(self, row: int, value: Optional[str]) -> None:
+        self.codes[row] = self._code(value)
+
+    def append(self, value: Optional[str]) -> None:
+        self.codes.append(self._code(value))
+
+    def accepts(self, value: Optional[str]) -> bool:
+        return True
+
+    def ranks(self) -> List[int]:
+        """Return the sort rank of each code."""
+        order = sorted(
+            range(len(self.dictionary)),
+            key=lambda code: self.dictionary[code] if self.dictionary[code] is not None else "",
+        )
+        ranks = [0] * len(order)
+        for rank, code in enumerate(order):
+            ranks[code] = rank
+        return ranks
+
+    def sort_keys(self) -> Sequence:
+        ranks = self.ranks()
+        return [ranks[code] for code in self.codes]
+
+    def width(self) -> int:
+        return max(map(len, filter(None, self.dictionary)), default=0)
+
+    def distinct(self) -> int:
+        return len(self.dictionary)
+
+
+def build_column(values: List[Optional[str]]):
+    """Return the column storing values in the cheapest encoding."""
+    column = NumberColumn.parse(values)
+    if column is not None:
+        return column
+    sample = values[:DICT_SAMPLE]
+    if len(set(sample)) < max(2, DICT_RATIO * len(sample)):
+        if len(set(values)) < max(2, DICT_RATIO * len(values)):
+            return DictColumn(values)
+    return StringColumn(values)
+
+
+def as_string_column(column) -> StringColumn:
+    return StringColumn([column.get(row) for row in range(len(column))])
+
+
+# =============================================================
+# Store
+# =============================================================
+
+
+class ResultStore:
+    """Results of a query stored by column, with a view: sorted, filtered rows.
+
+    Rows are keyed by lowercase DN. Deleted rows are left in the columns and
+    only dropped from the view, the store is rebuilt on the next query.
+    """
+
+    def __init__(self, columns: List[str], placeholder: str = ""):
+        self.names = list(columns)
+        self.placeholder = placeholder
+        self.columns: Dict[str, Any] = {}
+        self.keys: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.deleted = set()
+
+        # Rows in sort order, and the ones displayed: matching the filter
+        self.order: List[int] = []
+        self.view: List[int] = []
+        self.sort_column: Optional[str] = None
+        self.sort_reverse = False
+        self.query = ""
+        self.matches: Optional[set] = None
+
+        # Search index, and the rows changed since it was built
+        self._search: Optional[SearchIndex] = None
+        self._changed = set()
+
+        self._index = {name: position for position, name in enumerate(self.names)}
+        self._dn_position = self._index.get("dn")
+        self._positions: Dict[str, int] = {}
+
+    @classmethod
+    def from_results(cls, columns: List[str], results: Iterable[Dict[str, Any]],
+                     placeholder: str = "") -> "ResultStore":
+        store = cls(columns, placeholder)
+        results = list(results)
+        store.keys = [result["dn"].lower() for result in results]
+        store.rows = {key: row for row, key in enumerate(store.keys)}
+        if len(store.rows) < len(store.keys):
+            # Keep the first result of a DN
+            unique: Dict[str, Dict[str, Any]] = {}
+            for key, result in zip(store.keys, results):
+                unique.setdefault(key, result)
+            results, store.keys = list(unique.values()), list(unique)
+            store.rows = {key: row for row, key in enumerate(store.keys)}
+
+        # Build each column in one pass over the results, looking the
+        # attribute up by the spellings the server returned
+        attributes = [result.get("attributes", {}) for result in results]
+        spellings = set().union(*attributes)
+        for name in store.names:
+            if name == "dn":
+                values = [result.get("dn") for result in results]
+            else:
+                matches = [attr for attr in spellings if attr.lower() == name]
+                if not matches:
+                    values = [None] * len(results)
+                elif len(matches) == 1:
+                    values = first_values([attrs.get(matches[0]) for attrs in attributes])
+                else:
+                    values = first_values([
+                        next((attrs[attr] for attr in matches if attr in attrs), None)
+                        for attrs in attributes
+                    ])
+            store.columns[name] = build_column(values)
+        store.order = store.view = list(range(len(store.keys)))
+        return store
+
+    def _cells(self, result: Dict[str, Any]) -> List[Optional[str]]:
+        """Return the first values of a result for the columns, as strings."""
+        cells = [None] * len(self.names)
+        if self._dn_position is not None:
+            cells[self._dn_position] = result.get("dn")
+        for attr, value in result.get("attributes", {}).items():
+            # Positions are cached by attribute spelling, saving a lower() per value
+            position = self._positions.get(attr)
+            if position is None:
+                position = self._positions[attr] = self._index.get(attr.lower(), -1)
+            if position < 0:
+                continue
+            if value.__class__ is list and value and value[0].__class__ is str:
+                cells[position] = value[0]
+            else:
+                value = first_value(value)
+                cells[position] = value if value is None or isinstance(value, str) else str(value)
+        return cells
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    @property
+    def size(self) -> int:
+        """Rows in the store, deleted ones excluded."""
+        return len(self.keys) - len(self.deleted)
+
+    def cell(self, row: int, name: str) -> str:
+        value = self.columns[name].get(row)
+        return self.placeholder if value is None else value
+
+    def row_cells(self, row: int, names: Optional[List[str]] = None) -> List[str]:
+        return [self.cell(row, name) for name in names or self.names]
+
+    def window(self, start: int, end: int) -> List[int]:
+        """Return the rows displayed from start to end of the view."""
+        return self.view[start:end]
+
+    def widths(self) -> Dict[str, int]:
+        """Return the widest value of each column, placeholder included."""
+        return {
+            name: max(column.width(), len(self.placeholder)) for name, column in self.columns.items()
+        }
+
+    def project(self, names: List[str]) -> "ResultStore":
+        """Return a store of some of the columns, sharing their data."""
+        store = ResultStore([name for name in names if name in self.columns], self.placeholder)
+        store.columns = {name: self.columns[name] for name in store.names}
+        store.keys, store.rows, store.deleted = self.keys, self.rows, self.deleted
+        store.order, store.matches = list(self.order), self.matches
+        store._update_view()
+        return store
+
+    # Sort and filter
+    # =============================================================
+
+    def sorted_rows(self, rows: Sequence[int], name: str, reverse: bool = False) -> List[int]:
+        """Return rows sorted by a column, in a stable order."""
+        column = self.columns[name]
+        if isinstance(column, DictColumn):
+            # Bucket the rows by code, then concatenate the buckets by rank
+            ranks = column.ranks()
+            buckets: List[List[int]] = [[] for _ in ranks]
+            codes = column.codes
+            for row in rows:
+                buckets[codes[row]].append(row)
+            by_rank = sorted(range(len(ranks)), key=ranks.__getitem__, reverse=reverse)
+            return [row for code in by_rank for row in buckets[code]]
+        keys = column.sort_keys()
+        return sorted(rows, key=keys.__getitem__, reverse=reverse)
+
+    def sort(self, name: str, reverse: bool = False) -> float:
+        """Sort the rows by a column, return the seconds it took."""
+        start = time.perf_counter()
+        self.order = self.sorted_rows(self.order, name, reverse)
+        self.sort_column, self.sort_reverse = name, reverse
+        self._update_view()
+        return time.perf_counter() - start
+
+    def select(self, rows: Optional[Iterable[int]]) -> None:
+        """Display some rows only, all of them with None, in the sort order."""
+        self.matches = None if rows is None else set(rows)
+        self._update_view()
+
+    def _update_view(self) -> None:
+        if self.matches is None:
+            self.view = self.order
+        else:
+            matches = self.matches
+            self.view = [row for row in self.order if row in matches]
+
+    def equals(self, name: str, value: Optional[str]) -> List[int]:
+        """Return the rows where a column holds value, comparing codes if encoded."""
+        column = self.columns[name]
+        if isinstance(column, DictColumn):
+            code = column.index.get(value)
+            if code is None:
+                return []
+            return [row for row, row_code in enumerate(column.codes)
+                    if row_code == code and row not in self.deleted]
+        if isinstance(column, NumberColumn):
+            if value is not None and not column.accepts(value):
+                return []
+            number = MISSING_NUMBER if value is None else int(value)
+            return [row for row, row_value in enumerate(column.values)
+                    if row_value == number and row not in self.deleted]
+        return [row for row, row_value in enumerate(column.values)
+                if row_value == value and row not in self.deleted]
+
+    # Search
+    # =============================================================
+
+    def search_index(self) -> "SearchIndex":
+        """Return the search index of the columns, building it on first use."""
+        if self._search is None:
+            self._search = SearchIndex(self)
+            self._changed = set()
+        return self._search
+
+    def row_matches(self, row: int, terms: List[str]) -> bool:
+        """Tell whether each term is in a cell of a row, without the index."""
+        cells = [(self.columns[name].get(row) or "").lower() for name in self.names]
+        return all(any(term in cell for cell in cells) for term in terms)
+
+    def filter(self, query: str) -> float:
+        """Display the rows containing all words of query, return the seconds it took.
+
+        When query extends the previous one, only the previous matches are
+        checked again.
+        """
+        start = time.perf_counter()
+        terms = query.lower().split()
+        if not terms:
+            self.query = ""
+            self.select(None)
+            return time.perf_counter() - start
+
+        index = self.search_index()
+        candidates = None
+        if self.matches is not None and self.query and query.lower().startswith(self.query.lower()):
+            candidates = self.matches - self._changed
+
+        # Each term narrows the rows found for the previous ones
+        for term in sorted(terms, key=len, reverse=True):
+            candidates = index.rows(term, candidates)
+        matches = candidates - self._changed
+        matches.update(row for row in self._changed if self.row_matches(row, terms))
+
+        self.query = query
+        self.select(matches - self.deleted)
+        return time.perf_counter() - start
+
+    # Live changes
+    # =============================================================
+
+    def upsert(self, result: Dict[str, Any]) -> int:
+        """Add or update the row of a result, return its index."""
+        key = result["dn"].lower()
+        cells = self._cells(result)
+        for name, value in zip(self.names, cells):
+            if not self.columns[name].accepts(value):
+                self.columns[name] = as_string_column(self.columns[name])
+                self._search = None
+
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            for name, value in zip(self.names, cells):
+                self.columns[name].append(value)
+            self.order.append(row)
+        else:
+            for name, value in zip(self.names, cells):
+                self.columns[name].set(row, value)
+            if row in self.deleted:
+                self.deleted.discard(row)
+                self.order.append(row)
+        self._changed.add(row)
+
+        if self.matches is not None:
+            if self.row_matches(row, self.query.lower().split()):
+                self.matches.add(row)
+            else:
+                self.matches.discard(row)
+        self._update_view()
+        return row
+
+    def delete(self, key: str) -> Optional[int]:
+        """Drop the row of a lowercase DN from the view, return its index."""
+        row = self.rows.get(key)
+        if row is None or row in self.deleted:
+            return None
+        self.deleted.add(row)
+        self.order.remove(row)
+        if self.matches is not None:
+            self.matches.discard(row)
+        self._update_view()
+        return row
+
+
+# =============================================================
+# Search index
+# =============================================================
+
+
+class SearchIndex:
+    """Lowercase values of each column of a store, for substring searches.
+
+    Dictionary encoded columns index their distinct values only. Scanning
+    these lists with the in operator runs at C speed, an n-gram index built
+    and probed in Python would not pay off at these sizes.
+    """
+
+    def __init__(self, store: ResultStore):
+        self.size = len(store.keys)
+        self.columns = []
+        for column in store.columns.values():
+            if isinstance(column, DictColumn):
+                self.columns.append((lowercase(column.dictionary), column.codes))
+            else:
+                values = [column.get(row) for row in range(len(column))]
+                self.columns.append((lowercase(values), None))
+
+    def rows(self, term: str, candidates: Optional[set] = None) -> set:
+        """Return the rows, among candidates, with a cell containing term."""
+        found = set()
+        # Rows not found yet: each column is only scanned for those
+        remaining = candidates
+        for values, codes in self.columns:
+            rows = range(self.size) if remaining is None else remaining
+            if codes is None:
+                if remaining is None:
+                    hits = [row for row, value in enumerate(values) if term in value]
+                else:
+                    hits = [row for row in rows if row < self.size and term in values[row]]
+            else:
+                matched = {code for code, value in enumerate(values) if term in value}
+                if not matched:
+                    continue
+                hits = [row for row in rows if row < self.size and codes[row] in matched]
+            found.update(hits)
+            if remaining is None:
+                # Full scans are faster until most rows are found
+                if len(found) * 2 < self.size:
+                    continue
+                remaining = set(range(self.size))
+            remaining -= found
+            if not remaining:
+                break
+        return found
+
+
+def lowercase(values: Iterable[Optional[str]]) -> List[str]:
+    """Return values in lowercase, reusing the strings already in lowercase."""
+    lowered = []
+    for value in values:
+        if not value:
+            lowered.append("")
+            continue
+        lower = value.lower()
+        lowered.append(value if lower == value else lower)
+    return lowered
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Export - Streaming row and LDIF writers
+
+Rows are written as they come, so exports of any size run in constant
+memory. Multi-valued cells are joined with "|" in CSV and TSV, and kept as
+lists in JSONL.
+"""
+
+import csv
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, List, Optional, TextIO
+
+import ldif
+
+VALUE_SEPARATOR = "|"
+
+# Progress is reported every this many rows or entries
+PROGRESS_EVERY = 1000
+
+
+class ExportCancelled(Exception):
+    """Export stopped before its end, the partial file is removed."""
+
+
+def _flat(value: Any) -> str:
+    if isinstance(value, list):
+        return VALUE_SEPARATOR.join(str(item) for item in value)
+    return str(value)
+
+
+class CsvWriter:
+    """Write rows as CSV, with a header line."""
+
+    all_values = False
+
+    def __init__(self, stream: TextIO, columns: List[str], header: bool = True):
+        self.writer = csv.writer(stream)
+        if header:
+            self.writer.writerow(columns)
+
+    def write(self, row: List[Any]) -> None:
+        self.writer.writerow([_flat(value) for value in row])
+
+
+class TsvWriter:
+    """Write rows as TSV, tabs and newlines in values are escaped."""
+
+    all_values = False
+
+    def __init__(self, stream: TextIO, columns: List[str], header: bool = True):
+        self.stream = stream
+        if header:
+            self.write(columns)
+
+    @staticmethod
+    def _escape(value: Any) -> str:
+        return (
+            _flat(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    def write(self, row: List[Any]) -> None:
+        self.stream.write("\t".join(self._escape(value) for value in row))
+        self.stream.write("\n")
+
+
+class JsonlWriter:
+    """Write rows as JSON objects, one per line, with all values."""
+
+    all_values = True
+
+    def __init__(self, stream: TextIO, columns: List[str], header: bool = True):
+        # pylint: disable=unused-argument
+        self.stream = stream
+        self.columns = columns
+
+    def write(self, row: List[Any]) -> None:
+        self.stream.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False))
+        self.stream.write("\n")
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "tsv": TsvWriter,
+    "jsonl": JsonlWriter,
+}
+
+
+# =============================================================
+# File exports
+# =============================================================
+
+
+def export_path(directory: str, name: str, extension: str) -> str:
+    """Return a timestamped export file path, from a name safe for file systems."""
+    name = re.sub(r"[^\w.-]+", "_", name).strip("_") or "export"
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(os.path.expanduser(directory or "."), f"{name}-{stamp}.{extension}")
+
+
+@contextmanager
+def atomic_output(path: str) -> Iterator[TextIO]:
+    """Write to a temporary file, moved to path once complete."""
+    part_path = f"{path}.part"
+    try:
+        with open(part_path, "w", encoding="utf-8", newline="") as stream:
+            yield stream
+        os.replace(part_path, path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def _stream_items(
+    items: Iterable[Any],
+    write: Callable[[Any], None],
+    progress: Optional[Callable[[int], None]],
+    should_stop: Optional[Callable[[], bool]],
+) -> int:
+    count = 0
+    for item in items:
+        if should_stop and should_stop():
+            raise ExportCancelled()
+        write(item)
+        count += 1
+        if progress and count % PROGRESS_EVERY == 0:
+            progress(count)
+    return count
+
+
+def write_rows(
+    path: str,
+    columns: List[str],
+    rows: Iterable[List[Any]],
+    output_format: str,
+    progress: Callable[[int], None] = None,
+    should_stop: Callable[[], bool] = None,
+) -> int:
+    """Write rows to a file as they are produced, return the row count.
+
+    Rows should be a generator over a paged search: the next page is only
+    requested once the previous one is written.
+    """
+    with atomic_output(path) as stream:
+        writer = WRITERS[output_format](stream, columns)
+        return _stream_items(rows, writer.write, progress, should_stop)
+
+
+def write_ldif(
+    path: str,
+    pages: Iterable[List[Any]],
+    progress: Callable[[int], None] = None,
+    should_stop: Callable[[], bool] = None,
+) -> int:
+    """Write pages of raw (dn, attrs) entries as LDIF, return the entry count."""
+    entries = (entry for page in pages for entry in page)
+    with atomic_output(path) as stream:
+        writer = ldif.LDIFWriter(stream)
+        return _stream_items(
+            entries, lambda entry: writer.unparse(*entry), progress, should_stop
+        )
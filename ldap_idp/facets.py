@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Facets - Count the values of attributes over the results of a profile
+
+A facet is an attribute (objectClass, gidNumber...), or an RDN type of the
+entry DN written dn.<type> (dn.ou: the OUs an entry is under). Counts are
+made in one pass over the results, cached ones or pages of a search
+requesting the facet attributes only, or no attribute at all ("1.1") when
+all facets come from the DN.
+
+Drilling down on a facet value keeps the entries having it: attribute
+values narrow the search filter, DN values are checked on each entry.
+"""
+
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import ldap.dn
+import ldap.filter
+
+from ldap_idp.config import settings
+from ldap_idp.ldap_backend import SCOPE_SUBTREE
+
+# Prefix of the facets taken from the DN
+DN_PREFIX = "dn."
+
+# A drill down: (facet, value)
+Drill = Tuple[str, str]
+
+
+def profile_facets(rule_entry: Dict[str, Any]) -> List[str]:
+    """Return the facets of a profile, or the default ones."""
+    return list(rule_entry.get("facets") or settings.viewer.facets)
+
+
+def is_dn_facet(facet: str) -> bool:
+    return facet.lower().startswith(DN_PREFIX)
+
+
+def facet_attributes(facets: Sequence[str]) -> List[str]:
+    """Return the attributes to request for facets, "1.1" for none."""
+    attributes: Dict[str, str] = {}
+    for facet in facets:
+        if not is_dn_facet(facet):
+            attributes.setdefault(facet.lower(), facet)
+    return sorted(attributes.values(), key=str.lower) or ["1.1"]
+
+
+def drill_filter(query: str, drills: Sequence[Drill]) -> str:
+    """Return the filter of a query narrowed to the attribute drill downs."""
+    items = [
+        f"({facet}={ldap.filter.escape_filter_chars(str(value))})"
+        for facet, value in drills
+        if not is_dn_facet(facet)
+    ]
+    if not items:
+        return query
+    return f"(&{query}{''.join(items)})"
+
+
+class FacetCounter:
+    """Value counts of facets, over the entries matching drill downs."""
+
+    def __init__(self, facets: Sequence[str], drills: Sequence[Drill] = ()):
+        self.facets = list(facets)
+        self.drills = list(drills)
+        self.counts: Dict[str, Counter] = {facet: Counter() for facet in self.facets}
+        self.total = 0
+        self.seen = 0
+
+        # Lowercase attribute or RDN type -> facets, for one pass per entry
+        wanted = list(dict.fromkeys(self.facets + [facet for facet, _ in self.drills]))
+        self._attributes: Dict[str, List[str]] = {}
+        self._rdn_types: Dict[str, List[str]] = {}
+        self._parents: Dict[str, List[Tuple[str, str]]] = {}
+        for facet in wanted:
+            if is_dn_facet(facet):
+                self._rdn_types.setdefault(facet[len(DN_PREFIX):].lower(), []).append(facet)
+            else:
+                self._attributes.setdefault(facet.lower(), []).append(facet)
+
+    def entry_values(self, result: Dict[str, Any]) -> Dict[str, List[Any]]:
+        """Return the values of each facet for a search result."""
+        values: Dict[str, List[Any]] = {}
+        if self._attributes:
+            for name, items in (result.get("attributes") or {}).items():
+                for facet in self._attributes.get(name.lower(), ()):
+                    values[facet] = items if isinstance(items, list) else [items]
+        if self._rdn_types:
+            for rdn_type, rdn_value in self._dn_values(result["dn"]):
+                for facet in self._rdn_types[rdn_type]:
+                    values.setdefault(facet, []).append(rdn_value)
+        return values
+
+    def _dn_values(self, dn: str) -> List[Tuple[str, str]]:
+        """Return the (type, value) of the wanted RDNs of a DN.
+
+        Entries share a few parents: parent DNs are parsed once, and the
+        first RDN only when its type is wanted.
+        """
+        head, _, parent = dn.partition(",")
+        if not parent or "\\" in head or "+" in head:
+            return self._parse_dn(dn)
+        parent_values = self._parents.get(parent)
+        if parent_values is None:
+            parent_values = self._parents[parent] = self._parse_dn(parent)
+        if head.split("=", 1)[0].strip().lower() in self._rdn_types:
+            return self._parse_dn(head) + parent_values
+        return parent_values
+
+    def _parse_dn(self, dn: str) -> List[Tuple[str, str]]:
+        try:
+            rdns = ldap.dn.str2dn(dn)
+        except ldap.DECODING_ERROR:
+            return []
+        return [
+            (rdn_type.lower(), rdn_value)
+            for rdn in rdns
+            for rdn_type, rdn_value, _flags in rdn
+            if rdn_type.lower() in self._rdn_types
+        ]
+
+    def add(self, results: Sequence[Dict[str, Any]]) -> None:
+        """Count the values of results matching the drill downs."""
+        counts = self.counts
+        drills = self.drills
+        for result in results:
+            self.seen += 1
+            values = self.entry_values(result)
+            if drills and not all(value in values.get(facet, ()) for facet, value in drills):
+                continue
+            self.total += 1
+            for facet, items in values.items():
+                count = counts.get(facet)
+                if count is None:
+                    continue
+                if len(items) == 1:
+                    count[items[0]] += 1
+                else:
+                    # An entry counts once per value, under an OU nested twice too
+                    count.update(set(items))
+
+    def top(self, facet: str, limit: int = 0) -> List[Tuple[Any, int]]:
+        """Return (value, count) of a facet, most common first."""
+        return self.counts[facet].most_common(limit or None)
+
+
+def count_facets(
+    results: Sequence[Dict[str, Any]], facets: Sequence[str], drills: Sequence[Drill] = ()
+) -> FacetCounter:
+    """Count facets over results held in memory."""
+    counter = FacetCounter(facets, drills)
+    counter.add(results)
+    return counter
+
+
+def scan_facets(
+    ldap_connection,
+    query: str,
+    facets: Sequence[str],
+    drills: Sequence[Drill] = (),
+    page_size: int = 500,
+    progress: Optional[Callable[[int], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> Optional[FacetCounter]:
+    """Count facets with a paged search, return None if stopped."""
+    counter = FacetCounter(facets, drills)
+    for page in ldap_connection.iter_search(
+        scope=SCOPE_SUBTREE,
+        filter_str=drill_filter(query, drills),
+        attributes=facet_attributes(counter.facets + [facet for facet, _ in counter.drills]),
+        page_size=page_size,
+    ):
+        if should_stop and should_stop():
+            return None
+        counter.add(page)
+        if progress:
+            progress(counter.seen)
+    return counter
@@ -4,10 +4,18 @@ LDAP Backend - All LDAP related functions and connection management
 """
 
 import logging
+import os
+import re
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 import ldap
+import ldap.dn
+import ldap.schema
+from ldap.controls import SimplePagedResultsControl
+
+from ldap_idp.metrics import METRICS, MeteredLDAPObject
 
 # LDAP constants
 SCOPE_BASE = 0
@@ -16,6 +24,18 @@ SCOPE_SUBTREE = 2
 
 logger = logging.getLogger(__name__)
 
+# Parsed subschema per server URI, shared by all connections of the process
+_SCHEMA_CACHE: Dict[str, Any] = {}
+
+# Attribute description of a ranged value retrieval, e.g. member;range=0-1499
+RANGE_OPTION_RE = re.compile(r"^(?P<attr>.+);range=(?P<low>\d+)-(?P<high>\d+|\*)$", re.IGNORECASE)
+
+# Margin taken on change watermarks for clock skew with the server, in seconds
+WATERMARK_SKEW = 300
+
+# Operational attributes telling whether an entry has children
+SUBORDINATE_ATTRIBUTES = ["hasSubordinates", "numSubordinates"]
+
 
 # =============================================================
 # LDAP models
@@ -30,6 +50,15 @@ class LDAPConfig:
     bind_dn: str
     bind_password: str
     base_dn: str = ""
+    # Unix socket of the shared cache daemon, direct connection if empty
+    cache_socket: str = ""
+    # Read-only snapshot file served instead of the server, if set
+    snapshot_path: str = ""
+    # Record the LDAP traffic to this file, {pid} is replaced by the process id
+    record_path: str = ""
+    # Serve a recording instead of the server, sleeping latency x recorded times
+    replay_path: str = ""
+    replay_latency: float = 0.0
 
 
 # =============================================================
@@ -47,6 +76,131 @@ def has_children(entry: Dict[str, Any]) -> bool:
     return True
 
 
+def pop_subordinates(attributes: Dict[str, List[str]]) -> Optional[bool]:
+    """Remove the subordinate attributes of an entry, return whether it has children.
+
+    Returns None when the server sent neither of them.
+    """
+    flag = None
+    for name in list(attributes):
+        lowered = name.lower()
+        if lowered not in ("hassubordinates", "numsubordinates"):
+            continue
+        values = attributes.pop(name)
+        if lowered == "hassubordinates" and values:
+            flag = bool(flag) or values[0].upper() == "TRUE"
+        elif values and values[0].isdigit():
+            flag = bool(flag) or int(values[0]) > 0
+    return flag
+
+
+def get_parent_dn(dn: str) -> str:
+    """Return the DN of the parent entry, empty for a top entry."""
+    return ldap.dn.dn2str(ldap.dn.str2dn(dn)[1:])
+
+
+def parse_range_option(attr_name: str):
+    """Split a ranged attribute name into (attribute, low, high).
+
+    high is None for the last range ("*"); low and high are None when the
+    name carries no range option.
+    """
+    match = RANGE_OPTION_RE.match(attr_name)
+    if not match:
+        return attr_name, None, None
+    high = match.group("high")
+    return match.group("attr"), int(match.group("low")), None if high == "*" else int(high)
+
+
+def generalized_time(timestamp: float = None) -> str:
+    """Return a timestamp as LDAP generalized time, now if omitted."""
+    if timestamp is None:
+        timestamp = time.time()
+    return time.strftime("%Y%m%d%H%M%SZ", time.gmtime(timestamp))
+
+
+def error_text(err: Exception) -> str:
+    """Return a one line description of an LDAP error."""
+    info = err.args[0] if err.args and isinstance(err.args[0], dict) else {}
+    text = info.get("desc") or str(err)
+    if info.get("info"):
+        text = f"{text}: {info['info']}"
+    return text
+
+
+def entry_modlist(
+    old: Dict[str, List[Any]], new: Dict[str, List[Any]], partial=()
+) -> List[tuple]:
+    """Return the smallest modify modlist turning old attributes into new ones.
+
+    Values are deleted and added one by one, so large multi-valued attributes
+    are never rewritten. Attributes in partial were not read completely:
+    they are never deleted as a whole.
+    """
+    partial = {attr.lower() for attr in partial}
+    old_names = {name.lower(): name for name in old}
+    new_names = {name.lower(): name for name in new}
+
+    modlist = []
+    for key in sorted(set(old_names) | set(new_names)):
+        old_values = old.get(old_names.get(key), [])
+        new_values = new.get(new_names.get(key), [])
+        name = new_names.get(key) or old_names[key]
+
+        old_set, new_set = set(old_values), set(new_values)
+        deleted = [value for value in old_values if value not in new_set]
+        added = [value for value in new_values if value not in old_set]
+        if deleted and not new_values and key not in partial:
+            modlist.append((ldap.MOD_DELETE, name, None))
+        elif deleted:
+            modlist.append((ldap.MOD_DELETE, name, deleted))
+        if added:
+            modlist.append((ldap.MOD_ADD, name, added))
+    return modlist
+
+
+def apply_modlist(attributes: Dict[str, List[Any]], modlist: List[tuple]) -> Dict[str, List[Any]]:
+    """Return a copy of attributes with a modify modlist applied, as the server would."""
+    result = {name: list(values) for name, values in attributes.items()}
+    names = {name.lower(): name for name in result}
+
+    for mod_op, attr, values in modlist:
+        if isinstance(values, (str, bytes)):
+            values = [values]
+        values = values or []
+        name = names.get(attr.lower(), attr)
+        current = result.get(name, [])
+
+        if mod_op == ldap.MOD_ADD:
+            current = current + [value for value in values if value not in current]
+        elif mod_op == ldap.MOD_DELETE:
+            current = [value for value in current if values and value not in values]
+        else:
+            current = list(values)
+
+        if current:
+            result[name] = current
+            names[attr.lower()] = name
+        else:
+            result.pop(name, None)
+            names.pop(attr.lower(), None)
+    return result
+
+
+def encode_modlist(modlist: List[tuple]) -> List[tuple]:
+    """Encode the string values of a modlist for python-ldap."""
+    return [
+        (
+            mod_op,
+            attr,
+            [value.encode("utf-8") if isinstance(value, str) else value for value in values]
+            if values is not None
+            else None,
+        )
+        for mod_op, attr, values in modlist
+    ]
+
+
 def get_display_name(entry: Dict[str, Any]) -> str:
     """Get display name from LDAP entry"""
     dn = entry["dn"]
@@ -175,10 +329,40 @@ class LDAPConnection:
         
         return ""
 
+    def _open_transport(self):
+        """Return the python-ldap like object carrying LDAP operations."""
+        if self.config.replay_path:
+            # pylint: disable=import-outside-toplevel
+            from ldap_idp.ldap_replay import ReplayLDAPObject
+
+            logging.info(f"Replaying LDAP recording: {self.config.replay_path}")
+            return ReplayLDAPObject(self.config.replay_path, latency=self.config.replay_latency)
+        if self.config.snapshot_path:
+            # pylint: disable=import-outside-toplevel
+            from ldap_idp.ldap_snapshot import SnapshotLDAPObject
+
+            logging.info(f"Using directory snapshot: {self.config.snapshot_path}")
+            return SnapshotLDAPObject(self.config.snapshot_path)
+        if self.config.cache_socket:
+            # pylint: disable=import-outside-toplevel
+            from ldap_idp.cache_daemon import CacheDaemonClient
+
+            logging.info(f"Using directory cache daemon: {self.config.cache_socket}")
+            return CacheDaemonClient(self.config.cache_socket, self.config.uri)
+        return ldap.initialize(self.config.uri)
+
     def connect(self) -> None:
         """Establish LDAP connection"""
         try:
-            self.connection = ldap.initialize(self.config.uri)
+            self.connection = self._open_transport()
+            if self.config.record_path:
+                # pylint: disable=import-outside-toplevel
+                from ldap_idp.ldap_replay import RecordingLDAPObject
+
+                path = self.config.record_path.format(pid=os.getpid())
+                logging.info(f"Recording LDAP traffic to {path}")
+                self.connection = RecordingLDAPObject(self.connection, path, self.config.uri)
+            self.connection = MeteredLDAPObject(self.connection)
             self.connection.simple_bind_s(
                 self.config.bind_dn, self.config.bind_password
             )
@@ -216,6 +400,84 @@ class LDAPConnection:
             logging.error(f"LDAP search failed {type(e)}: {e} with: base_dn={base_dn}, scope={scope}, filter_str={filter_str}, attributes={attributes}")
             return []
 
+    def iter_search(
+        self,
+        base_dn: str = None,
+        scope: int = SCOPE_SUBTREE,
+        filter_str: str = "(objectClass=*)",
+        attributes: Optional[List[str]] = None,
+        page_size: int = 500,
+        raw: bool = False,
+    ) -> Iterator[List[Any]]:
+        """Search LDAP directory page by page, with the paged results control.
+
+        Yields lists of entries, in the same format as search(), or raw
+        python-ldap (dn, attrs) tuples if raw is set. Only one page is held
+        in memory at a time.
+        """
+        if not self.connection:
+            raise RuntimeError("LDAP connection not established")
+
+        base_dn = base_dn or self.base_dn
+
+        def convert(results):
+            if raw:
+                return [(dn, attrs) for dn, attrs in results if dn is not None]
+            return [
+                {"dn": dn, "attributes": self._decode_attributes(attrs)}
+                for dn, attrs in results
+                if dn is not None
+            ]
+
+        # Snapshot transports answer in one go
+        if not hasattr(self.connection, "search_ext"):
+            yield convert(self.connection.search_s(base_dn, scope, filter_str, attributes))
+            return
+
+        control = SimplePagedResultsControl(True, size=page_size, cookie="")
+        while True:
+            msgid = self.connection.search_ext(
+                base_dn, scope, filter_str, attributes, serverctrls=[control]
+            )
+            _rtype, rdata, _rmsgid, serverctrls = self.connection.result3(msgid)
+            yield convert(rdata)
+
+            cookies = [
+                ctrl.cookie
+                for ctrl in serverctrls
+                if ctrl.controlType == SimplePagedResultsControl.controlType
+            ]
+            if not cookies or not cookies[0]:
+                break
+            control.cookie = cookies[0]
+
+    def get_schema(self):
+        """Return the server subschema, fetched once per URI and process.
+
+        Forked session workers inherit the parsed schema from their parent,
+        so only the preloading process pays for the round trips.
+        """
+        schema = _SCHEMA_CACHE.get(self.config.uri)
+        METRICS.hit("cache.schema", schema is not None)
+        if schema is not None:
+            return schema
+
+        if not self.connection:
+            raise RuntimeError("LDAP connection not established")
+
+        subschema_dn = self.connection.search_subschemasubentry_s(self.base_dn or "")
+        if not subschema_dn:
+            logging.warning(f"No subschema subentry advertised by {self.config.uri}")
+            return None
+
+        entry = self.connection.read_subschemasubentry_s(
+            subschema_dn, attrs=ldap.schema.SCHEMA_ATTRS
+        )
+        schema = ldap.schema.SubSchema(entry or {})
+        _SCHEMA_CACHE[self.config.uri] = schema
+        logging.info(f"Loaded LDAP schema from {subschema_dn}")
+        return schema
+
     def _decode_attributes(
         self, attrs: Dict[bytes, List[bytes]]
     ) -> Dict[str, List[str]]:
@@ -516,8 +778,12 @@ class LDAPConnectionImproved(LDAPConnection):
         base_dn = self.base_dn
         logger.info(f"Base DN: {base_dn}")
 
+        # Changes made while the tree loads must show up on the next refresh
+        watermark = generalized_time(time.time() - WATERMARK_SKEW)
+
         # Build tree structure recursively
         tree_data = {
+            "watermark": watermark,
             "root": {
                 "label": base_dn,
                 "dn": base_dn,
@@ -553,8 +819,15 @@ class LDAPConnectionImproved(LDAPConnection):
             return []
 
         try:
-            # Search for entries at current level
-            entries = self.search(parent_dn, scope=SCOPE_ONELEVEL)
+            # Search for entries at current level, paged for huge containers,
+            # with the attributes telling which of them have children
+            entries = [
+                entry
+                for page in self.iter_search(
+                    parent_dn, scope=SCOPE_ONELEVEL, attributes=["*"] + SUBORDINATE_ATTRIBUTES
+                )
+                for entry in page
+            ]
             logger.debug(
                 f"Found {len(entries)} entries at depth {current_depth} for {parent_dn}"
             )
@@ -565,44 +838,9 @@ class LDAPConnectionImproved(LDAPConnection):
 
         children = []
         for entry in entries:
-            # Apply filters to the entry
-            filtered_entry = apply_entry_filters(entry, self.filter_config)
-
-            dn = filtered_entry["dn"]
-            attributes = filtered_entry["attributes"]
-
-            # Get display name
-            display_name = get_display_name(filtered_entry)
-            rdn = get_rdn(filtered_entry)
-            icon = get_icon(entry)
-            # assert False, filtered_entry
-
-            if display_mode == "full":
-                label = f"{icon} {rdn}"
-            elif display_mode == "simple":
-                label = f"{icon} {display_name}"
-            else:
-                raise ValueError(f"Invalid display mode: {display_mode}")
-
-            # Check if entry has children by searching
-            try:
-                child_entries = self.search(dn, scope=SCOPE_ONELEVEL)
-                has_children_flag = len(child_entries) > 0
-                logger.debug(f"Entry {dn} has {len(child_entries)} children")
-            except Exception as e:
-                logger.debug(f"Could not check children for {dn}: {e}")
-                has_children_flag = False
-
-            # Create node data
-            node_data = {
-                "label": label,
-                "rdn": rdn,
-                "dn": dn,
-                "icon": icon,
-                "attributes": attributes,
-                "has_children": has_children_flag,
-                "children": [],
-            }
+            node_data = self._make_node_data(entry, display_mode=display_mode)
+            dn = node_data["dn"]
+            has_children_flag = node_data["has_children"]
 
             # Recursively load children if this entry has children and we haven't reached max depth
             if has_children_flag and current_depth < max_depth - 1:
@@ -618,19 +856,88 @@ class LDAPConnectionImproved(LDAPConnection):
 
         return children
 
+    def _make_node_data(self, entry: Dict[str, Any], display_mode="simple"):
+        """Return the tree node data of an entry, without its children."""
+        # Servers sending hasSubordinates/numSubordinates save a search per entry
+        attributes = dict(entry["attributes"])
+        has_children_flag = pop_subordinates(attributes)
+        entry = dict(entry, attributes=attributes)
 
+        # Apply filters to the entry
+        filtered_entry = apply_entry_filters(entry, self.filter_config)
 
+        dn = filtered_entry["dn"]
+        attributes = filtered_entry["attributes"]
 
+        # Get display name
+        display_name = get_display_name(filtered_entry)
+        rdn = get_rdn(filtered_entry)
+        icon = get_icon(entry)
 
+        if display_mode == "full":
+            label = f"{icon} {rdn}"
+        elif display_mode == "simple":
+            label = f"{icon} {display_name}"
+        else:
+            raise ValueError(f"Invalid display mode: {display_mode}")
 
+        # Otherwise check if entry has children by searching
+        if has_children_flag is None:
+            try:
+                has_children_flag = self._has_children(dn)
+            except Exception as e:
+                logger.debug(f"Could not check children for {dn}: {e}")
+                has_children_flag = False
 
+        return {
+            "label": label,
+            "rdn": rdn,
+            "dn": dn,
+            "icon": icon,
+            "attributes": attributes,
+            "has_children": has_children_flag,
+            "children": [],
+        }
 
+    def get_changes_since(self, watermark: str, display_mode="simple"):
+        """Return the node data of entries modified since a watermark.
 
-
-
-
-
-
+        Returns the changed entries and the watermark of the next refresh,
+        the newest modifyTimestamp seen (or the same one if nothing changed).
+        Searches page by page, and raises on LDAP errors.
+        """
+        changes = []
+        for page in self.iter_search(
+            self.base_dn,
+            scope=SCOPE_SUBTREE,
+            filter_str=f"(modifyTimestamp>={watermark})",
+            attributes=["*", "modifyTimestamp"] + SUBORDINATE_ATTRIBUTES,
+        ):
+            for entry in page:
+                stamps = entry["attributes"].pop("modifyTimestamp", None) or [watermark]
+                watermark = max([watermark] + stamps)
+                changes.append(self._make_node_data(entry, display_mode=display_mode))
+
+        logger.info(f"Found {len(changes)} entries changed, next watermark: {watermark}")
+        return changes, watermark
+
+    def get_children_dns(self, dn: str) -> List[str]:
+        """Return the DNs of the direct children of an entry.
+
+        Searches page by page, and raises on LDAP errors: an empty list
+        always means the entry has no children.
+        """
+        return [
+            entry["dn"]
+            for page in self.iter_search(dn, scope=SCOPE_ONELEVEL, attributes=["1.1"])
+            for entry in page
+        ]
+
+    def _has_children(self, dn: str) -> bool:
+        """Check if an entry has children, without fetching their attributes."""
+        child_entries = self.search(dn, scope=SCOPE_ONELEVEL, attributes=["1.1"])
+        logger.debug(f"Entry {dn} has {len(child_entries)} children")
+        return len(child_entries) > 0
 
     def get_ldap_entry(self, dn: str, sort=True):
         """Get one LDAP entry by DN."""
@@ -643,6 +950,9 @@ class LDAPConnectionImproved(LDAPConnection):
             return None
         entry = ret[0]
 
+        # Servers limiting values per attribute send the first range only
+        ranges = self._collapse_ranges(entry)
+
         # Apply filters to the entry
         filtered_entry = apply_entry_filters(entry, self.filter_config)
         logger.warning(f"Filtered entry: {filtered_entry} FROM {self.filter_config}")
@@ -655,4 +965,67 @@ class LDAPConnectionImproved(LDAPConnection):
                 "dn": filtered_entry["dn"],
                 "attributes": sorted_attributes,
             }
+        if ranges:
+            filtered_entry["ranges"] = ranges
         return filtered_entry
+
+    @staticmethod
+    def _collapse_ranges(entry: Dict[str, Any]) -> Dict[str, int]:
+        """Rename ranged attributes of an entry to their plain name, in place.
+
+        Returns the start of the next range of attributes with values left
+        on the server, by attribute name.
+        """
+        ranges = {}
+        attributes = {}
+        for name, values in entry["attributes"].items():
+            attr, low, high = parse_range_option(name)
+            if low is None:
+                attributes.setdefault(name, values)
+                continue
+            attributes[attr] = values
+            if high is not None:
+                ranges[attr] = high + 1
+        entry["attributes"] = attributes
+        return ranges
+
+    def modify_entry(self, dn: str, modlist: List[tuple]) -> None:
+        """Apply a modify modlist of string values, blocking until done.
+
+        The request is sent asynchronously and its result awaited, so a
+        worker thread can wait for it while the UI keeps running.
+        """
+        if not self.connection:
+            raise RuntimeError("LDAP connection not established")
+        if not hasattr(self.connection, "modify_s"):
+            raise ldap.UNWILLING_TO_PERFORM({"desc": "Directory snapshots are read-only"})
+
+        encoded = encode_modlist(modlist)
+        if hasattr(self.connection, "modify_ext"):
+            msgid = self.connection.modify_ext(dn, encoded)
+            self.connection.result3(msgid)
+        else:
+            # The cache daemon applies it and patches its caches
+            self.connection.modify_s(dn, encoded)
+        logger.info(f"Modified {dn}: {len(modlist)} modifications")
+
+    def get_attribute_range(self, dn: str, attribute: str, start: int):
+        """Fetch the values of an attribute from start, as the server pages them.
+
+        Returns the values and the start of the next range, None when they
+        were the last ones. Servers without range retrieval send all values.
+        """
+        results = self.search(
+            dn, scope=SCOPE_BASE, attributes=[f"{attribute};range={start}-*"]
+        )
+        if not results:
+            return [], None
+
+        for name, values in results[0]["attributes"].items():
+            attr, low, high = parse_range_option(name)
+            if attr.lower() != attribute.lower():
+                continue
+            if low is None or high is None:
+                return values, None
+            return values, high + 1
+        return [], None
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+LDAP Cache - Persistent local cache for warm TUI startup
+
+Entries, trees and viewer query results are kept in a SQLite file of the
+user cache directory, one file per URI, bind DN and base DN. The UI renders
+from it right away, then revalidates in the background by comparing the
+modifyTimestamp/entryCSN stamps of the cached entries with the server's.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import ldap
+
+from ldap_idp.config import settings
+from ldap_idp.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+SCOPE_BASE = 0
+SCOPE_ONELEVEL = 1
+SCOPE_SUBTREE = 2
+
+# Operational attributes telling whether an entry changed
+STAMP_ATTRIBUTES = ["modifyTimestamp", "entryCSN"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    stamps TEXT NOT NULL,
+    fetched REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+)
+"""
+
+
+def default_cache_dir() -> Path:
+    """Return the ldapcp directory of the user cache dir."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(Path.home(), ".cache")
+    return Path(base) / "ldapcp"
+
+
+def entry_stamp(attributes: Dict[str, Any]) -> str:
+    """Return the change stamp of decoded entry attributes."""
+    lowered = {name.lower(): values for name, values in attributes.items()}
+    return "|".join(
+        ",".join(lowered.get(name.lower(), [])) for name in STAMP_ATTRIBUTES
+    )
+
+
+def fetch_stamps(
+    ldap_connection, base_dn: str = None, scope: int = SCOPE_SUBTREE,
+    filter_str: str = "(objectClass=*)",
+) -> Dict[str, str]:
+    """Return the change stamp of every matching entry, keyed by lowercase DN.
+
+    The search is paged. A missing base has no stamps, other LDAP errors
+    are raised: an empty answer would look like a change.
+    """
+    stamps = {}
+    try:
+        for page in ldap_connection.iter_search(
+            base_dn, scope=scope, filter_str=filter_str, attributes=STAMP_ATTRIBUTES
+        ):
+            for result in page:
+                stamps[result["dn"].lower()] = entry_stamp(result["attributes"])
+    except ldap.NO_SUCH_OBJECT:
+        return {}
+    return stamps
+
+
+def fetch_tree_stamps(ldap_connection, tree_data: Dict[str, Any]) -> Dict[str, str]:
+    """Return the change stamps of the entries of the loaded tree levels.
+
+    One level search per container whose children the tree holds, so the
+    deeper levels of the directory are never read.
+    """
+    stamps = {}
+    nodes = [tree_data["root"]]
+    while nodes:
+        node = nodes.pop()
+        stamps.update(fetch_stamps(ldap_connection, node["dn"], scope=SCOPE_ONELEVEL))
+        nodes.extend(child for child in node.get("children") or () if child.get("children"))
+    return stamps
+
+
+def stamps_changed(cached: Optional[Dict[str, str]], fresh: Dict[str, str]) -> bool:
+    """Tell whether cached data must be refetched.
+
+    Servers hiding both stamp attributes give no way to tell, so their data
+    is always considered changed.
+    """
+    if cached is None or cached != fresh:
+        return True
+    return not any(stamp.strip("|") for stamp in fresh.values())
+
+
+# =============================================================
+# Cache store
+# =============================================================
+
+
+def restrict_dir(path: Path) -> None:
+    """Make a cache directory private, unless it is shared (sticky, like /tmp) or not ours."""
+    info = path.stat()
+    if info.st_uid != os.getuid() or info.st_mode & stat.S_ISVTX:
+        return
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+
+
+class PersistentCache:
+    """SQLite store of cached LDAP data for one URI, bind DN and base DN."""
+
+    def __init__(self, uri: str, bind_dn: str, base_dn: str, cache_dir: str = None):
+        cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        restrict_dir(cache_dir)
+
+        ident = "\0".join([uri, bind_dn.lower(), base_dn.lower()])
+        name = hashlib.sha256(ident.encode("utf-8")).hexdigest()[:24]
+        self.path = cache_dir / f"{name}.sqlite"
+
+        self.lock = threading.Lock()
+        # The database, -wal and -shm files hold directory data: owner only
+        old_umask = os.umask(0o077)
+        try:
+            for path in (self.path, Path(f"{self.path}-wal"), Path(f"{self.path}-shm")):
+                if path.exists():
+                    os.chmod(path, 0o600)
+            self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+            with self.lock:
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute(SCHEMA)
+                self.db.commit()
+        finally:
+            os.umask(old_umask)
+        logger.info(f"Persistent cache opened: {self.path}")
+
+    @classmethod
+    def from_settings(cls, ldap_config) -> Optional["PersistentCache"]:
+        """Return the cache of an LDAPConfig, or None if caching is disabled."""
+        if not settings.cache.persistent:
+            return None
+        try:
+            return cls(
+                ldap_config.uri,
+                ldap_config.bind_dn,
+                ldap_config.base_dn or "",
+                cache_dir=settings.cache.persistent_dir or None,
+            )
+        except (OSError, sqlite3.Error) as err:
+            logger.error(f"Persistent cache disabled: {err}")
+            return None
+
+    def get(self, kind: str, key: Any) -> Optional[Tuple[Any, Dict[str, str]]]:
+        """Return the cached (data, stamps) of an item, None if missing."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data, stamps FROM items WHERE kind = ? AND key = ?",
+                (kind, json.dumps(key)),
+            ).fetchone()
+        METRICS.hit(f"cache.persistent.{kind}", row is not None)
+        if row is None:
+            return None
+        return json.loads(row[0]), json.loads(row[1])
+
+    def put(self, kind: str, key: Any, data: Any, stamps: Dict[str, str]) -> None:
+        """Store an item together with the stamps it was fetched at."""
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO items (kind, key, data, stamps, fetched) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(key), json.dumps(data), json.dumps(stamps), time.time()),
+            )
+            self.db.commit()
+
+    def delete(self, kind: str, key: Any) -> None:
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM items WHERE kind = ? AND key = ?", (kind, json.dumps(key))
+            )
+            self.db.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
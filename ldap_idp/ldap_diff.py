@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+LDAP Diff - Compare two directory states in bounded memory
+
+Each side (a server, an LDIF file or an ldapcp-snapshot file) is streamed
+once and sorted by DN with an external merge sort: sorted runs are spooled
+to temporary files and merged. Entries carry a hash of their content, so
+the merge join only compares the attributes of entries whose hashes
+differ. The differences are written as an LDIF change set: adds parents
+first, deletes children first.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import base64
+import hashlib
+import heapq
+import json
+import logging
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import click
+import ldap
+import ldap.dn
+import ldapurl
+
+from ldap_idp.config import settings
+from ldap_idp.ldap_backend import SCOPE_SUBTREE, entry_modlist
+from ldap_idp.ldif_stream import LDIFChangeWriter, iter_ldif_records
+
+logger = logging.getLogger(__name__)
+
+# Operational attributes differing between replicas and exports of the same data
+DEFAULT_IGNORED_ATTRIBUTES = [
+    "contextCSN",
+    "createTimestamp",
+    "creatorsName",
+    "entryCSN",
+    "entryDN",
+    "entryUUID",
+    "hasSubordinates",
+    "modifiersName",
+    "modifyTimestamp",
+    "structuralObjectClass",
+    "subschemaSubentry",
+]
+
+# Entries held in memory per sorted run
+RUN_SIZE = 50000
+
+Entry = Tuple[str, Dict[str, List[bytes]]]
+
+
+# =============================================================
+# Sorting
+# =============================================================
+
+
+def dn_sort_key(dn: str) -> str:
+    """Return a DN key sorting parents right before their subtree."""
+    try:
+        rdns = [
+            "+".join(sorted(f"{attr}={value}" for attr, value, _ in rdn))
+            for rdn in ldap.dn.str2dn(dn)
+        ]
+    except ldap.DECODING_ERROR:
+        rdns = [part.strip() for part in dn.split(",")]
+    return "\0".join(reversed(rdns)).lower()
+
+
+def entry_hash(attributes: Dict[str, List[bytes]]) -> str:
+    """Return a hash of attributes, insensitive to name case and value order."""
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(attributes, key=str.lower):
+        digest.update(name.lower().encode("utf-8") + b"\0")
+        for value in sorted(attributes[name]):
+            digest.update(len(value).to_bytes(4, "little") + value)
+    return digest.hexdigest()
+
+
+class ExternalSorter:
+    """Sort (key, item) pairs of any number, with a bounded number in memory."""
+
+    def __init__(self, run_size: int = RUN_SIZE, reverse: bool = False):
+        self.run_size = run_size
+        self.reverse = reverse
+        self.buffer: List[Tuple[str, Any]] = []
+        self.runs = []
+        self.count = 0
+
+    def add(self, key: str, item: Any) -> None:
+        self.buffer.append((key, item))
+        self.count += 1
+        if len(self.buffer) >= self.run_size:
+            self._spool()
+
+    def _spool(self) -> None:
+        self.buffer.sort(key=lambda pair: pair[0], reverse=self.reverse)
+        run = tempfile.TemporaryFile("w+", encoding="utf-8")
+        for pair in self.buffer:
+            run.write(json.dumps(pair))
+            run.write("\n")
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = []
+
+    @staticmethod
+    def _read_run(run) -> Iterator[Tuple[str, Any]]:
+        for line in run:
+            yield tuple(json.loads(line))
+        run.close()
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        self.buffer.sort(key=lambda pair: pair[0], reverse=self.reverse)
+        sources = [self._read_run(run) for run in self.runs] + [iter(self.buffer)]
+        return heapq.merge(*sources, key=lambda pair: pair[0], reverse=self.reverse)
+
+
+def _encode(attributes: Dict[str, List[bytes]]) -> Dict[str, List[str]]:
+    return {
+        name: [base64.b64encode(value).decode("ascii") for value in values]
+        for name, values in attributes.items()
+    }
+
+
+def _decode(attributes: Dict[str, List[str]]) -> Dict[str, List[bytes]]:
+    return {
+        name: [base64.b64decode(value) for value in values]
+        for name, values in attributes.items()
+    }
+
+
+def sort_entries(entries: Iterator[Entry], ignored=(), run_size: int = RUN_SIZE) -> ExternalSorter:
+    """Sort entries by DN, keeping their hash and attributes without ignored ones."""
+    ignored = {attr.lower() for attr in ignored}
+    sorter = ExternalSorter(run_size)
+    for dn, attributes in entries:
+        attributes = {
+            name: values for name, values in attributes.items()
+            if name.lower() not in ignored
+        }
+        sorter.add(dn_sort_key(dn), [dn, entry_hash(attributes), _encode(attributes)])
+    return sorter
+
+
+# =============================================================
+# Sources
+# =============================================================
+
+
+def iter_ldif_entries(path: str) -> Iterator[Entry]:
+    """Yield the entries of an LDIF export."""
+    with open(path, encoding="utf-8") as stream:
+        for record in iter_ldif_records(stream):
+            if record.changetype == "add":
+                yield record.dn, dict(record.modlist)
+
+
+def iter_snapshot_entries(path: str) -> Iterator[Entry]:
+    """Yield the entries of an ldapcp-snapshot file."""
+    # pylint: disable=import-outside-toplevel
+    from ldap_idp.ldap_snapshot import Snapshot
+
+    snapshot = Snapshot(path)
+    try:
+        for idx in range(snapshot.count):
+            yield snapshot.dn(idx), snapshot.attributes(idx)
+    finally:
+        snapshot.close()
+
+
+def iter_server_entries(ldap_connection, base_dn: str = None, page_size: int = 500) -> Iterator[Entry]:
+    """Yield the entries of a server, page by page."""
+    for page in ldap_connection.iter_search(
+        base_dn=base_dn, scope=SCOPE_SUBTREE, attributes=["*"], page_size=page_size, raw=True
+    ):
+        yield from page
+
+
+def iter_source_entries(source: str, base_dn: str = None, ldap_connection=None) -> Iterator[Entry]:
+    """Yield the entries of a source: "live", an LDAP URL, an LDIF or a snapshot file.
+
+    Servers are bound with the authldap credentials; the DN of an LDAP URL
+    is its search base. "live" uses ldap_connection if given.
+    """
+    if source == "live" and ldap_connection is not None:
+        yield from iter_server_entries(ldap_connection, base_dn)
+    elif source == "live" or ldapurl.isLDAPUrl(source):
+        # pylint: disable=import-outside-toplevel
+        from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+
+        uri = settings.authldap.uri
+        if source != "live":
+            url = ldapurl.LDAPUrl(source)
+            uri = f"{url.urlscheme}://{url.hostport}"
+            base_dn = base_dn or url.dn or None
+        config = LDAPConfig(
+            uri=uri,
+            bind_dn=settings.authldap.bind_dn,
+            bind_password=settings.authldap.bind_pass,
+            base_dn=settings.authldap.base_dn,
+        )
+        ldap_connection = LDAPConnectionImproved(config, base_dn=base_dn)
+        ldap_connection.connect()
+        try:
+            yield from iter_server_entries(ldap_connection)
+        finally:
+            ldap_connection.disconnect()
+    elif source.lower().endswith(".ldif"):
+        yield from iter_ldif_entries(source)
+    else:
+        yield from iter_snapshot_entries(source)
+
+
+# =============================================================
+# Diff
+# =============================================================
+
+
+class DirectoryDiff:
+    """Merge join of two DN-sorted sides, yielding their differences.
+
+    Changes are ("add", dn, attributes), ("modify", dn, modlist) and
+    ("delete", dn, None), adds and modifies in DN order, then deletes in
+    reverse DN order.
+    """
+
+    def __init__(self, ignored=DEFAULT_IGNORED_ATTRIBUTES, run_size: int = RUN_SIZE):
+        self.ignored = list(ignored)
+        self.run_size = run_size
+        self.stats = {
+            "old": 0,
+            "new": 0,
+            "unchanged": 0,
+            "add": 0,
+            "modify": 0,
+            "delete": 0,
+            "elapsed": 0.0,
+        }
+
+    def diff(self, old_entries: Iterator[Entry], new_entries: Iterator[Entry]) -> Iterator[tuple]:
+        start = time.monotonic()
+        old = sort_entries(old_entries, self.ignored, self.run_size)
+        new = sort_entries(new_entries, self.ignored, self.run_size)
+        self.stats["old"], self.stats["new"] = old.count, new.count
+        deletes = ExternalSorter(self.run_size, reverse=True)
+
+        old_iter, new_iter = iter(old), iter(new)
+        old_item, new_item = next(old_iter, None), next(new_iter, None)
+        while old_item is not None or new_item is not None:
+            if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+                deletes.add(old_item[0], old_item[1][0])
+                old_item = next(old_iter, None)
+                continue
+
+            if old_item is None or new_item[0] < old_item[0]:
+                dn, _hash, attributes = new_item[1]
+                self.stats["add"] += 1
+                yield "add", dn, _decode(attributes)
+                new_item = next(new_iter, None)
+                continue
+
+            # Same DN: compare attributes only if the contents differ
+            _old_dn, old_hash, old_attributes = old_item[1]
+            dn, new_hash, new_attributes = new_item[1]
+            if old_hash == new_hash:
+                self.stats["unchanged"] += 1
+            else:
+                modlist = self._modlist(_decode(old_attributes), _decode(new_attributes))
+                if modlist:
+                    self.stats["modify"] += 1
+                    yield "modify", dn, modlist
+                else:
+                    self.stats["unchanged"] += 1
+            old_item, new_item = next(old_iter, None), next(new_iter, None)
+
+        for _key, dn in deletes:
+            self.stats["delete"] += 1
+            yield "delete", dn, None
+        self.stats["elapsed"] = time.monotonic() - start
+
+    @staticmethod
+    def _modlist(old: Dict[str, List[bytes]], new: Dict[str, List[bytes]]) -> List[tuple]:
+        # Names differing in case only are the same attribute
+        names = {name.lower(): name for name in new}
+        old = {names.get(name.lower(), name): values for name, values in old.items()}
+        return entry_modlist(old, new)
+
+
+def write_changes(changes: Iterator[tuple], stream, on_change: Callable = None) -> None:
+    """Write diff changes as an LDIF change set."""
+    writer = LDIFChangeWriter(stream)
+    for kind, dn, payload in changes:
+        if kind == "add":
+            writer.add(dn, payload)
+        elif kind == "modify":
+            writer.modify(dn, payload)
+        else:
+            writer.delete(dn)
+        if on_change:
+            on_change(kind, dn, payload)
+
+
+# =============================================================
+# Command line
+# =============================================================
+
+
+@click.command()
+@click.argument("old")
+@click.argument("new")
+@click.option(
+    "--output", "-o", default="-", type=click.File("w", encoding="utf-8"),
+    help="LDIF change set file (default: stdout)",
+)
+@click.option("--base-dn", default=None, help="Subtree of the servers to compare")
+@click.option(
+    "--ignore", "ignored", multiple=True,
+    help="Attribute to ignore, repeat for several (default: operational attributes)",
+)
+@click.option("--run-size", default=RUN_SIZE, type=int, help="Entries sorted in memory at once")
+def main(old: str, new: str, output, base_dn: Optional[str], ignored, run_size: int) -> None:
+    """Write the LDIF changes turning OLD into NEW.
+
+    OLD and NEW are "live" (the configured server), an LDAP URL such as
+    ldap://replica:389/dc=example,dc=com, an LDIF file or a snapshot file.
+    """
+    differ = DirectoryDiff(ignored=ignored or DEFAULT_IGNORED_ATTRIBUTES, run_size=run_size)
+    write_changes(
+        differ.diff(iter_source_entries(old, base_dn), iter_source_entries(new, base_dn)),
+        output,
+    )
+
+    stats = differ.stats
+    click.echo(
+        f"{stats['old']} and {stats['new']} entries compared in {stats['elapsed']:.1f}s: "
+        f"{stats['add']} added, {stats['modify']} modified, {stats['delete']} deleted, "
+        f"{stats['unchanged']} unchanged",
+        err=True,
+    )
+    sys.exit(1 if stats["add"] or stats["modify"] or stats["delete"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+LDAP Filter - Client side evaluation of RFC 4515 search filters
+
+Used by the backends which answer searches without a server (snapshots,
+dynamic group evaluation). Matching is case-insensitive, which is right for
+the directory string attributes the control panel displays.
+"""
+
+from typing import Dict, List, Tuple, Union
+
+# Parsed filter node, e.g. ("eq", "uid", "jdoe") or ("and", [node, ...])
+FilterNode = Tuple
+
+MATCH_ALL = ("present", "objectclass")
+
+
+# =============================================================
+# Parser
+# =============================================================
+
+
+def _unescape(value: str) -> str:
+    """Decode RFC 4515 backslash hex escapes."""
+    if "\\" not in value:
+        return value
+    out = bytearray()
+    idx = 0
+    raw = value.encode("utf-8")
+    while idx < len(raw):
+        if raw[idx : idx + 1] == b"\\":
+            out.append(int(raw[idx + 1 : idx + 3], 16))
+            idx += 3
+        else:
+            out.append(raw[idx])
+            idx += 1
+    return out.decode("utf-8", errors="replace")
+
+
+def _find_closing(filter_str: str, start: int) -> int:
+    """Return the index of the parenthesis closing the one at start."""
+    depth = 0
+    for idx in range(start, len(filter_str)):
+        char = filter_str[idx]
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return idx
+    raise ValueError(f"Unbalanced LDAP filter: {filter_str}")
+
+
+def _parse_list(body: str) -> List[FilterNode]:
+    nodes = []
+    idx = 0
+    while idx < len(body):
+        # Whitespace between components, as in "(& (a=b) (c=d))"
+        if body[idx].isspace():
+            idx += 1
+            continue
+        if body[idx] != "(":
+            raise ValueError(f"Invalid LDAP filter component: {body}")
+        end = _find_closing(body, idx)
+        nodes.append(_parse_item(body[idx + 1 : end]))
+        idx = end + 1
+    return nodes
+
+
+def _parse_item(body: str) -> FilterNode:
+    body = body.strip()
+    if not body:
+        raise ValueError("Empty LDAP filter component")
+
+    head = body[0]
+    if head == "&":
+        return ("and", _parse_list(body[1:]))
+    if head == "|":
+        return ("or", _parse_list(body[1:]))
+    if head == "!":
+        return ("not", _parse_list(body[1:])[0])
+
+    if "=" not in body:
+        raise ValueError(f"Invalid LDAP filter component: ({body})")
+    pos = body.index("=")
+    operator = body[pos - 1] if pos else ""
+
+    if operator == ":":
+        raise ValueError(f"Extensible match is not supported: ({body})")
+    if operator in ("<", ">", "~"):
+        kind = {"<": "le", ">": "ge", "~": "approx"}[operator]
+        return (kind, body[: pos - 1].strip().lower(), _unescape(body[pos + 1 :]).lower())
+
+    attr, value = body[:pos].strip().lower(), body[pos + 1 :]
+    if value == "*":
+        return ("present", attr)
+    if "*" in value:
+        parts = [_unescape(part).lower() for part in value.split("*")]
+        return ("sub", attr, parts[0], parts[1:-1], parts[-1])
+    return ("eq", attr, _unescape(value).lower())
+
+
+def parse_filter(filter_str: str) -> FilterNode:
+    """Parse an LDAP filter string into a tree of tuples."""
+    filter_str = filter_str.strip()
+    if not filter_str.startswith("("):
+        filter_str = f"({filter_str})"
+    end = _find_closing(filter_str, 0)
+    if end != len(filter_str) - 1:
+        raise ValueError(f"Trailing data in LDAP filter: {filter_str}")
+    return _parse_item(filter_str[1:-1])
+
+
+# =============================================================
+# Evaluation
+# =============================================================
+
+
+def _as_text(value: Union[str, bytes]) -> str:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    return value.lower()
+
+
+def _compare(left: str, right: str) -> int:
+    """Compare numerically when both sides are integers, as text otherwise."""
+    try:
+        left_num, right_num = int(left), int(right)
+    except ValueError:
+        return (left > right) - (left < right)
+    return (left_num > right_num) - (left_num < right_num)
+
+
+def _match_substring(value: str, initial: str, anys: List[str], final: str) -> bool:
+    if not value.startswith(initial):
+        return False
+    pos = len(initial)
+    for part in anys:
+        found = value.find(part, pos)
+        if found < 0:
+            return False
+        pos = found + len(part)
+    return len(value) - pos >= len(final) and value.endswith(final)
+
+
+def match_filter(node: FilterNode, attributes: Dict[str, List[Union[str, bytes]]]) -> bool:
+    """Evaluate a parsed filter against attributes keyed by lowercase name."""
+    kind = node[0]
+
+    if kind == "and":
+        return all(match_filter(child, attributes) for child in node[1])
+    if kind == "or":
+        return any(match_filter(child, attributes) for child in node[1])
+    if kind == "not":
+        return not match_filter(node[1], attributes)
+
+    values = attributes.get(node[1])
+    if not values:
+        return False
+    if kind == "present":
+        return True
+
+    texts = [_as_text(value) for value in values]
+    # Approximate matching is taken as equality
+    if kind in ("eq", "approx"):
+        return node[2] in texts
+    if kind == "sub":
+        return any(_match_substring(text, node[2], node[3], node[4]) for text in texts)
+    if kind == "ge":
+        return any(_compare(text, node[2]) >= 0 for text in texts)
+    if kind == "le":
+        return any(_compare(text, node[2]) <= 0 for text in texts)
+
+    raise ValueError(f"Unknown filter node: {node}")
+
+
+def filter_attributes_used(node: FilterNode) -> List[str]:
+    """Return the lowercase attribute names a parsed filter depends on."""
+    if node[0] in ("and", "or"):
+        return sorted({attr for child in node[1] for attr in filter_attributes_used(child)})
+    if node[0] == "not":
+        return filter_attributes_used(node[1])
+    return [node[1]]
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+LDAP Groups - Nested and dynamic group membership resolution
+
+Builds an in-memory membership graph from member, uniqueMember and memberOf
+with two paged searches, then answers "which groups is this entry effectively
+in" from memoized transitive closures. Cycles are detected (Tarjan strongly
+connected components) and reported instead of looping.
+
+Dynamic groups (groupOfURLs) are resolved by evaluating their memberURL
+LDAP URLs, batched per base and scope and cached for a while.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import logging
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import ldap.schema
+import ldapurl
+
+from ldap_idp.ldap_backend import SCOPE_BASE, SCOPE_SUBTREE
+from ldap_idp.ldap_filter import filter_attributes_used, match_filter, parse_filter
+from ldap_idp.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Attributes of groups listing their members
+MEMBER_ATTRIBUTES = ["member", "uniqueMember"]
+
+# Attribute of entries listing their groups
+MEMBEROF_ATTRIBUTE = "memberOf"
+
+# Attribute of dynamic groups, and the virtual attribute of their members
+MEMBERURL_ATTRIBUTE = "memberURL"
+DYNAMIC_MEMBER_ATTRIBUTE = "dynamicMember"
+
+
+def member_dn(value: str) -> str:
+    """Return the DN of a member value, without the uniqueMember UID suffix."""
+    # uniqueMember is a NameAndOptionalUID: "cn=x,dc=y#'0101'B"
+    if value.endswith("'B") and "#'" in value:
+        value = value[: value.rindex("#'")]
+    return value
+
+
+class MembershipGraph:
+    """Direct membership edges, and the effective groups derived from them.
+
+    Entries are keyed by lowercase DN. Edges come from two sides which are
+    kept apart, so refreshing one side never drops edges of the other:
+    member attributes of groups, and memberOf attributes of entries.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.names: Dict[str, str] = {}
+
+        # group -> members, and its reverse index, from member attributes
+        self._members: Dict[str, Set[str]] = {}
+        self._member_groups: Dict[str, Set[str]] = {}
+        # entry -> groups, and its reverse index, from memberOf
+        self._memberof: Dict[str, Set[str]] = {}
+        self._memberof_members: Dict[str, Set[str]] = {}
+
+        # Memoized transitive closures, shared by the entries of a cycle
+        self._closures: Dict[str, FrozenSet[str]] = {}
+        self.cycles: List[List[str]] = []
+
+        self.built = False
+        self.build_time = 0.0
+
+    # Graph edges
+    # =============================================================
+
+    def _key(self, dn: str) -> str:
+        key = dn.lower()
+        self.names.setdefault(key, dn)
+        return key
+
+    @staticmethod
+    def _set_edges(forward, reverse, source: str, targets: Set[str]) -> Set[str]:
+        """Replace the edges of source, return the targets added or removed."""
+        old = forward.get(source, set())
+        for target in old - targets:
+            reverse[target].discard(source)
+        for target in targets - old:
+            reverse.setdefault(target, set()).add(source)
+        if targets:
+            forward[source] = targets
+        else:
+            forward.pop(source, None)
+        return old ^ targets
+
+    def parents(self, key: str) -> Set[str]:
+        """Return the groups an entry is directly in."""
+        return self._member_groups.get(key, set()) | self._memberof.get(key, set())
+
+    def children(self, key: str) -> Set[str]:
+        """Return the direct members of a group."""
+        return self._members.get(key, set()) | self._memberof_members.get(key, set())
+
+    @property
+    def edge_count(self) -> int:
+        return sum(len(targets) for targets in self._members.values()) + sum(
+            len(targets) for targets in self._memberof.values()
+        )
+
+    # Building and updates
+    # =============================================================
+
+    def build(self, ldap_connection, page_size: int = 500) -> None:
+        """Load every membership edge of the directory, with two paged searches.
+
+        The edges are loaded into a new graph, swapped in once complete: the
+        current graph keeps answering meanwhile, and is kept if a search
+        raises.
+        """
+        start = time.monotonic()
+        member_filter = "(|{})".format(
+            "".join(f"({attr}=*)" for attr in MEMBER_ATTRIBUTES)
+        )
+        searches = [
+            (member_filter, MEMBER_ATTRIBUTES, True),
+            (f"({MEMBEROF_ATTRIBUTE}=*)", [MEMBEROF_ATTRIBUTE], False),
+        ]
+
+        graph = MembershipGraph()
+        for filter_str, attributes, with_members in searches:
+            for page in ldap_connection.iter_search(
+                scope=SCOPE_SUBTREE,
+                filter_str=filter_str,
+                attributes=attributes,
+                page_size=page_size,
+            ):
+                for entry in page:
+                    graph._update_edges(  # pylint: disable=protected-access
+                        entry["dn"], entry["attributes"], with_members=with_members
+                    )
+
+        with self.lock:
+            self._adopt(graph)
+            self.built = True
+            self.build_time = time.monotonic() - start
+
+        logger.info(
+            f"Membership graph built in {self.build_time:.2f}s: "
+            f"{len(self._members)} groups, {self.edge_count} edges"
+        )
+
+    def _adopt(self, graph: "MembershipGraph") -> None:
+        """Take the edges and closures of another graph, keeping this lock."""
+        for name, value in vars(graph).items():
+            if name != "lock":
+                setattr(self, name, value)
+
+    def _update_edges(
+        self, dn: str, attributes: Dict[str, List[str]], with_members: bool = True
+    ) -> Set[str]:
+        """Replace the edges of an entry, return the keys whose closure changed.
+
+        Member edges are replaced when with_members is set, i.e. when the
+        attributes are complete and a missing member attribute means none.
+        """
+        key = self._key(dn)
+        lowered = {name.lower(): values for name, values in attributes.items()}
+        changed = {key}
+
+        if with_members:
+            members = {
+                self._key(member_dn(value))
+                for attr in MEMBER_ATTRIBUTES
+                for value in lowered.get(attr.lower(), [])
+            }
+            changed |= self._set_edges(self._members, self._member_groups, key, members)
+
+        # memberOf is operational, it is only there when asked for
+        if MEMBEROF_ATTRIBUTE.lower() in lowered:
+            groups = {self._key(value) for value in lowered[MEMBEROF_ATTRIBUTE.lower()]}
+            self._set_edges(self._memberof, self._memberof_members, key, groups)
+        return changed
+
+    def update_entry(self, dn: str, attributes: Dict[str, List[str]]) -> None:
+        """Refresh the edges of a changed entry, invalidating what depends on them."""
+        with self.lock:
+            self._invalidate(self._update_edges(dn, attributes))
+
+    def remove_entry(self, dn: str) -> None:
+        """Drop the edges of a deleted entry."""
+        key = dn.lower()
+        with self.lock:
+            changed = {key}
+            changed |= self._set_edges(self._members, self._member_groups, key, set())
+            self._set_edges(self._memberof, self._memberof_members, key, set())
+            self._invalidate(changed)
+
+    def _invalidate(self, keys: Set[str]) -> None:
+        """Forget the closures of entries and of everything nested below them."""
+        todo = list(keys)
+        seen = set(todo)
+        while todo:
+            key = todo.pop()
+            self._closures.pop(key, None)
+            for child in self.children(key):
+                if child not in seen:
+                    seen.add(child)
+                    todo.append(child)
+        self.cycles = [
+            cycle for cycle in self.cycles
+            if not seen.intersection(name.lower() for name in cycle)
+        ]
+
+    # Resolution
+    # =============================================================
+
+    def _resolve(self, start: str) -> None:
+        """Memoize the closure of start and of its ancestors (iterative Tarjan).
+
+        Components are completed in reverse topological order, so the parents
+        outside a component already have their closure when it completes.
+        """
+        index = {start: 0}
+        low = {start: 0}
+        stack = [start]
+        on_stack = {start}
+        work = [(start, iter(self.parents(start)))]
+
+        while work:
+            node, parents = work[-1]
+            descended = False
+            for parent in parents:
+                if parent in self._closures:
+                    continue
+                if parent not in index:
+                    index[parent] = low[parent] = len(index)
+                    stack.append(parent)
+                    on_stack.add(parent)
+                    work.append((parent, iter(self.parents(parent))))
+                    descended = True
+                    break
+                if parent in on_stack:
+                    low[node] = min(low[node], index[parent])
+            if descended:
+                continue
+
+            work.pop()
+            if work:
+                caller = work[-1][0]
+                low[caller] = min(low[caller], low[node])
+            if low[node] != index[node]:
+                continue
+
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == node:
+                    break
+
+            ancestors = set()
+            for member in component:
+                for parent in self.parents(member):
+                    ancestors.add(parent)
+                    ancestors |= self._closures.get(parent, frozenset())
+            closure = frozenset(ancestors)
+            for member in component:
+                self._closures[member] = closure
+
+            if len(component) > 1 or node in self.parents(node):
+                self.cycles.append([self.names.get(key, key) for key in component])
+
+    def effective_groups(self, dn: str) -> List[Tuple[str, bool]]:
+        """Return the (group DN, direct membership) of every group of an entry."""
+        key = dn.lower()
+        with self.lock:
+            if key not in self._closures:
+                self._resolve(key)
+            direct = self.parents(key)
+            groups = self._closures[key] - {key}
+            return sorted(
+                ((self.names.get(group, group), group in direct) for group in groups),
+                key=lambda item: (not item[1], item[0].lower()),
+            )
+
+    def cycles_of(self, dn: str) -> List[List[str]]:
+        """Return the membership cycles an entry or its groups are part of."""
+        key = dn.lower()
+        with self.lock:
+            groups = self._closures.get(key, frozenset()) | {key}
+            return [
+                cycle for cycle in self.cycles
+                if groups.intersection(name.lower() for name in cycle)
+            ]
+
+
+# =============================================================
+# Dynamic groups
+# =============================================================
+
+
+# Equality rules which client side matching follows, by the kind of values
+MATCHING_RULE_KINDS = {
+    "caseIgnoreMatch": "string",
+    "caseIgnoreIA5Match": "string",
+    "integerMatch": "integer",
+}
+
+# Used when the server publishes no schema
+DEFAULT_MATCHABLE_ATTRIBUTES = {
+    **dict.fromkeys(["uid", "cn", "sn", "givenname", "displayname", "mail", "ou", "o",
+                     "title", "description", "employeetype", "departmentnumber", "l", "st"],
+                    "string"),
+    "uidnumber": "integer",
+    "gidnumber": "integer",
+}
+
+
+def matchable_attributes_from_schema(schema) -> Dict[str, str]:
+    """Return the lowercase names of attributes with a plain string or integer equality."""
+    kinds = {}
+    for oid in schema.listall(ldap.schema.AttributeType):
+        attr_type = schema.get_obj(ldap.schema.AttributeType, oid)
+        if attr_type is None:
+            continue
+
+        equality, current, seen = attr_type.equality, attr_type, set()
+        while equality is None and current is not None and current.sup:
+            sup = current.sup[0]
+            if sup in seen:
+                break
+            seen.add(sup)
+            current = schema.get_obj(ldap.schema.AttributeType, sup)
+            equality = current.equality if current is not None else None
+
+        kind = MATCHING_RULE_KINDS.get(equality)
+        if kind:
+            kinds.update((name.lower(), kind) for name in attr_type.names)
+    return kinds
+
+
+def client_matchable(node, attributes: Dict[str, str]) -> bool:
+    """Tell if client side matching of a parsed filter gives the server's answer.
+
+    Presence always does. Equality and substrings only on attributes
+    compared as case-insensitive strings, or integers in canonical form
+    (no substrings). objectClass values are taken as names, not OIDs.
+    """
+    kind = node[0]
+    if kind in ("and", "or"):
+        return all(client_matchable(child, attributes) for child in node[1])
+    if kind == "not":
+        return client_matchable(node[1], attributes)
+    if kind == "present":
+        return True
+
+    attr_kind = "string" if node[1] == "objectclass" else attributes.get(node[1])
+    if attr_kind == "string":
+        return kind in ("eq", "sub")
+    if attr_kind == "integer" and kind == "eq":
+        try:
+            return str(int(node[2])) == node[2]
+        except ValueError:
+            return False
+    return False
+
+
+def parse_member_url(url: str) -> Tuple[str, int, str]:
+    """Return the (base, scope, filter) of a memberURL.
+
+    As in RFC 4516, a URL without scope is a base search.
+    """
+    parsed = ldapurl.LDAPUrl(url)
+    scope = SCOPE_BASE if parsed.scope is None else parsed.scope
+    filter_str = parsed.filterstr or "(objectClass=*)"
+    if not filter_str.startswith("("):
+        filter_str = f"({filter_str})"
+    return parsed.dn, scope, filter_str
+
+
+class DynamicGroupResolver:
+    """Evaluate memberURL of dynamic groups, with batched and cached queries.
+
+    Identical base/scope/filter triples are searched once. The filters of a
+    same base and scope are OR-ed into one query, and matched back to their
+    groups client side, when client matching gives the server's answer:
+    others get a query of their own. Results are kept ttl seconds.
+    """
+
+    def __init__(self, ldap_connection, ttl: float = 300):
+        self.ldap_connection = ldap_connection
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (base, scope, filter) -> (expiry, member DNs)
+        self._cache: Dict[Tuple[str, int, str], Tuple[float, List[str]]] = {}
+        self.query_count = 0
+        # Attributes client matching can evaluate, from the schema
+        self._matchable: Optional[Dict[str, str]] = None
+
+    def matchable_attributes(self) -> Dict[str, str]:
+        """Return the attributes with a string or integer equality, read once."""
+        if self._matchable is None:
+            try:
+                schema = self.ldap_connection.get_schema()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning(f"Could not read schema, using default matchable attributes: {err}")
+                schema = None
+            kinds = matchable_attributes_from_schema(schema) if schema is not None else {}
+            self._matchable = kinds or dict(DEFAULT_MATCHABLE_ATTRIBUTES)
+        return self._matchable
+
+    def resolve(self, groups: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """Return the member DNs of groups given as {group DN: memberURLs}."""
+        group_triples = {}
+        for group_dn, urls in groups.items():
+            triples = []
+            for url in urls:
+                try:
+                    triples.append(parse_member_url(url))
+                except ValueError as err:
+                    logger.warning(f"Invalid memberURL of {group_dn}: {url}: {err}")
+            group_triples[group_dn] = triples
+
+        with self.lock:
+            now = time.monotonic()
+            missing = {
+                triple
+                for triples in group_triples.values()
+                for triple in triples
+                if self._cache.get(triple, (0, None))[0] <= now
+            }
+            METRICS.incr("cache.dynamic_groups.miss", len(missing))
+            METRICS.incr(
+                "cache.dynamic_groups.hit",
+                len({triple for triples in group_triples.values() for triple in triples} - missing),
+            )
+            if missing:
+                self._fetch(missing, now + self.ttl)
+
+            members = {}
+            for group_dn, triples in group_triples.items():
+                dns = {}
+                for triple in triples:
+                    for dn in self._cache[triple][1]:
+                        dns.setdefault(dn.lower(), dn)
+                members[group_dn] = sorted(dns.values(), key=str.lower)
+        return members
+
+    def resolve_group(self, group_dn: str, urls: List[str]) -> List[str]:
+        """Return the member DNs of one dynamic group."""
+        return self.resolve({group_dn: urls})[group_dn]
+
+    def _search_dns(self, base, scope, filter_str, attributes):
+        self.query_count += 1
+        for page in self.ldap_connection.iter_search(
+            base, scope=scope, filter_str=filter_str, attributes=attributes
+        ):
+            yield from page
+
+    def _fetch(self, triples, expiry: float) -> None:
+        """Run the queries of triples, one per base and scope when possible."""
+        batches: Dict[Tuple[str, int], List[str]] = {}
+        for base, scope, filter_str in triples:
+            batches.setdefault((base, scope), []).append(filter_str)
+
+        matchable = self.matchable_attributes() if len(triples) > 1 else {}
+        for (base, scope), filters in batches.items():
+            parsed, alone = {}, []
+            for filter_str in filters:
+                try:
+                    node = parse_filter(filter_str)
+                except ValueError:
+                    node = None
+                if node is not None and client_matchable(node, matchable):
+                    parsed[filter_str] = node
+                else:
+                    # Not evaluable client side, gets its own query
+                    alone.append(filter_str)
+            if len(parsed) == 1:
+                alone.extend(parsed)
+                parsed = {}
+
+            if parsed:
+                attributes = sorted(
+                    {attr for node in parsed.values() for attr in filter_attributes_used(node)}
+                )
+                matches = {filter_str: [] for filter_str in parsed}
+                combined = "(|{})".format("".join(parsed))
+                for entry in self._search_dns(base, scope, combined, attributes):
+                    lowered = {
+                        name.lower(): values for name, values in entry["attributes"].items()
+                    }
+                    for filter_str, node in parsed.items():
+                        if match_filter(node, lowered):
+                            matches[filter_str].append(entry["dn"])
+                for filter_str, dns in matches.items():
+                    self._cache[(base, scope, filter_str)] = (expiry, dns)
+
+            for filter_str in alone:
+                dns = [
+                    entry["dn"]
+                    for entry in self._search_dns(base, scope, filter_str, ["1.1"])
+                ]
+                self._cache[(base, scope, filter_str)] = (expiry, dns)
+
+        logger.info(f"Evaluated {len(triples)} memberURL queries, {self.query_count} searches so far")
+
+    def add_dynamic_members(self, results: List[Dict]) -> List[Dict]:
+        """Return results with the dynamicMember virtual attribute of dynamic groups."""
+        groups = {}
+        for result in results:
+            for name, values in result["attributes"].items():
+                if name.lower() == MEMBERURL_ATTRIBUTE.lower():
+                    groups[result["dn"]] = values
+        if not groups:
+            return results
+
+        members = self.resolve(groups)
+        return [
+            {
+                **result,
+                "attributes": {
+                    **result["attributes"],
+                    DYNAMIC_MEMBER_ATTRIBUTE: members[result["dn"]],
+                },
+            }
+            if result["dn"] in members
+            else result
+            for result in results
+        ]
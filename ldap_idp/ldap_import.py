@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+LDAP Import - Pipelined application of LDIF change files
+
+Operations are sent with the asynchronous python-ldap calls (add_ext,
+modify_ext, delete_ext, rename) and their results collected by message id,
+with up to a window of operations in flight. An operation waits for the
+in-flight operations on its entry and its parent, so children are never
+added before their parent.
+
+Records complete out of order: a checkpoint holds the first record not
+completed yet and the completed ones after it, so a resumed import applies
+every record exactly once. The checkpoint records the size and hash of the
+LDIF file it was written for, and is removed once the import completes.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+import click
+import ldap
+
+from ldap_idp.config import settings
+from ldap_idp.ldap_backend import error_text, get_parent_dn
+from ldap_idp.ldif_stream import LDIFError, LDIFRecord, iter_ldif_records
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checkpoint writes and progress reports
+CHECKPOINT_INTERVAL = 1.0
+
+
+class CheckpointError(Exception):
+    """A checkpoint exists but may not be resumed."""
+
+
+def file_fingerprint(path: str) -> Dict[str, Any]:
+    """Return the size and SHA-256 of a file, identifying its contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(block)
+    return {"size": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+
+class ImportEngine:
+    """Apply change records with a window of asynchronous operations.
+
+    on_error(record, error) is called for each failed record, and
+    on_progress(stats) about every second. An existing checkpoint is only
+    loaded with resume, and if it was written for the same source, e.g. the
+    file_fingerprint() of the LDIF file; CheckpointError is raised otherwise.
+    """
+
+    def __init__(
+        self,
+        ldap_object,
+        window: int = 64,
+        checkpoint_path: str = None,
+        source: Optional[Dict[str, Any]] = None,
+        resume: bool = False,
+        stop_on_error: bool = False,
+        on_error: Callable[[LDIFRecord, Exception], None] = None,
+        on_progress: Callable[[Dict[str, Any]], None] = None,
+    ):
+        if not hasattr(ldap_object, "add_ext"):
+            raise RuntimeError("Imports need a direct LDAP connection")
+        self.ldap_object = ldap_object
+        self.window = max(1, window)
+        self.checkpoint_path = checkpoint_path
+        self.source = source
+        self.stop_on_error = stop_on_error
+        self.on_error = on_error
+        self.on_progress = on_progress
+
+        # msgid -> record, and in-flight counts by entry and by parent
+        self.in_flight: Dict[int, LDIFRecord] = {}
+        self._busy_dns: Dict[str, int] = {}
+        self._busy_parents: Dict[str, int] = {}
+
+        # First record not completed, and completed records after it
+        self.next_record = 0
+        self.done_after: Set[int] = set()
+
+        self.stats = {
+            "submitted": 0,
+            "completed": 0,
+            "errors": 0,
+            "skipped": 0,
+            "elapsed": 0.0,
+            "rate": 0.0,
+        }
+        self._start = 0.0
+        self._last_report = 0.0
+        self._stopped = False
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            self.load_checkpoint(resume)
+
+    # Checkpoint
+    # =============================================================
+
+    def load_checkpoint(self, resume: bool) -> None:
+        """Resume from the checkpoint, if asked to and written for the same source."""
+        if not resume:
+            raise CheckpointError(
+                f"{self.checkpoint_path} holds the state of an unfinished import: "
+                "resume it, or remove it to start over"
+            )
+        with open(self.checkpoint_path, encoding="utf-8") as checkpoint:
+            state = json.load(checkpoint)
+        if state.get("source") != self.source:
+            raise CheckpointError(
+                f"{self.checkpoint_path} was written for another version of the file: "
+                "remove it to start over"
+            )
+        self.next_record = state["next"]
+        self.done_after = set(state["done"])
+
+    def write_checkpoint(self) -> None:
+        if not self.checkpoint_path:
+            return
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as checkpoint:
+            json.dump(
+                {
+                    "source": self.source,
+                    "next": self.next_record,
+                    "done": sorted(self.done_after),
+                },
+                checkpoint,
+            )
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def remove_checkpoint(self) -> None:
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _mark_done(self, number: int) -> None:
+        if number != self.next_record:
+            self.done_after.add(number)
+            return
+        self.next_record += 1
+        while self.next_record in self.done_after:
+            self.done_after.remove(self.next_record)
+            self.next_record += 1
+
+    # Dependencies
+    # =============================================================
+
+    @staticmethod
+    def _record_dns(record: LDIFRecord):
+        """Return the entries a record touches, and the parents it needs."""
+        dn = record.dn.lower()
+        dns, parents = {dn}, {get_parent_dn(record.dn).lower()}
+        if record.newrdn is not None:
+            superior = record.newsuperior or get_parent_dn(record.dn)
+            dns.add(f"{record.newrdn},{superior}".lower())
+            parents.add(superior.lower())
+        return dns, parents
+
+    def _is_blocked(self, record: LDIFRecord) -> bool:
+        dns, parents = self._record_dns(record)
+        if any(dn in self._busy_dns for dn in dns | parents):
+            return True
+        # Deletes and renames wait for the operations on their children
+        return record.changetype != "add" and any(dn in self._busy_parents for dn in dns)
+
+    @staticmethod
+    def _count(counts: Dict[str, int], keys, step: int) -> None:
+        for key in keys:
+            counts[key] = counts.get(key, 0) + step
+            if not counts[key]:
+                del counts[key]
+
+    # Operations
+    # =============================================================
+
+    def _send(self, record: LDIFRecord) -> int:
+        conn = self.ldap_object
+        if record.changetype == "add":
+            return conn.add_ext(record.dn, record.modlist)
+        if record.changetype == "modify":
+            return conn.modify_ext(record.dn, record.modlist)
+        if record.changetype == "delete":
+            return conn.delete_ext(record.dn)
+        return conn.rename(record.dn, record.newrdn, record.newsuperior, int(record.deleteoldrdn))
+
+    def submit(self, record: LDIFRecord) -> None:
+        """Send a record, once the window and its dependencies allow it."""
+        while self.in_flight and (
+            len(self.in_flight) >= self.window or self._is_blocked(record)
+        ):
+            self.collect()
+
+        dns, parents = self._record_dns(record)
+        try:
+            msgid = self._send(record)
+        except ldap.LDAPError as err:
+            self._finish(record, err)
+            return
+
+        self.in_flight[msgid] = record
+        self._count(self._busy_dns, dns, 1)
+        self._count(self._busy_parents, parents, 1)
+        self.stats["submitted"] += 1
+
+    def collect(self) -> None:
+        """Wait for the result of one in-flight operation."""
+        error = None
+        try:
+            _rtype, _rdata, msgid, _ctrls = self.ldap_object.result3(ldap.RES_ANY, all=1)
+        except ldap.LDAPError as err:
+            info = err.args[0] if err.args and isinstance(err.args[0], dict) else {}
+            msgid = info.get("msgid")
+            if msgid not in self.in_flight:
+                raise
+            error = err
+
+        record = self.in_flight.pop(msgid)
+        dns, parents = self._record_dns(record)
+        self._count(self._busy_dns, dns, -1)
+        self._count(self._busy_parents, parents, -1)
+
+        self.stats["completed"] += 1
+        self._finish(record, error)
+        self._report()
+
+    def _finish(self, record: LDIFRecord, error: Optional[Exception] = None) -> None:
+        """Count a record done, unless it failed and stops the import: resuming retries it."""
+        if error is not None:
+            self._fail(record, error)
+            if self.stop_on_error:
+                return
+        self._mark_done(record.number)
+
+    def _fail(self, record: LDIFRecord, error: Exception) -> None:
+        self.stats["errors"] += 1
+        logger.info(f"Line {record.line}: {record.changetype} {record.dn}: {error_text(error)}")
+        if self.on_error:
+            self.on_error(record, error)
+        if self.stop_on_error:
+            self._stopped = True
+
+    def _report(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_report < CHECKPOINT_INTERVAL:
+            return
+        self._last_report = now
+        elapsed = now - self._start
+        self.stats["elapsed"] = elapsed
+        self.stats["rate"] = self.stats["completed"] / elapsed if elapsed else 0.0
+        self.write_checkpoint()
+        if self.on_progress:
+            self.on_progress(dict(self.stats))
+
+    def run(
+        self, records: Iterable[LDIFRecord], should_stop: Callable[[], bool] = None
+    ) -> Dict[str, Any]:
+        """Apply records in order, skipping those done before a checkpoint.
+
+        The checkpoint is kept if the run stops early, removed otherwise.
+        """
+        self._start = self._last_report = time.monotonic()
+        try:
+            for record in records:
+                if should_stop and should_stop():
+                    self._stopped = True
+                if self._stopped:
+                    break
+                if record.number < self.next_record or record.number in self.done_after:
+                    self.stats["skipped"] += 1
+                    continue
+                self.submit(record)
+            while self.in_flight:
+                self.collect()
+        finally:
+            self._report(force=True)
+        if not self._stopped:
+            self.remove_checkpoint()
+        return self.stats
+
+
+# =============================================================
+# Command line
+# =============================================================
+
+
+@click.command()
+@click.argument("ldif_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--window", default=64, type=int, help="Operations in flight")
+@click.option(
+    "--checkpoint", default=None,
+    help="Checkpoint file, to resume an interrupted import (default: LDIF_FILE.checkpoint)",
+)
+@click.option("--resume", is_flag=True, help="Resume the import saved in the checkpoint")
+@click.option("--stop-on-error", is_flag=True, help="Stop at the first failed record")
+def main(
+    ldif_file: str, window: int, checkpoint: Optional[str], resume: bool, stop_on_error: bool
+) -> None:
+    """Apply the add, modify, delete and modrdn records of LDIF_FILE."""
+    # pylint: disable=import-outside-toplevel
+    from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+
+    config = LDAPConfig(
+        uri=settings.authldap.uri,
+        bind_dn=settings.authldap.bind_dn,
+        bind_password=settings.authldap.bind_pass,
+        base_dn=settings.authldap.base_dn,
+    )
+    ldap_connection = LDAPConnectionImproved(config)
+    ldap_connection.connect()
+
+    def on_error(record, error):
+        click.echo(
+            f"Line {record.line}: {record.changetype} {record.dn}: {error_text(error)}",
+            err=True,
+        )
+
+    def on_progress(stats):
+        click.echo(
+            f"{stats['completed']} operations, {stats['errors']} errors, "
+            f"{stats['rate']:.0f} ops/s",
+            err=True,
+        )
+
+    try:
+        engine = ImportEngine(
+            ldap_connection.connection,
+            window=window,
+            checkpoint_path=checkpoint or f"{ldif_file}.checkpoint",
+            source=file_fingerprint(ldif_file),
+            resume=resume,
+            stop_on_error=stop_on_error,
+            on_error=on_error,
+            on_progress=on_progress,
+        )
+    except CheckpointError as err:
+        ldap_connection.disconnect()
+        hint = "" if resume else " (--resume to resume it)"
+        raise click.ClickException(f"{err}{hint}") from err
+    if engine.next_record or engine.done_after:
+        click.echo(
+            f"Resuming from record {engine.next_record}, "
+            f"{len(engine.done_after)} records after it already applied",
+            err=True,
+        )
+
+    try:
+        with open(ldif_file, encoding="utf-8") as stream:
+            stats = engine.run(iter_ldif_records(stream))
+    except LDIFError as err:
+        raise click.ClickException(str(err)) from err
+    finally:
+        ldap_connection.disconnect()
+
+    click.echo(
+        f"Applied {stats['completed'] - stats['errors']} records, {stats['errors']} errors, "
+        f"{stats['skipped']} skipped in {stats['elapsed']:.1f}s ({stats['rate']:.0f} ops/s)",
+        err=True,
+    )
+    sys.exit(1 if stats["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+LDAP Live - Follow the changes of a search, for live updating views
+
+The RFC 4533 Content Synchronization control (refreshAndPersist) is used when
+the server supports it, e.g. OpenLDAP with the syncprov overlay. Otherwise the
+watcher polls modifyTimestamp, with a DN only search to notice deletions.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import ldap
+import ldap.ldapobject
+import ldap.syncrepl
+
+from ldap_idp.ldap_backend import (
+    SCOPE_SUBTREE,
+    WATERMARK_SKEW,
+    generalized_time,
+)
+from ldap_idp.ldap_groups import DYNAMIC_MEMBER_ATTRIBUTE
+
+logger = logging.getLogger(__name__)
+
+# on_change(kind, dn, attributes), kind is "add", "modify" or "delete"
+ChangeCallback = Callable[[str, str, Optional[Dict[str, List[str]]]], None]
+
+
+# =============================================================
+# Syncrepl consumer
+# =============================================================
+
+
+class SyncreplConnection(ldap.ldapobject.SimpleLDAPObject, ldap.syncrepl.SyncreplConsumer):
+    """Dedicated connection forwarding syncrepl events to a LiveWatcher."""
+
+    def __init__(self, uri: str, watcher: "LiveWatcher"):
+        super().__init__(uri)
+        self.watcher = watcher
+        self.cookie = None
+        # Deletes are notified by entryUUID only
+        self.uuid_dns: Dict[str, str] = {}
+
+    def syncrepl_get_cookie(self):
+        return self.cookie
+
+    def syncrepl_set_cookie(self, cookie):
+        self.cookie = cookie
+
+    def syncrepl_entry(self, dn, attributes, uuid):
+        # A renamed entry comes back with the same uuid and a new DN
+        old_dn = self.uuid_dns.get(uuid)
+        if old_dn and old_dn.lower() != dn.lower():
+            self.watcher.emit_delete(old_dn)
+        self.uuid_dns[uuid] = dn
+        self.watcher.emit_entry(dn, attributes)
+
+    def syncrepl_delete(self, uuids):
+        for uuid in uuids:
+            dn = self.uuid_dns.pop(uuid, None)
+            if dn:
+                self.watcher.emit_delete(dn)
+
+    def syncrepl_present(self, uuids, refreshDeletes=False):
+        if refreshDeletes and uuids:
+            self.syncrepl_delete(uuids)
+
+    def syncrepl_refreshdone(self):
+        self.watcher.end_refresh()
+
+
+# =============================================================
+# Watcher
+# =============================================================
+
+
+class LiveWatcher:
+    """Follow the entries matching a filter and report their changes.
+
+    known_results are the entries already displayed: changes are reported
+    against them, so the initial content of a sync is not reported again.
+    Their dynamicMember virtual attribute, which the server never sends, is
+    left out of the comparison. Callbacks run in the thread calling run().
+    """
+
+    def __init__(
+        self,
+        ldap_connection,
+        filter_str: str,
+        known_results: Iterable[Dict[str, Any]],
+        on_change: ChangeCallback,
+        on_status: Callable[[str], None] = None,
+        poll_interval: float = 10,
+        use_syncrepl: bool = True,
+    ):
+        self.ldap_connection = ldap_connection
+        self.filter_str = filter_str
+        self.on_change = on_change
+        self.on_status = on_status
+        self.poll_interval = poll_interval
+        self.use_syncrepl = use_syncrepl
+
+        self.known = {
+            result["dn"].lower(): {
+                name: values
+                for name, values in result["attributes"].items()
+                if name.lower() != DYNAMIC_MEMBER_ATTRIBUTE.lower()
+            }
+            for result in known_results
+        }
+        self._refresh_seen = None
+
+    def _status(self, text: str) -> None:
+        logger.info(f"Live watch of {self.filter_str}: {text}")
+        if self.on_status:
+            self.on_status(text)
+
+    # Change reporting
+    # =============================================================
+
+    def emit_entry(self, dn: str, attributes: Dict[Any, List[Any]]) -> None:
+        """Report an entry unless it matches what is displayed."""
+        attributes = self.ldap_connection._decode_attributes(attributes)
+        key = dn.lower()
+        if self._refresh_seen is not None:
+            self._refresh_seen.add(key)
+
+        previous = self.known.get(key)
+        if previous == attributes:
+            return
+        self.known[key] = attributes
+        self.on_change("add" if previous is None else "modify", dn, attributes)
+
+    def emit_delete(self, dn: str) -> None:
+        if self.known.pop(dn.lower(), None) is not None:
+            self.on_change("delete", dn, None)
+
+    def end_refresh(self) -> None:
+        """Entries not sent during the refresh phase were deleted meanwhile."""
+        if self._refresh_seen is None:
+            return
+        for key in set(self.known) - self._refresh_seen:
+            self.emit_delete(key)
+        self._refresh_seen = None
+
+    # Run loops
+    # =============================================================
+
+    def run(self, should_stop: Callable[[], bool]) -> None:
+        """Follow changes until should_stop returns True."""
+        config = self.ldap_connection.config
+        # Snapshots, the cache daemon and recordings have no syncrepl to follow
+        direct = not (config.snapshot_path or config.cache_socket or config.replay_path)
+        if self.use_syncrepl and direct:
+            try:
+                self._run_syncrepl(should_stop)
+                return
+            except ldap.LDAPError as err:
+                logger.warning(f"Syncrepl unavailable, polling instead: {err}")
+        self._run_polling(should_stop)
+
+    def _run_syncrepl(self, should_stop: Callable[[], bool]) -> None:
+        config = self.ldap_connection.config
+        conn = SyncreplConnection(config.uri, self)
+        conn.simple_bind_s(config.bind_dn, config.bind_password)
+
+        self._refresh_seen = set()
+        msgid = conn.syncrepl_search(
+            self.ldap_connection.base_dn,
+            SCOPE_SUBTREE,
+            mode="refreshAndPersist",
+            filterstr=self.filter_str,
+        )
+        self._status("live (syncrepl)")
+        try:
+            while not should_stop():
+                try:
+                    if not conn.syncrepl_poll(msgid=msgid, timeout=1, all=1):
+                        break
+                except ldap.TIMEOUT:
+                    continue
+        finally:
+            try:
+                conn.abandon(msgid)
+                conn.unbind_s()
+            except ldap.LDAPError:
+                pass
+
+    def _run_polling(self, should_stop: Callable[[], bool]) -> None:
+        self._status(f"live (polling {self.poll_interval}s)")
+        watermark = generalized_time(time.time() - WATERMARK_SKEW)
+
+        while not should_stop():
+            deadline = time.monotonic() + self.poll_interval
+            while time.monotonic() < deadline:
+                if should_stop():
+                    return
+                time.sleep(0.2)
+            try:
+                watermark = self.poll_once(watermark)
+            except ldap.LDAPError as err:
+                logger.error(f"Live poll failed, retrying later: {err}")
+
+    def poll_once(self, watermark: str) -> str:
+        """Report changes since a watermark, return the next watermark.
+
+        Paged searches raise on errors, where search() would return nothing
+        and make every displayed entry look deleted.
+        """
+        for page in self.ldap_connection.iter_search(
+            scope=SCOPE_SUBTREE,
+            filter_str=f"(&{self.filter_str}(modifyTimestamp>={watermark}))",
+            attributes=["*", "modifyTimestamp"],
+        ):
+            for result in page:
+                attributes = result["attributes"]
+                stamps = attributes.pop("modifyTimestamp", None) or [watermark]
+                watermark = max([watermark] + stamps)
+                self.emit_entry(result["dn"], attributes)
+
+        present = set()
+        for page in self.ldap_connection.iter_search(
+            scope=SCOPE_SUBTREE, filter_str=self.filter_str, attributes=["1.1"]
+        ):
+            present.update(result["dn"].lower() for result in page)
+        for key in set(self.known) - present:
+            self.emit_delete(key)
+
+        return watermark
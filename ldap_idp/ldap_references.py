@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+LDAP References - Inverted index of DN-valued attributes
+
+Answers "which entries point at this one" (member, manager, seeAlso, ...)
+from memory. The index is built with one paged pass over the directory,
+requesting only the DN-syntax attributes, and updated entry by entry.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import ldap.schema
+
+from ldap_idp.ldap_backend import SCOPE_SUBTREE
+from ldap_idp.ldap_groups import member_dn
+
+logger = logging.getLogger(__name__)
+
+# Distinguished Name and Name And Optional UID (uniqueMember) syntaxes
+DN_SYNTAXES = {
+    "1.3.6.1.4.1.1466.115.121.1.12",
+    "1.3.6.1.4.1.1466.115.121.1.34",
+}
+
+# Used when the server publishes no schema
+DEFAULT_REFERENCE_ATTRIBUTES = [
+    "member",
+    "uniqueMember",
+    "manager",
+    "owner",
+    "seeAlso",
+    "secretary",
+    "roleOccupant",
+]
+
+
+def dn_attributes_from_schema(schema) -> List[str]:
+    """Return the user attributes of DN syntax, following attribute inheritance."""
+    names = []
+    for oid in schema.listall(ldap.schema.AttributeType):
+        attr_type = schema.get_obj(ldap.schema.AttributeType, oid)
+        # Operational attributes (creatorsName, memberOf backlinks...) are skipped
+        if attr_type is None or attr_type.usage or attr_type.no_user_mod:
+            continue
+
+        syntax, current, seen = attr_type.syntax, attr_type, set()
+        while syntax is None and current is not None and current.sup:
+            sup = current.sup[0]
+            if sup in seen:
+                break
+            seen.add(sup)
+            current = schema.get_obj(ldap.schema.AttributeType, sup)
+            syntax = current.syntax if current is not None else None
+
+        if syntax and syntax.split("{")[0] in DN_SYNTAXES and attr_type.names:
+            names.append(attr_type.names[0])
+    return sorted(names, key=str.lower)
+
+
+def reference_attributes(ldap_connection, configured: Optional[List[str]] = None) -> List[str]:
+    """Return the attributes to index: configured ones, else DN-syntax ones."""
+    if configured:
+        return list(configured)
+    try:
+        schema = ldap_connection.get_schema()
+    except Exception as err:  # pylint: disable=broad-except
+        logger.warning(f"Could not read schema, using default reference attributes: {err}")
+        schema = None
+    names = dn_attributes_from_schema(schema) if schema is not None else []
+    return names or list(DEFAULT_REFERENCE_ATTRIBUTES)
+
+
+class ReferenceIndex:
+    """Entries pointing at each DN, through which attribute.
+
+    Entries are keyed by lowercase DN. A forward index of the references
+    each entry holds makes updates replace only the edges of that entry.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attributes: List[str] = []
+        self._reset()
+
+    def _reset(self) -> None:
+        self.names: Dict[str, str] = {}
+        # target -> {(source, attribute)}, and source -> {(target, attribute)}
+        self._referrers: Dict[str, Set[Tuple[str, str]]] = {}
+        self._references: Dict[str, Set[Tuple[str, str]]] = {}
+        self.built = False
+        self.build_time = 0.0
+
+    def _key(self, dn: str) -> str:
+        key = dn.lower()
+        self.names.setdefault(key, dn)
+        return key
+
+    @property
+    def reference_count(self) -> int:
+        return sum(len(edges) for edges in self._references.values())
+
+    def build(self, ldap_connection, attributes: List[str], page_size: int = 500) -> None:
+        """Index the references of the whole directory, in one paged pass.
+
+        The references are indexed into a new index, swapped in once
+        complete: the current one keeps answering meanwhile, and is kept if
+        the search raises.
+        """
+        start = time.monotonic()
+        filter_str = "(|{})".format("".join(f"({attr}=*)" for attr in attributes))
+
+        index = ReferenceIndex()
+        index.attributes = list(attributes)
+        for page in ldap_connection.iter_search(
+            scope=SCOPE_SUBTREE,
+            filter_str=filter_str,
+            attributes=index.attributes,
+            page_size=page_size,
+        ):
+            for entry in page:
+                index._set_references(  # pylint: disable=protected-access
+                    entry["dn"], entry["attributes"]
+                )
+
+        with self.lock:
+            self._adopt(index)
+            self.built = True
+            self.build_time = time.monotonic() - start
+
+        logger.info(
+            f"Reference index built in {self.build_time:.2f}s: "
+            f"{self.reference_count} references over {len(self.attributes)} attributes"
+        )
+
+    def _adopt(self, index: "ReferenceIndex") -> None:
+        """Take the references of another index, keeping this lock."""
+        for name, value in vars(index).items():
+            if name != "lock":
+                setattr(self, name, value)
+
+    def _set_references(self, dn: str, attributes: Dict[str, List[str]]) -> None:
+        source = self._key(dn)
+        indexed = {attr.lower(): attr for attr in self.attributes}
+
+        edges = set()
+        for name, values in attributes.items():
+            attr = indexed.get(name.lower())
+            if attr is None:
+                continue
+            edges.update((self._key(member_dn(value)), attr) for value in values)
+
+        old = self._references.get(source, set())
+        for target, attr in old - edges:
+            self._referrers[target].discard((source, attr))
+            if not self._referrers[target]:
+                del self._referrers[target]
+        for target, attr in edges - old:
+            self._referrers.setdefault(target, set()).add((source, attr))
+        if edges:
+            self._references[source] = edges
+        else:
+            self._references.pop(source, None)
+
+    def update_entry(self, dn: str, attributes: Dict[str, List[str]]) -> None:
+        """Replace the references held by a changed entry."""
+        with self.lock:
+            self._set_references(dn, attributes)
+
+    def remove_entry(self, dn: str) -> None:
+        """Drop the references held by a deleted entry."""
+        with self.lock:
+            self._set_references(dn, {})
+
+    def referenced_by(self, dn: str) -> List[Tuple[str, str]]:
+        """Return the (source DN, attribute) of the entries pointing at a DN."""
+        with self.lock:
+            edges = self._referrers.get(dn.lower(), set())
+            return sorted(
+                ((self.names.get(source, source), attr) for source, attr in edges),
+                key=lambda item: (item[1].lower(), item[0].lower()),
+            )
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+LDAP Replay - Record LDAP traffic, and replay it without a server
+
+RecordingLDAPObject wraps the transport of a connection and writes every
+request with its response and timing to a gzipped JSON lines file.
+ReplayLDAPObject serves a recording in place of the server, optionally
+sleeping the recorded server time, so slowness reports can be reproduced
+offline and round trips compared across versions.
+
+Requests are matched on their operation and arguments: repeated requests
+get the recorded responses in order, then the last one again. Bind
+passwords are never recorded.
+
+File layout, one JSON document per line:
+
+    header    {"format", "version", "uri", "methods", "created"}
+    records   {"c": connection, "op", "key", "t": start offset, "dt": seconds,
+               "r": result, or "e": {"name", "info"} for LDAP errors}
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import atexit
+import base64
+import gzip
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import deque
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+import click
+import ldap
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "ldapcp-recording"
+VERSION = 1
+
+# Transport methods recorded, the others pass through unrecorded
+SYNC_OPS = (
+    "simple_bind_s",
+    "unbind_s",
+    "search_s",
+    "modify_s",
+    "search_subschemasubentry_s",
+    "read_subschemasubentry_s",
+)
+ASYNC_OPS = ("search_ext", "modify_ext", "add_ext", "delete_ext", "rename")
+
+# Seconds between flushes of a recording, so a crashed session keeps its traffic
+FLUSH_INTERVAL = 1.0
+
+
+# =============================================================
+# Encoding
+# =============================================================
+
+
+def encode(value: Any) -> Any:
+    """Return a JSON-able form of request arguments and responses."""
+    if isinstance(value, bytes):
+        return {"$b": base64.b64encode(value).decode("ascii")}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): encode(item) for key, item in value.items()}
+    if hasattr(value, "controlType"):
+        # Only what the paged results control carries is kept
+        return {
+            "$c": value.controlType,
+            "cookie": encode(getattr(value, "cookie", None)),
+            "size": getattr(value, "size", None),
+        }
+    return repr(value)
+
+
+def decode(value: Any) -> Any:
+    """Reverse encode(), controls becoming plain attribute holders."""
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "$b" in value:
+        return base64.b64decode(value["$b"])
+    if "$c" in value:
+        return SimpleNamespace(
+            controlType=value["$c"], cookie=decode(value["cookie"]), size=value["size"]
+        )
+    return {key: decode(item) for key, item in value.items()}
+
+
+def request_key(op: str, args: tuple, kwargs: Dict[str, Any]) -> str:
+    """Return the matching key of a request."""
+    if op == "simple_bind_s":
+        # The bind DN only, passwords stay out of recordings
+        args, kwargs = args[:1], {key: kwargs[key] for key in ("who",) if key in kwargs}
+    return json.dumps([op, encode(args), encode(kwargs)], sort_keys=True)
+
+
+def error_record(err: ldap.LDAPError) -> Dict[str, Any]:
+    info = err.args[0] if err.args else {}
+    return {"name": type(err).__name__, "info": encode(info)}
+
+
+def raise_error(error: Dict[str, Any], msgid: int = None) -> None:
+    info = decode(error["info"])
+    if isinstance(info, dict) and msgid is not None:
+        info["msgid"] = msgid
+    raise getattr(ldap, error["name"], ldap.LDAPError)(info)
+
+
+def new_stats() -> Dict[str, Any]:
+    return {"round_trips": 0, "ops": {}, "server_time": 0.0, "misses": 0}
+
+
+def count(stats: Dict[str, Any], op: str, elapsed: float) -> None:
+    stats["round_trips"] += 1
+    stats["ops"][op] = stats["ops"].get(op, 0) + 1
+    stats["server_time"] += elapsed
+
+
+# =============================================================
+# Recording
+# =============================================================
+
+
+class _RecordingFile:
+    """A recording shared by the connections of the process."""
+
+    _open: Dict[str, "_RecordingFile"] = {}
+    _open_lock = threading.Lock()
+
+    def __init__(self, path: str, uri: str, methods):
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.last_flush = self.start
+        self.users = 0
+        self.connections = 0
+        self.stream = gzip.open(path, "wt", encoding="utf-8")
+        self._write({
+            "format": FORMAT,
+            "version": VERSION,
+            "uri": uri,
+            "methods": list(methods),
+            "created": time.time(),
+        })
+
+    @classmethod
+    def acquire(cls, path: str, uri: str, methods) -> "_RecordingFile":
+        with cls._open_lock:
+            recording = cls._open.get(path)
+            if recording is None:
+                recording = cls._open[path] = cls(path, uri, methods)
+                atexit.register(recording.close)
+            recording.users += 1
+            recording.connections += 1
+            return recording
+
+    def release(self) -> None:
+        with self._open_lock:
+            self.users -= 1
+            if self.users <= 0:
+                self._open.pop(self.path, None)
+                self.close()
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        self.stream.write(json.dumps(record, separators=(",", ":")))
+        self.stream.write("\n")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        with self.lock:
+            if self.stream.closed:
+                return
+            self._write(record)
+            now = time.monotonic()
+            if now - self.last_flush >= FLUSH_INTERVAL:
+                self.last_flush = now
+                self.stream.flush()
+                # pylint: disable=protected-access
+                self.stream.buffer.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.stream.closed:
+                self.stream.close()
+
+
+class RecordingLDAPObject:
+    """Transport wrapper recording the traffic of another transport.
+
+    Wraps python-ldap objects and the cache daemon and snapshot lookalikes,
+    exposing the same methods as the wrapped transport.
+    """
+
+    def __init__(self, transport, path: str, uri: str = ""):
+        self.transport = transport
+        methods = [op for op in SYNC_OPS + ASYNC_OPS if hasattr(transport, op)]
+        if hasattr(transport, "result3"):
+            methods.append("result3")
+        self.recording = _RecordingFile.acquire(path, uri, methods)
+        self.connection_id = self.recording.connections
+        self.stats = new_stats()
+        # msgid -> (op, key, start) of async requests awaiting their result
+        self.pending: Dict[int, tuple] = {}
+        self.lock = threading.Lock()
+        self.released = False
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.transport, name)
+        if name in SYNC_OPS:
+            return lambda *args, **kwargs: self._call(name, attr, args, kwargs)
+        if name in ASYNC_OPS:
+            return lambda *args, **kwargs: self._send(name, attr, args, kwargs)
+        if name == "result3":
+            return lambda *args, **kwargs: self._result(attr, args, kwargs)
+        return attr
+
+    def _record(self, op: str, key: str, start: float, result=None, error=None) -> None:
+        elapsed = time.monotonic() - start
+        with self.lock:
+            count(self.stats, op, elapsed)
+        record = {
+            "c": self.connection_id,
+            "op": op,
+            "key": key,
+            "t": round(start - self.recording.start, 6),
+            "dt": round(elapsed, 6),
+        }
+        if error is not None:
+            record["e"] = error_record(error)
+        else:
+            record["r"] = encode(result)
+        self.recording.write(record)
+
+    def _call(self, op: str, method, args, kwargs):
+        key = request_key(op, args, kwargs)
+        start = time.monotonic()
+        try:
+            result = method(*args, **kwargs)
+        except ldap.LDAPError as err:
+            self._record(op, key, start, error=err)
+            raise
+        self._record(op, key, start, result=result)
+        if op == "unbind_s":
+            self._release()
+        return result
+
+    def _send(self, op: str, method, args, kwargs):
+        key = request_key(op, args, kwargs)
+        start = time.monotonic()
+        try:
+            msgid = method(*args, **kwargs)
+        except ldap.LDAPError as err:
+            self._record(op, key, start, error=err)
+            raise
+        with self.lock:
+            self.pending[msgid] = (op, key, start)
+        return msgid
+
+    def _result(self, method, args, kwargs):
+        try:
+            rtype, rdata, msgid, ctrls = method(*args, **kwargs)
+        except ldap.LDAPError as err:
+            info = err.args[0] if err.args and isinstance(err.args[0], dict) else {}
+            with self.lock:
+                request = self.pending.pop(info.get("msgid"), None)
+            if request is not None:
+                self._record(*request, error=err)
+            raise
+        with self.lock:
+            request = self.pending.pop(msgid, None)
+        if request is not None:
+            self._record(*request, result=[rtype, rdata, ctrls])
+        return rtype, rdata, msgid, ctrls
+
+    def _release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.recording.release()
+
+
+# =============================================================
+# Replay
+# =============================================================
+
+
+class _Replay:
+    """A loaded recording: responses by request key, shared by connections."""
+
+    _loaded: Dict[str, "_Replay"] = {}
+    _loaded_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.header, records = read_recording(path)
+        self.responses: Dict[str, deque] = {}
+        self.last: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            self.responses.setdefault(record["key"], deque()).append(record)
+
+    @classmethod
+    def load(cls, path: str) -> "_Replay":
+        with cls._loaded_lock:
+            replay = cls._loaded.get(path)
+            if replay is None:
+                replay = cls._loaded[path] = cls(path)
+            return replay
+
+    def next_response(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            queue = self.responses.get(key)
+            if queue:
+                self.last[key] = queue.popleft()
+            return self.last.get(key)
+
+
+class ReplayLDAPObject:
+    """python-ldap connection lookalike serving a recording.
+
+    Recorded server times are slept, multiplied by latency (0: no wait).
+    Requests missing from the recording fail with ldap.OTHER, and are
+    counted in stats["misses"].
+    """
+
+    def __init__(self, path: str, latency: float = 0.0):
+        self.path = path
+        self.latency = latency
+        self.replay = _Replay.load(path)
+        self.methods = set(self.replay.header.get("methods", SYNC_OPS))
+        self.stats = new_stats()
+        self.lock = threading.Lock()
+        self.next_msgid = 1
+        # msgid -> recorded response of async requests not collected yet
+        self.pending: Dict[int, Optional[Dict[str, Any]]] = {}
+
+    def __getattr__(self, name: str):
+        # Only what the recorded transport had, the backend probes with hasattr()
+        if name not in self.methods:
+            raise AttributeError(name)
+        if name in ASYNC_OPS:
+            return lambda *args, **kwargs: self._send(name, args, kwargs)
+        if name == "result3":
+            return self._result
+        return lambda *args, **kwargs: self._call(name, args, kwargs)
+
+    def _wait(self, op: str, record: Dict[str, Any]) -> None:
+        with self.lock:
+            count(self.stats, op, record["dt"])
+        if self.latency:
+            time.sleep(record["dt"] * self.latency)
+
+    def _miss(self, op: str, key: str) -> None:
+        with self.lock:
+            self.stats["misses"] += 1
+        logger.warning(f"No recorded response for {key}")
+        raise ldap.OTHER({"desc": "No recorded response", "info": op})
+
+    def _call(self, op: str, args, kwargs):
+        key = request_key(op, args, kwargs)
+        record = self.replay.next_response(key)
+        if record is None:
+            if op in ("simple_bind_s", "unbind_s"):
+                return None
+            self._miss(op, key)
+        self._wait(op, record)
+        if "e" in record:
+            raise_error(record["e"])
+        return decode(record["r"])
+
+    def _send(self, op: str, args, kwargs) -> int:
+        key = request_key(op, args, kwargs)
+        record = self.replay.next_response(key)
+        if record is None:
+            self._miss(op, key)
+        with self.lock:
+            msgid = self.next_msgid
+            self.next_msgid += 1
+            self.pending[msgid] = (op, record)
+        return msgid
+
+    def _result(self, msgid: int = ldap.RES_ANY, *_args, **_kwargs):
+        with self.lock:
+            if msgid == ldap.RES_ANY and self.pending:
+                msgid = next(iter(self.pending))
+            request = self.pending.pop(msgid, None)
+        if request is None:
+            raise ldap.NO_RESULTS_RETURNED({"desc": "No pending request", "msgid": msgid})
+
+        op, record = request
+        self._wait(op, record)
+        if "e" in record:
+            raise_error(record["e"], msgid)
+        rtype, rdata, ctrls = decode(record["r"])
+        return rtype, rdata, msgid, ctrls
+
+
+# =============================================================
+# Reading
+# =============================================================
+
+
+def read_recording(path: str):
+    """Return the header and records of a recording, cut short if truncated."""
+    header, records = {}, []
+    with gzip.open(path, "rt", encoding="utf-8") as stream:
+        try:
+            header = json.loads(stream.readline())
+            for line in stream:
+                records.append(json.loads(line))
+        except (EOFError, zlib.error, gzip.BadGzipFile, ValueError) as err:
+            # Sessions killed before closing their recording
+            logger.warning(f"Truncated recording {path}: {err}")
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        raise ValueError(f"{path} is not an LDAP recording")
+    return header, records
+
+
+def summarize(records) -> Dict[str, Any]:
+    stats = new_stats()
+    stats["connections"] = len({record["c"] for record in records})
+    for record in records:
+        count(stats, record["op"], record["dt"])
+    return stats
+
+
+# =============================================================
+# Command line
+# =============================================================
+
+
+@click.command()
+@click.argument("recording", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--compare", default=None, type=click.Path(exists=True, dir_okay=False),
+    help="Other recording to compare round trips with",
+)
+def main(recording: str, compare: Optional[str]) -> None:
+    """Summarize the LDAP round trips of a RECORDING, per operation."""
+    header, records = read_recording(recording)
+    stats = summarize(records)
+    other = summarize(read_recording(compare)[1]) if compare else None
+
+    click.echo(
+        f"{recording}: {header.get('uri', '')}, {stats['connections']} connections, "
+        f"{stats['server_time']:.3f}s of server time"
+    )
+    for op in sorted(set(stats["ops"]) | set(other["ops"] if other else ())):
+        line = f"  {op:28} {stats['ops'].get(op, 0):8}"
+        if other:
+            line += f" {other['ops'].get(op, 0):8} {other['ops'].get(op, 0) - stats['ops'].get(op, 0):+8}"
+        click.echo(line)
+    line = f"  {'round trips':28} {stats['round_trips']:8}"
+    if other:
+        line += f" {other['round_trips']:8} {other['round_trips'] - stats['round_trips']:+8}"
+    click.echo(line)
+
+
+if __name__ == "__main__":
+    main()
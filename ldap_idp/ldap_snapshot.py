@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+LDAP Snapshot - Memory-mapped read-only directory snapshots
+
+A snapshot is a single file holding a sorted DN table, a parent/child index
+and the attribute blobs of every entry. Sessions `mmap` it and decode only
+what they display, so N `ldapcp-serve` sessions share one page-cache copy of
+the directory instead of N Python heaps.
+
+Layout (little endian):
+
+    header    magic, version, entry count, section offsets
+    records   one fixed size record per entry, sorted by DN key
+    children  entry indexes, grouped by parent, in DN key order
+    dns       DN strings (utf-8)
+    blobs     attribute blobs, see encode_attributes()
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import click
+import ldap
+import ldap.dn
+
+from ldap_idp.config import settings
+from ldap_idp.ldap_filter import MATCH_ALL, match_filter, parse_filter
+
+logger = logging.getLogger(__name__)
+
+SCOPE_BASE = 0
+SCOPE_ONELEVEL = 1
+SCOPE_SUBTREE = 2
+
+MAGIC = b"LDAPCPS1"
+# 2: DN keys normalized by python-ldap
+VERSION = 2
+
+# magic, version, count, records_off, children_off, dns_off, blobs_off, created
+HEADER = struct.Struct("<8sIIQQQQQ")
+# dn_off, dn_len, blob_off, blob_len, parent, child_start, child_count
+RECORD = struct.Struct("<QIQIiII")
+CHILD = struct.Struct("<I")
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+
+# Seconds between checks for a refreshed snapshot file
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+def dn_key(dn: str) -> bytes:
+    """Return the sort and lookup key of a DN, with normalized escapes, lowercase."""
+    try:
+        dn = ldap.dn.dn2str(ldap.dn.str2dn(dn))
+    except ldap.DECODING_ERROR:
+        # Not a valid DN: only spaces around separators are dropped
+        dn = ",".join(part.strip() for part in dn.split(","))
+    return dn.lower().encode("utf-8")
+
+
+def parent_key(key: bytes) -> Optional[bytes]:
+    """Return the key of the parent DN, None for a top level DN."""
+    escaped = False
+    for idx, char in enumerate(key):
+        if escaped:
+            escaped = False
+        elif char == 0x5C:  # backslash
+            escaped = True
+        elif char == 0x2C:  # comma
+            return key[idx + 1 :]
+    return None
+
+
+# =============================================================
+# Attribute blobs
+# =============================================================
+
+
+def encode_attributes(attrs: Dict[str, List[bytes]]) -> bytes:
+    """Encode python-ldap attributes into a compact blob."""
+    parts = [U16.pack(len(attrs))]
+    for name, values in attrs.items():
+        raw_name = name.encode("utf-8")
+        parts.append(U16.pack(len(raw_name)))
+        parts.append(raw_name)
+        parts.append(U32.pack(len(values)))
+        for value in values:
+            parts.append(U32.pack(len(value)))
+            parts.append(value)
+    return b"".join(parts)
+
+
+def decode_attributes(
+    blob: memoryview, wanted: Optional[set] = None
+) -> Dict[str, List[bytes]]:
+    """Decode a blob, keeping only the lowercase attribute names in wanted."""
+    attrs = {}
+    (count,) = U16.unpack_from(blob, 0)
+    pos = U16.size
+    for _ in range(count):
+        (name_len,) = U16.unpack_from(blob, pos)
+        pos += U16.size
+        name = bytes(blob[pos : pos + name_len]).decode("utf-8")
+        pos += name_len
+        (value_count,) = U32.unpack_from(blob, pos)
+        pos += U32.size
+
+        keep = wanted is None or name.lower() in wanted
+        values = []
+        for _ in range(value_count):
+            (value_len,) = U32.unpack_from(blob, pos)
+            pos += U32.size
+            if keep:
+                values.append(bytes(blob[pos : pos + value_len]))
+            pos += value_len
+        if keep:
+            attrs[name] = values
+    return attrs
+
+
+# =============================================================
+# Writer
+# =============================================================
+
+
+def write_snapshot(entries: Iterable[Tuple[str, Dict[str, List[bytes]]]], path: str) -> int:
+    """Write entries to a snapshot file, atomically replacing path.
+
+    Attribute blobs are spooled to a temporary file as entries stream in,
+    only DNs and blob offsets are kept in memory.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    index: List[Tuple[bytes, str, int, int]] = []
+
+    with tempfile.TemporaryFile(dir=directory) as spool:
+        offset = 0
+        for dn, attrs in entries:
+            if not dn:
+                continue
+            blob = encode_attributes(attrs)
+            spool.write(blob)
+            index.append((dn_key(dn), dn, offset, len(blob)))
+            offset += len(blob)
+
+        index.sort(key=lambda item: item[0])
+        keys = [item[0] for item in index]
+        position = {key: idx for idx, key in enumerate(keys)}
+
+        # Children of each entry, in DN key order since index is sorted
+        parents = []
+        children: Dict[int, List[int]] = {}
+        for idx, key in enumerate(keys):
+            pkey = parent_key(key)
+            parent = position.get(pkey, -1) if pkey is not None else -1
+            parents.append(parent)
+            if parent >= 0:
+                children.setdefault(parent, []).append(idx)
+
+        dn_blobs = [item[1].encode("utf-8") for item in index]
+        records_off = HEADER.size
+        children_off = records_off + RECORD.size * len(index)
+        dns_off = children_off + CHILD.size * sum(len(v) for v in children.values())
+        blobs_off = dns_off + sum(len(raw) for raw in dn_blobs)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(
+                    HEADER.pack(MAGIC, VERSION, len(index), records_off, children_off,
+                                dns_off, blobs_off, int(time.time()))
+                )
+
+                dn_pos = 0
+                child_pos = 0
+                for idx, (_key, _dn, blob_off, blob_len) in enumerate(index):
+                    kids = children.get(idx, [])
+                    out.write(
+                        RECORD.pack(dn_pos, len(dn_blobs[idx]), blob_off, blob_len,
+                                    parents[idx], child_pos, len(kids))
+                    )
+                    dn_pos += len(dn_blobs[idx])
+                    child_pos += len(kids)
+
+                for idx in range(len(index)):
+                    for child in children.get(idx, []):
+                        out.write(CHILD.pack(child))
+
+                for raw in dn_blobs:
+                    out.write(raw)
+
+                spool.seek(0)
+                while True:
+                    chunk = spool.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    logger.info(f"Wrote snapshot of {len(index)} entries to {path}")
+    return len(index)
+
+
+# =============================================================
+# Reader
+# =============================================================
+
+
+class Snapshot:
+    """Read-only, memory-mapped view of a snapshot file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as handle:
+            self.stat = os.fstat(handle.fileno())
+            self.map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        (magic, version, self.count, self.records_off, self.children_off,
+         self.dns_off, self.blobs_off, self.created) = HEADER.unpack_from(self.view, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"Not a version {VERSION} LDAP snapshot: {path}")
+
+    def close(self) -> None:
+        self.view.release()
+        self.map.close()
+
+    def record(self, idx: int) -> Tuple[int, int, int, int, int, int, int]:
+        return RECORD.unpack_from(self.view, self.records_off + idx * RECORD.size)
+
+    def dn(self, idx: int) -> str:
+        dn_off, dn_len = self.record(idx)[:2]
+        start = self.dns_off + dn_off
+        return bytes(self.view[start : start + dn_len]).decode("utf-8")
+
+    def key(self, idx: int) -> bytes:
+        return dn_key(self.dn(idx))
+
+    def find(self, dn: str) -> int:
+        """Binary search the DN table, return the entry index or -1."""
+        key = dn_key(dn)
+        keys = _KeyView(self)
+        idx = bisect.bisect_left(keys, key)
+        if idx < self.count and keys[idx] == key:
+            return idx
+        return -1
+
+    def children(self, idx: int) -> List[int]:
+        child_start, child_count = self.record(idx)[5:7]
+        start = self.children_off + child_start * CHILD.size
+        return [
+            CHILD.unpack_from(self.view, start + pos * CHILD.size)[0]
+            for pos in range(child_count)
+        ]
+
+    def child_count(self, idx: int) -> int:
+        return self.record(idx)[6]
+
+    def roots(self) -> List[int]:
+        return [idx for idx in range(self.count) if self.record(idx)[4] < 0]
+
+    def attributes(self, idx: int, wanted: Optional[set] = None) -> Dict[str, List[bytes]]:
+        blob_off, blob_len = self.record(idx)[2:4]
+        start = self.blobs_off + blob_off
+        return decode_attributes(self.view[start : start + blob_len], wanted)
+
+    def subtree(self, idx: int) -> Iterable[int]:
+        stack = [idx]
+        while stack:
+            current = stack.pop()
+            yield current
+            stack.extend(reversed(self.children(current)))
+
+
+class _KeyView:
+    """Sequence of DN keys, as needed by bisect."""
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self) -> int:
+        return self.snapshot.count
+
+    def __getitem__(self, idx: int) -> bytes:
+        return self.snapshot.key(idx)
+
+
+class SnapshotLDAPObject:
+    """python-ldap connection lookalike serving searches from a snapshot."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.snapshot = Snapshot(path)
+        self.last_check = time.monotonic()
+
+    def _maybe_reload(self) -> None:
+        """Switch to a refreshed snapshot once the refresh tool replaced it."""
+        now = time.monotonic()
+        if now - self.last_check < RELOAD_CHECK_INTERVAL:
+            return
+        self.last_check = now
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if stat.st_ino != self.snapshot.stat.st_ino or stat.st_mtime != self.snapshot.stat.st_mtime:
+            logger.info(f"Reloading refreshed snapshot {self.path}")
+            # Searches still running hold the old snapshot: its map is
+            # closed when the last of them drops it, not here
+            self.snapshot = Snapshot(self.path)
+
+    def simple_bind_s(self, *_args, **_kwargs) -> None:
+        """Snapshots are read-only and carry no access control."""
+
+    def unbind_s(self) -> None:
+        self.snapshot.close()
+
+    def search_subschemasubentry_s(self, _dn: str = ""):
+        return None
+
+    def search_s(self, base, scope, filterstr="(objectClass=*)", attrlist=None, attrsonly=0):
+        self._maybe_reload()
+        snapshot = self.snapshot
+
+        if not base:
+            return self._search_root(snapshot, scope, filterstr)
+
+        idx = snapshot.find(base)
+        if idx < 0:
+            raise ldap.NO_SUCH_OBJECT({"desc": "No such object", "matched": "", "info": base})
+
+        if scope == SCOPE_BASE:
+            candidates: Iterable[int] = [idx]
+        elif scope == SCOPE_ONELEVEL:
+            candidates = snapshot.children(idx)
+        else:
+            candidates = snapshot.subtree(idx)
+
+        return self._filter(snapshot, candidates, filterstr, attrlist)
+
+    def _search_root(self, snapshot: Snapshot, scope: int, filterstr: str):
+        """Answer root DSE reads and searches below the empty DN."""
+        roots = snapshot.roots()
+        if scope == SCOPE_BASE:
+            contexts = [snapshot.dn(idx).encode("utf-8") for idx in roots]
+            return [("", {"namingContexts": contexts})]
+        if scope == SCOPE_ONELEVEL:
+            return self._filter(snapshot, roots, filterstr, None)
+        return self._filter(
+            snapshot, (idx for root in roots for idx in snapshot.subtree(root)), filterstr, None
+        )
+
+    def _filter(
+        self, snapshot: Snapshot, candidates: Iterable[int], filterstr: str,
+        attrlist: Optional[list],
+    ):
+        """Return the candidates of a snapshot matching a filter."""
+        node = parse_filter(filterstr)
+        match_all = node == MATCH_ALL
+
+        no_attrs = attrlist is not None and list(attrlist) in (["1.1"], [])
+        wanted = None
+        if attrlist and not no_attrs and "*" not in attrlist:
+            wanted = {name.lower() for name in attrlist}
+
+        results = []
+        for idx in candidates:
+            if match_all:
+                attrs = {} if no_attrs else snapshot.attributes(idx, wanted)
+            else:
+                attrs = snapshot.attributes(idx)
+                lowered = {name.lower(): values for name, values in attrs.items()}
+                if not match_filter(node, lowered):
+                    continue
+                if no_attrs:
+                    attrs = {}
+                elif wanted is not None:
+                    attrs = {k: v for k, v in attrs.items() if k.lower() in wanted}
+            results.append((snapshot.dn(idx), attrs))
+        return results
+
+
+# =============================================================
+# Refresh tool
+# =============================================================
+
+
+@click.command()
+@click.option(
+    "--output",
+    default=lambda: settings.cache.snapshot_path,
+    help="Snapshot file to (re)build",
+)
+@click.option("--base-dn", default=None, help="Subtree to snapshot (defaults to the base DN)")
+@click.option("--page-size", default=500, type=int, help="Paged search size")
+def main(output: str, base_dn: Optional[str], page_size: int) -> None:
+    """Rebuild the directory snapshot from the LDAP server, atomically."""
+    # pylint: disable=import-outside-toplevel
+    from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+
+    if not output:
+        raise click.UsageError("No snapshot path: set cache.snapshot_path or use --output")
+
+    config = LDAPConfig(
+        uri=settings.authldap.uri,
+        bind_dn=settings.authldap.bind_dn,
+        bind_password=settings.authldap.bind_pass,
+        base_dn=settings.authldap.base_dn,
+    )
+    ldap_connection = LDAPConnectionImproved(config, base_dn=base_dn)
+    ldap_connection.connect()
+
+    start = time.perf_counter()
+    entries = (
+        entry
+        for page in ldap_connection.iter_search(
+            base_dn=base_dn, scope=SCOPE_SUBTREE, page_size=page_size, raw=True
+        )
+        for entry in page
+    )
+    count = write_snapshot(entries, output)
+    ldap_connection.disconnect()
+
+    click.echo(f"Snapshot of {count} entries written to {output} "
+               f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+LDIF stream - Streaming parser and writer of LDIF content and change records
+
+Records are yielded one at a time while the file is read, so files of any
+size are parsed in constant memory. Content records (no changetype) are
+returned as adds. Supported change types: add, modify, delete, modrdn and
+moddn (RFC 2849).
+"""
+
+import base64
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, TextIO, Tuple
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import ldap
+
+CHANGE_TYPES = ("add", "modify", "delete", "modrdn", "moddn")
+
+MOD_OPS = {
+    "add": ldap.MOD_ADD,
+    "delete": ldap.MOD_DELETE,
+    "replace": ldap.MOD_REPLACE,
+}
+
+
+class LDIFError(ValueError):
+    """Malformed LDIF record."""
+
+    def __init__(self, line: int, text: str):
+        super().__init__(f"Line {line}: {text}")
+        self.line = line
+
+
+@dataclass
+class LDIFRecord:
+    """A change record, numbered in file order from 0."""
+
+    number: int
+    line: int
+    dn: str
+    changetype: str
+    # add: [(attr, [values])], modify: [(mod_op, attr, [values] or None)]
+    modlist: List[tuple] = field(default_factory=list)
+    # modrdn/moddn
+    newrdn: Optional[str] = None
+    deleteoldrdn: bool = True
+    newsuperior: Optional[str] = None
+
+
+def _read_lines(stream: TextIO) -> Iterator[Tuple[int, Optional[str]]]:
+    """Yield (line number, unfolded line), None for record separators."""
+    current, start = None, 0
+    for number, line in enumerate(stream, 1):
+        line = line.rstrip("\r\n")
+        if line.startswith(" ") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+            current = None
+        if line.startswith("#"):
+            continue
+        if not line:
+            yield number, None
+            continue
+        current, start = line, number
+    if current is not None:
+        yield start, current
+    yield 0, None
+
+
+def _parse_line(number: int, line: str) -> Tuple[str, bytes]:
+    if line == "-":
+        return "-", b""
+    name, sep, value = line.partition(":")
+    if not sep:
+        raise LDIFError(number, f"Missing ':' in {line!r}")
+    if value.startswith(":"):
+        try:
+            return name, base64.b64decode(value[1:].strip(), validate=True)
+        except ValueError as err:
+            raise LDIFError(number, f"Invalid base64 value: {err}") from err
+    if value.startswith("<"):
+        url = urlparse(value[1:].strip())
+        if url.scheme != "file":
+            raise LDIFError(number, f"Unsupported URL: {value[1:].strip()}")
+        with open(url2pathname(url.path), "rb") as value_file:
+            return name, value_file.read()
+    return name, value.lstrip(" ").encode("utf-8")
+
+
+def _build_record(number: int, lines: List[Tuple[int, str, bytes]]) -> Optional[LDIFRecord]:
+    line, name, value = lines[0]
+    if name.lower() == "version":
+        if len(lines) == 1:
+            return None
+        lines = lines[1:]
+        line, name, value = lines[0]
+    if name.lower() != "dn":
+        raise LDIFError(line, "Record does not start with dn:")
+
+    record = LDIFRecord(number=number, line=line, dn=value.decode("utf-8"), changetype="add")
+    rest = [item for item in lines[1:] if item[1].lower() != "control"]
+    if rest and rest[0][1].lower() == "changetype":
+        record.changetype = rest[0][2].decode("utf-8").strip().lower()
+        rest = rest[1:]
+        if record.changetype not in CHANGE_TYPES:
+            raise LDIFError(line, f"Invalid changetype {record.changetype}")
+
+    if record.changetype == "add":
+        attrs = {}
+        for _, name, value in rest:
+            attrs.setdefault(name, []).append(value)
+        record.modlist = list(attrs.items())
+    elif record.changetype == "modify":
+        record.modlist = _parse_modify(rest)
+    elif record.changetype in ("modrdn", "moddn"):
+        values = {name.lower(): value.decode("utf-8") for _, name, value in rest}
+        if "newrdn" not in values:
+            raise LDIFError(line, "Missing newrdn")
+        record.newrdn = values["newrdn"]
+        record.deleteoldrdn = values.get("deleteoldrdn", "1").strip() != "0"
+        record.newsuperior = values.get("newsuperior")
+    return record
+
+
+def _parse_modify(lines: List[Tuple[int, str, bytes]]) -> List[tuple]:
+    modlist = []
+    index = 0
+    while index < len(lines):
+        line, op_name, attr = lines[index]
+        mod_op = MOD_OPS.get(op_name.lower())
+        if mod_op is None:
+            raise LDIFError(line, f"Invalid modify operation {op_name}")
+        attr = attr.decode("utf-8").strip()
+        values = []
+        index += 1
+        while index < len(lines) and lines[index][1] != "-":
+            line, name, value = lines[index]
+            if name.lower() != attr.lower():
+                raise LDIFError(line, f"Value of {name} in a {op_name} of {attr}")
+            values.append(value)
+            index += 1
+        index += 1  # Skip "-"
+        modlist.append((mod_op, attr, values or None))
+    return modlist
+
+
+def iter_ldif_records(stream: TextIO) -> Iterator[LDIFRecord]:
+    """Yield the records of an LDIF stream, in file order."""
+    lines = []
+    number = 0
+    for line_number, line in _read_lines(stream):
+        if line is not None:
+            lines.append((line_number, *_parse_line(line_number, line)))
+            continue
+        if not lines:
+            continue
+        record = _build_record(number, lines)
+        lines = []
+        if record is not None:
+            yield record
+            number += 1
+
+
+# =============================================================
+# Writer
+# =============================================================
+
+MOD_OP_NAMES = {mod_op: name for name, mod_op in MOD_OPS.items()}
+
+
+def _is_safe(value: bytes) -> bool:
+    """Tell if a value can be written as is (SAFE-STRING of RFC 2849)."""
+    if not value:
+        return True
+    if value[0] in b" :<" or value[-1:] == b" ":
+        return False
+    return all(0 < byte < 0x80 and byte not in (0x0A, 0x0D) for byte in value)
+
+
+class LDIFChangeWriter:
+    """Write add, modify and delete change records to a text stream."""
+
+    def __init__(self, stream: TextIO, cols: int = 76):
+        self.stream = stream
+        self.cols = cols
+        self.records_written = 0
+
+    def _line(self, name: str, value) -> None:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        if _is_safe(value):
+            line = f"{name}: {value.decode('ascii')}"
+        else:
+            line = f"{name}:: {base64.b64encode(value).decode('ascii')}"
+
+        self.stream.write(line[: self.cols])
+        self.stream.write("\n")
+        for pos in range(self.cols, len(line), self.cols - 1):
+            self.stream.write(" ")
+            self.stream.write(line[pos : pos + self.cols - 1])
+            self.stream.write("\n")
+
+    def _end(self) -> None:
+        self.stream.write("\n")
+        self.records_written += 1
+
+    def add(self, dn: str, attributes) -> None:
+        self._line("dn", dn)
+        self._line("changetype", "add")
+        for name, values in attributes.items():
+            for value in values:
+                self._line(name, value)
+        self._end()
+
+    def modify(self, dn: str, modlist: List[tuple]) -> None:
+        self._line("dn", dn)
+        self._line("changetype", "modify")
+        for mod_op, attr, values in modlist:
+            self._line(MOD_OP_NAMES[mod_op], attr)
+            for value in values or []:
+                self._line(attr, value)
+            self.stream.write("-\n")
+        self._end()
+
+    def delete(self, dn: str) -> None:
+        self._line("dn", dn)
+        self._line("changetype", "delete")
+        self._end()
@@ -1,4 +1,5 @@
 import logging
+import sys
 from typing import Any, Dict, List, Optional
 
 from textual.app import App, ComposeResult
@@ -8,8 +9,11 @@ from textual.widgets import Footer, Header, Static
 from textual.drivers.web_driver import WebDriver
 
 from ldap_idp.lib_textual.comp_config import AppConfigLoaderMixin
+from ldap_idp.lib_textual.watchdog import LoopWatchdog
+from ldap_idp.lib_textual.wid_debug import DebugPanel
 
 from ldap_idp.config import settings
+from ldap_idp.metrics import METRICS
 
 # Configure logging - only to file, not console
 logging.basicConfig(
@@ -68,6 +72,7 @@ class AppWrapper(App):
 
     BINDINGS = [
         Binding("ctrl+c", "quit_shell", "Quit", show=True),
+        Binding("f12", "toggle_debug_panel", "Debug", show=False),
     ]
 
     DEFAULT_LOG_FILE = "APP.log"
@@ -89,6 +94,9 @@ class AppWrapper(App):
         self.title = app_title
         self.sub_title = app_subtitle
         self.active_subapp = None  # Track the active subapp
+        self.watchdog = None
+        if settings.debug.watchdog:
+            self.watchdog = LoopWatchdog(threshold=settings.debug.watchdog_threshold)
 
         # pprint(self.app_class)
         assert isinstance(
@@ -136,6 +144,7 @@ class AppWrapper(App):
         logger.info("Composing app widgets")
         yield Header(id="app-header")
         yield Footer(id="app-footer")
+        yield DebugPanel(id="debug-panel")
         yield self.app_class(id="app-wrapped-widget")
 
 
@@ -145,6 +154,13 @@ class AppWrapper(App):
     def on_mount(self) -> None:
         """Called when the app is mounted."""
         logger.info("App mounted successfully")
+        debug_panel = self.query_one("#debug-panel", DebugPanel)
+        debug_panel.add_section("Performance", METRICS.render)
+        if self.watchdog:
+            self.watchdog.start()
+            debug_panel.add_section(
+                "Event loop", lambda: self.watchdog.report(limit=8, stacks=False)
+            )
 
     def on_exit(self) -> None:
         """Called when the app is exiting."""
@@ -161,7 +177,17 @@ class AppWrapper(App):
     def is_cli_mode(self) -> bool:
         """Check if the application is running in CLI mode."""
         return not self.is_web_mode()
-    
+
+    def report_watchdog(self) -> None:
+        """Stop the watchdog, log its top blockers, and print them on a terminal."""
+        if not self.watchdog:
+            return
+        self.watchdog.stop()
+        report = self.watchdog.report()
+        logger.info(report)
+        if self.watchdog.stalls and sys.stderr.isatty():
+            print(report, file=sys.stderr)
+
     # Bindings
     # ---------------------------
 
@@ -177,3 +203,7 @@ class AppWrapper(App):
             self.exit()
 
         # Implement press-papier/clipboard here
+
+    def action_toggle_debug_panel(self) -> None:
+        """Show or hide the debug panel."""
+        self.query_one("#debug-panel", DebugPanel).toggle()
@@ -0,0 +1,212 @@
+"""
+Event-loop watchdog - Measure the lag of the event loop, catch what blocks it
+
+A heartbeat task sleeps on the event loop and measures how late it wakes
+up. A thread watches the heartbeat: when it is late by more than the
+threshold, the loop thread is stuck in a callback, and its stack is
+sampled with sys._current_frames(). Stalls are aggregated by call site (the
+innermost application frame) and handler (the outermost application frame
+calling it, e.g. a watch_* or on_* method).
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Frames of these directories are application code, except the library ones
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Heartbeat period, and lags kept for percentiles
+BEAT_INTERVAL = 0.05
+LAG_SAMPLES = 1200
+
+# Frames kept per captured stack
+STACK_DEPTH = 12
+
+
+def percentile(ordered: List[float], ratio: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))]
+
+
+def _in_package(frame) -> bool:
+    return os.path.abspath(frame.f_code.co_filename).startswith(APP_DIR)
+
+
+def _is_app_frame(frame) -> bool:
+    return _in_package(frame) and not os.path.abspath(frame.f_code.co_filename).startswith(LIB_DIR)
+
+
+def describe_stack(frame) -> Dict[str, Any]:
+    """Return the handler, call site, message and stack of a blocked frame."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+
+    # The innermost application frame is the call site, the outermost one
+    # of its call chain (through library frames) the handler
+    innermost = frames[-1] if frames else None
+    site = handler = None
+    for index in range(len(frames) - 1, -1, -1):
+        if site is None:
+            if _is_app_frame(frames[index]):
+                site = handler = frames[index]
+        elif not _in_package(frames[index]):
+            break
+        elif _is_app_frame(frames[index]):
+            handler = frames[index]
+
+    # The Textual message being dispatched, if any
+    message = ""
+    for item in reversed(frames):
+        if item.f_code.co_name == "_dispatch_message":
+            try:
+                message = type(item.f_locals.get("message")).__name__
+            except Exception:  # pylint: disable=broad-except
+                pass
+            break
+
+    def where(item):
+        if item is None:
+            return "?"
+        return f"{os.path.basename(item.f_code.co_filename)}:{item.f_lineno} {item.f_code.co_name}"
+
+    return {
+        "handler": handler.f_code.co_qualname if handler else f"({message or 'framework'})",
+        "site": where(site or innermost),
+        "blocking": where(innermost),
+        "message": message,
+        "stack": traceback.format_list(traceback.extract_stack(frames[-1])[-STACK_DEPTH:])
+        if frames else [],
+    }
+
+
+class LoopWatchdog:
+    """Measure event-loop lag, and record the callbacks blocking it.
+
+    Start it from the event loop (e.g. in on_mount); stalls longer than
+    threshold seconds are aggregated in blockers.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = BEAT_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.lags = deque(maxlen=LAG_SAMPLES)
+        self.beats = 0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.blockers: Dict[tuple, Dict[str, Any]] = {}
+
+        self._lock = threading.Lock()
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stall_sample: Optional[Dict[str, Any]] = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _beat(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+            with self._lock:
+                self._last_beat = now
+                sample, self._stall_sample = self._stall_sample, None
+                self.beats += 1
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+                if lag >= self.threshold:
+                    self.stalls += 1
+                    if sample is not None:
+                        self._record(sample, lag)
+
+    def _watch(self) -> None:
+        """Sample the loop thread stack once per stall."""
+        period = max(self.threshold / 2, 0.01)
+        while not self._stop.wait(period):
+            with self._lock:
+                late = time.monotonic() - self._last_beat - self.interval
+                if late < self.threshold or self._stall_sample is not None:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread)  # pylint: disable=protected-access
+            if frame is None:
+                continue
+            sample = describe_stack(frame)
+            with self._lock:
+                self._stall_sample = sample
+
+    def _record(self, sample: Dict[str, Any], lag: float) -> None:
+        key = (sample["handler"], sample["site"])
+        blocker = self.blockers.get(key)
+        if blocker is None:
+            blocker = self.blockers[key] = dict(sample, count=0, total=0.0, max=0.0)
+        blocker["count"] += 1
+        blocker["total"] += lag
+        blocker["max"] = max(blocker["max"], lag)
+        blocker["stack"] = sample["stack"]
+
+    # Reports
+    # =============================================================
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            ordered = sorted(self.lags)
+        return {
+            "beats": self.beats,
+            "p50": percentile(ordered, 0.5),
+            "p99": percentile(ordered, 0.99),
+            "max": self.max_lag,
+            "stalls": self.stalls,
+        }
+
+    def top_blockers(self, limit: int = 10) -> List[Dict[str, Any]]:
+        with self._lock:
+            blockers = list(self.blockers.values())
+        return sorted(blockers, key=lambda item: item["total"], reverse=True)[:limit]
+
+    def report(self, limit: int = 10, stacks: bool = True) -> str:
+        """Return the lag summary and the top blockers, as text."""
+        summary = self.summary()
+        lines = [
+            f"Event loop: lag p50 {summary['p50'] * 1000:.1f}ms, "
+            f"p99 {summary['p99'] * 1000:.1f}ms, max {summary['max'] * 1000:.0f}ms, "
+            f"{summary['stalls']} stalls over {self.threshold * 1000:.0f}ms"
+        ]
+        blockers = self.top_blockers(limit)
+        if blockers:
+            lines.append("Top blockers (total, max, count, handler, call site):")
+        for blocker in blockers:
+            lines.append(
+                f"  {blocker['total'] * 1000:8.0f}ms {blocker['max'] * 1000:7.0f}ms "
+                f"{blocker['count']:5}x  {blocker['handler']}  at {blocker['site']}"
+            )
+            if stacks:
+                lines.extend(
+                    "      " + line
+                    for entry in blocker["stack"]
+                    for line in entry.rstrip().splitlines()
+                )
+        return "\n".join(lines)
@@ -0,0 +1,64 @@
+import logging
+from typing import Callable, List, Tuple
+
+from rich.console import Group
+from rich.text import Text
+from textual.widgets import Static
+
+logger = logging.getLogger(__name__)
+
+
+class DebugPanel(Static):
+    """Side panel of runtime diagnostics, refreshed every second while shown.
+
+    Sections are (title, callable) pairs, the callable returning a Rich
+    renderable or a string; add_section() registers more of them.
+    """
+
+    DEFAULT_CSS = """
+    DebugPanel {
+        dock: right;
+        width: 60;
+        height: 100%;
+        padding: 0 1;
+        border-left: solid $primary;
+        background: $surface;
+        display: none;
+    }
+    DebugPanel.visible {
+        display: block;
+    }
+    """
+
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sections: List[Tuple[str, Callable]] = []
+        self._timer = None
+
+    def add_section(self, title: str, render: Callable) -> None:
+        self.sections.append((title, render))
+
+    def on_mount(self) -> None:
+        self._timer = self.set_interval(self.REFRESH_INTERVAL, self.update_sections, pause=True)
+
+    def toggle(self) -> None:
+        self.toggle_class("visible")
+        if self.has_class("visible"):
+            self.update_sections()
+            self._timer.resume()
+        else:
+            self._timer.pause()
+
+    def update_sections(self) -> None:
+        parts = []
+        for title, render in self.sections:
+            parts.append(Text(title, style="bold underline"))
+            try:
+                parts.append(render())
+            except Exception as err:  # pylint: disable=broad-except
+                logger.warning(f"Debug panel section {title} failed: {err}")
+                parts.append(Text(str(err), style="red"))
+            parts.append(Text(""))
+        self.update(Group(*parts))
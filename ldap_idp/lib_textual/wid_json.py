@@ -0,0 +1,404 @@
+"""
+JSON view - Virtualized tree of nested dicts and lists
+
+Only the visible lines are formatted: rows are light references to the
+values, and the children of a collapsed node are not created until it is
+expanded. Updating the view with 20k results costs one row per result.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from rich.cells import cell_len
+from rich.text import Text
+from textual import events
+from textual.binding import Binding
+from textual.cache import LRUCache
+from textual.geometry import Region, Size
+from textual.reactive import reactive
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+
+logger = logging.getLogger(__name__)
+
+# Rows created by the automatic expansion of update()
+EXPAND_LIMIT = 2000
+
+# Characters of a value displayed, and of the preview of a collapsed node
+MAX_VALUE_CHARS = 500
+PREVIEW_CHARS = 80
+
+
+class JSONNode:
+    """A row of the view: a value, and its key in its parent."""
+
+    __slots__ = ("key", "value", "depth", "parent", "expanded")
+
+    def __init__(self, key, value, depth: int, parent: Optional["JSONNode"]):
+        self.key = key
+        self.value = value
+        self.depth = depth
+        self.parent = parent
+        self.expanded = False
+
+    @property
+    def expandable(self) -> bool:
+        return isinstance(self.value, (dict, list, tuple)) and len(self.value) > 0
+
+    @property
+    def path(self) -> Tuple:
+        path = []
+        node = self
+        while node is not None:
+            path.append(node.key)
+            node = node.parent
+        return tuple(reversed(path))
+
+    def children(self) -> List["JSONNode"]:
+        items = self.value.items() if isinstance(self.value, dict) else enumerate(self.value)
+        return [JSONNode(key, value, self.depth + 1, self) for key, value in items]
+
+
+def format_scalar(value: Any) -> Tuple[str, str]:
+    """Return the text of a scalar value, and its component class."""
+    if isinstance(value, bool) or value is None:
+        return repr(value), "json-view--literal"
+    if isinstance(value, (int, float)):
+        return repr(value), "json-view--number"
+    if isinstance(value, bytes):
+        text = repr(value[:MAX_VALUE_CHARS])
+        return (text if len(value) <= MAX_VALUE_CHARS else text + "…"), "json-view--string"
+    text = value if isinstance(value, str) else str(value)
+    if len(text) > MAX_VALUE_CHARS:
+        text = text[:MAX_VALUE_CHARS] + "…"
+    return repr(text), "json-view--string"
+
+
+def format_preview(value: Any, limit: int = PREVIEW_CHARS) -> Tuple[str, bool]:
+    """Return a one line preview of a container, and whether it is complete."""
+    is_dict = isinstance(value, dict)
+    items = value.items() if is_dict else enumerate(value)
+    parts = []
+    size = 0
+    for key, item in items:
+        if isinstance(item, (dict, list, tuple)):
+            text = ("{…}" if isinstance(item, dict) else "[…]") if item else repr(item)
+            complete = not item
+        else:
+            text, _style = format_scalar(item)
+            complete = True
+        text = f"{key!r}: {text}" if is_dict else text
+        size += len(text) + 2
+        if size > limit:
+            parts.append("…")
+            break
+        parts.append(text)
+        if not complete:
+            size = limit + 1
+    body = ", ".join(parts)
+    full = size <= limit
+    return ("{" + body + "}" if is_dict else "[" + body + "]"), full
+
+
+class JSONView(ScrollView, can_focus=True):
+    """Tree view of nested data, rendering only the visible lines."""
+
+    DEFAULT_CSS = """
+    JSONView {
+        height: 1fr;
+        background: $surface;
+    }
+    JSONView > .json-view--key {
+        color: $text-primary;
+        text-style: bold;
+    }
+    JSONView > .json-view--string {
+        color: $text-success;
+    }
+    JSONView > .json-view--number {
+        color: $text-accent;
+    }
+    JSONView > .json-view--literal {
+        color: $text-warning;
+        text-style: italic;
+    }
+    JSONView > .json-view--guide {
+        color: $text-muted;
+    }
+    JSONView > .json-view--cursor {
+        background: $block-cursor-blurred-background;
+    }
+    JSONView:focus > .json-view--cursor {
+        background: $block-cursor-background;
+    }
+    """
+
+    COMPONENT_CLASSES = {
+        "json-view--key",
+        "json-view--string",
+        "json-view--number",
+        "json-view--literal",
+        "json-view--guide",
+        "json-view--cursor",
+    }
+
+    BINDINGS = [
+        Binding("up", "cursor_up", "Cursor up", show=False),
+        Binding("down", "cursor_down", "Cursor down", show=False),
+        Binding("pageup", "page_up", "Page up", show=False),
+        Binding("pagedown", "page_down", "Page down", show=False),
+        Binding("home", "cursor_home", "First line", show=False),
+        Binding("end", "cursor_end", "Last line", show=False),
+        Binding("enter,space", "toggle_node", "Toggle", show=False),
+        Binding("right", "expand_node", "Expand", show=False),
+        Binding("left", "collapse_node", "Collapse", show=False),
+    ]
+
+    cursor_line: reactive[int] = reactive(0, always_update=True)
+
+    def __init__(self, data: Any = None, *args, expand_limit: int = EXPAND_LIMIT, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expand_limit = expand_limit
+        self.rows: List[JSONNode] = []
+        self._max_width = 0
+        self._line_cache: LRUCache[tuple, Strip] = LRUCache(1024)
+        # Nodes expanded or collapsed by the user, by path, kept across updates
+        self._toggled: Dict[Tuple, bool] = {}
+        self.update(data)
+
+    # Data
+    # =============================================================
+
+    def update(self, data: Any) -> None:
+        """Display data, expanding its first levels up to expand_limit rows."""
+        self._line_cache.clear()
+        self._max_width = 0
+        root = JSONNode(None, data, -1, None)
+        if root.expandable:
+            root.expanded = True
+            self.rows = root.children()
+            self._expand_levels()
+            self._apply_toggles()
+        else:
+            root.depth = 0
+            self.rows = [root]
+        self._update_size()
+        self.cursor_line = min(self.cursor_line, max(0, len(self.rows) - 1))
+        self.refresh()
+
+    def _expand_levels(self) -> None:
+        """Expand nodes level by level, while the rows fit in expand_limit."""
+        depth = 0
+        while True:
+            level = [node for node in self.rows if node.depth == depth and node.expandable]
+            # Count the rows first, the previews of a large level are not needed
+            added = 0
+            for node in level:
+                added += len(node.value)
+                if len(self.rows) + added > self.expand_limit:
+                    return
+            level = [node for node in level if self._auto_expands(node)]
+            if not level:
+                return
+            for node in level:
+                node.expanded = True
+            self.rows = self._flatten(self.rows)
+            depth += 1
+
+    @staticmethod
+    def _auto_expands(node: JSONNode) -> bool:
+        # Small containers of scalars read better on one line
+        return not format_preview(node.value)[1]
+
+    @staticmethod
+    def _flatten(rows: List[JSONNode]) -> List[JSONNode]:
+        """Insert the children of expanded rows which are not listed yet."""
+        flat = []
+        for index, node in enumerate(rows):
+            flat.append(node)
+            listed = index + 1 < len(rows) and rows[index + 1].depth > node.depth
+            if node.expanded and not listed:
+                flat.extend(JSONView._flatten(node.children()))
+        return flat
+
+    def _apply_toggles(self) -> None:
+        for path, expanded in sorted(self._toggled.items(), key=lambda item: len(item[0])):
+            index = self._find(path)
+            if index is not None and self.rows[index].expanded != expanded:
+                self._set_expanded(index, expanded)
+
+    def _find(self, path: Tuple) -> Optional[int]:
+        """Return the row index of a node, if its ancestors are expanded."""
+        index, end = 0, len(self.rows)
+        for depth, key in enumerate(path[1:]):
+            while index < end and not (
+                self.rows[index].depth == depth and self.rows[index].key == key
+            ):
+                index += 1
+            if index >= end:
+                return None
+            if depth == len(path) - 2:
+                return index
+            # Search the children of this node next
+            end = index + 1
+            while end < len(self.rows) and self.rows[end].depth > depth:
+                end += 1
+            index += 1
+        return None
+
+    def _set_expanded(self, index: int, expanded: bool) -> None:
+        node = self.rows[index]
+        if not node.expandable or node.expanded == expanded:
+            return
+        node.expanded = expanded
+        if expanded:
+            self.rows[index + 1:index + 1] = self._flatten(node.children())
+        else:
+            end = index + 1
+            while end < len(self.rows) and self.rows[end].depth > node.depth:
+                end += 1
+            del self.rows[index + 1:end]
+        self._line_cache.clear()
+        self._update_size()
+        self.refresh()
+
+    def toggle(self, index: int) -> None:
+        node = self.rows[index]
+        self._toggled[node.path] = not node.expanded
+        self._set_expanded(index, not node.expanded)
+
+    # Rendering
+    # =============================================================
+
+    def _update_size(self) -> None:
+        self.virtual_size = Size(self._max_width, len(self.rows))
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        index = scroll_y + y
+        width = self.size.width
+        rich_style = self.rich_style
+        if index >= len(self.rows):
+            return Strip.blank(width, rich_style)
+
+        strip = self._render_row(index)
+        if index == self.cursor_line:
+            base = rich_style + self.get_component_rich_style("json-view--cursor")
+            strip = strip.apply_style(base).extend_cell_length(width + scroll_x, base)
+        else:
+            strip = strip.apply_style(rich_style)
+        return strip.crop_extend(scroll_x, scroll_x + width, rich_style).apply_offsets(
+            scroll_x, index
+        )
+
+    def _render_row(self, index: int) -> Strip:
+        node = self.rows[index]
+        key = (id(node), node.expanded)
+        strip = self._line_cache.get(key)
+        if strip is not None:
+            return strip
+
+        style = self.get_component_rich_style
+        text = Text(no_wrap=True, end="")
+        text.append("  " * node.depth, style("json-view--guide"))
+        if node.expandable:
+            text.append("▼ " if node.expanded else "▶ ", style("json-view--guide"))
+        else:
+            text.append("  ")
+        if node.key is not None:
+            label = f"[{node.key}]" if isinstance(node.key, int) else str(node.key)
+            text.append(label, style("json-view--key"))
+            text.append(": ")
+
+        value = node.value
+        if isinstance(value, (dict, list, tuple)):
+            if node.expanded:
+                kind = "key" if isinstance(value, dict) else "item"
+                plural = "s" if len(value) > 1 else ""
+                text.append(f"{len(value)} {kind}{plural}", style("json-view--guide"))
+            else:
+                preview, _full = format_preview(value)
+                text.append(preview, style("json-view--guide"))
+        else:
+            value_text, value_class = format_scalar(value)
+            text.append(value_text, style(value_class))
+
+        strip = Strip(text.render(self.app.console), cell_len(text.plain))
+        self._line_cache[key] = strip
+        if strip.cell_length > self._max_width:
+            self._max_width = strip.cell_length
+            self.call_later(self._update_size)
+        return strip
+
+    def notify_style_update(self) -> None:
+        super().notify_style_update()
+        self._line_cache.clear()
+
+    # Cursor
+    # =============================================================
+
+    def watch_cursor_line(self, previous: int, line: int) -> None:
+        self.refresh(Region(0, previous - self.scroll_offset.y, self.size.width, 1))
+        self.refresh(Region(0, line - self.scroll_offset.y, self.size.width, 1))
+        self.scroll_to_region(
+            Region(0, line, 1, 1), animate=False, force=True, immediate=False
+        )
+
+    def validate_cursor_line(self, line: int) -> int:
+        return max(0, min(line, len(self.rows) - 1))
+
+    def action_cursor_up(self) -> None:
+        self.cursor_line -= 1
+
+    def action_cursor_down(self) -> None:
+        self.cursor_line += 1
+
+    def action_page_up(self) -> None:
+        self.cursor_line -= self.scrollable_content_region.height
+
+    def action_page_down(self) -> None:
+        self.cursor_line += self.scrollable_content_region.height
+
+    def action_cursor_home(self) -> None:
+        self.cursor_line = 0
+
+    def action_cursor_end(self) -> None:
+        self.cursor_line = len(self.rows) - 1
+
+    def action_toggle_node(self) -> None:
+        if self.rows:
+            self.toggle(self.cursor_line)
+
+    def action_expand_node(self) -> None:
+        """Expand the node, or move to its first child if expanded."""
+        if not self.rows:
+            return
+        node = self.rows[self.cursor_line]
+        if node.expandable and not node.expanded:
+            self.toggle(self.cursor_line)
+        elif node.expanded:
+            self.cursor_line += 1
+
+    def action_collapse_node(self) -> None:
+        """Collapse the node, or move to its parent if collapsed."""
+        if not self.rows:
+            return
+        node = self.rows[self.cursor_line]
+        if node.expanded:
+            self.toggle(self.cursor_line)
+            return
+        index = self.cursor_line - 1
+        while index >= 0 and self.rows[index].depth >= node.depth:
+            index -= 1
+        if index >= 0:
+            self.cursor_line = index
+
+    def on_click(self, event: events.Click) -> None:
+        offset = event.get_content_offset(self)
+        if offset is None:
+            return
+        index = self.scroll_offset.y + offset.y
+        if index < len(self.rows):
+            if index == self.cursor_line:
+                self.toggle(index)
+            self.cursor_line = index
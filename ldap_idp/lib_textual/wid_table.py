@@ -0,0 +1,159 @@
+"""
+Virtual table - Table of a columnar result store, rendering the visible rows
+
+Unlike DataTable, no row is copied into the widget: lines are rendered
+from the store view when displayed, so sorting or patching a store of
+200k rows only refreshes one screen of lines.
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+from rich.cells import cell_len, set_cell_size
+from rich.segment import Segment
+from textual import events
+from textual.cache import LRUCache
+from textual.geometry import Size
+from textual.message import Message
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+
+from ldap_idp.columnar import ResultStore
+
+logger = logging.getLogger(__name__)
+
+# Cells wider than this are truncated
+MAX_COLUMN_WIDTH = 50
+
+# Spaces on each side of a cell
+CELL_PADDING = 1
+
+
+def fit(text: str, width: int) -> str:
+    """Pad or truncate text to width cells."""
+    if cell_len(text) <= width:
+        return set_cell_size(text, width)
+    return set_cell_size(text, width - 1) + "…"
+
+
+class VirtualTable(ScrollView, can_focus=True):
+    """Table of a ResultStore view, with a fixed header of clickable columns."""
+
+    DEFAULT_CSS = """
+    VirtualTable {
+        height: 1fr;
+        background: $surface;
+    }
+    VirtualTable > .virtual-table--header {
+        text-style: bold;
+        background: $panel;
+        color: $foreground;
+    }
+    """
+
+    COMPONENT_CLASSES = {"virtual-table--header"}
+
+    class HeaderSelected(Message):
+        """Posted when a column header is clicked."""
+
+        def __init__(self, table: "VirtualTable", column_key: str) -> None:
+            self.table = table
+            self.column_key = column_key
+            super().__init__()
+
+        @property
+        def control(self) -> "VirtualTable":
+            return self.table
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store: Optional[ResultStore] = None
+        self.columns: List[str] = []
+        self.widths: Dict[str, int] = {}
+        self._line_cache: LRUCache[int, Strip] = LRUCache(256)
+
+    # Data
+    # =============================================================
+
+    def set_store(self, store: Optional[ResultStore], columns: Optional[List[str]] = None) -> None:
+        """Display the view of a store, for columns (all of them by default)."""
+        self.store = store
+        self.columns = list(columns or (store.names if store else []))
+        widths = store.widths() if store else {}
+        self.widths = {
+            name: min(MAX_COLUMN_WIDTH, max(cell_len(name) + 2, widths.get(name, 0)))
+            for name in self.columns
+        }
+        self.refresh_view()
+
+    def refresh_view(self) -> None:
+        """Render again after the store view changed: sort, filter or patch."""
+        self._line_cache.clear()
+        total = sum(width + 2 * CELL_PADDING for width in self.widths.values())
+        rows = len(self.store) if self.store else 0
+        self.virtual_size = Size(total, rows + 1)
+        self.refresh()
+
+    def clear(self) -> None:
+        self.set_store(None)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.store) if self.store else 0
+
+    # Rendering
+    # =============================================================
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        width = self.size.width
+        if y == 0:
+            strip = self._render_header()
+        else:
+            index = scroll_y + y - 1
+            if self.store is None or index >= len(self.store):
+                return Strip.blank(width, self.rich_style)
+            strip = self._line_cache.get(index)
+            if strip is None:
+                strip = self._line_cache[index] = self._render_row(index)
+        return strip.crop_extend(scroll_x, scroll_x + width, self.rich_style)
+
+    def _render_header(self) -> Strip:
+        style = self.get_component_rich_style("virtual-table--header")
+        store = self.store
+        cells = []
+        for name in self.columns:
+            label = name
+            if store is not None and store.sort_column == name:
+                label += " ▼" if store.sort_reverse else " ▲"
+            cells.append(" " * CELL_PADDING + fit(label, self.widths[name]) + " " * CELL_PADDING)
+        text = "".join(cells)
+        return Strip([Segment(text, style)], cell_len(text))
+
+    def _render_row(self, index: int) -> Strip:
+        store = self.store
+        row = store.view[index]
+        padding = " " * CELL_PADDING
+        text = "".join(
+            padding + fit(store.cell(row, name), self.widths[name]) + padding
+            for name in self.columns
+        )
+        return Strip([Segment(text, self.rich_style)], cell_len(text))
+
+    def notify_style_update(self) -> None:
+        super().notify_style_update()
+        self._line_cache.clear()
+
+    # Events
+    # =============================================================
+
+    def on_click(self, event: events.Click) -> None:
+        offset = event.get_content_offset(self)
+        if offset is None or offset.y != 0:
+            return
+        x = offset.x + self.scroll_offset.x
+        for name in self.columns:
+            x -= self.widths[name] + 2 * CELL_PADDING
+            if x < 0:
+                self.post_message(self.HeaderSelected(self, name))
+                return
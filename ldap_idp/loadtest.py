@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+Load test - Concurrent simulated web sessions against ldapcp-serve
+
+Each session opens the websocket of textual-serve, as a browser tab does,
+and plays a script of keystrokes. The latency of a keystroke is the time
+until the first frame the app sends back after it; spawn time is the time
+from connecting to the first frame, and until the screen settles.
+
+While sessions run, the memory of the server process tree is sampled from
+/proc, and the operations it made are read from the cn=Monitor backend of
+the LDAP server (OpenLDAP), before and after the run.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import click
+import yaml
+
+from ldap_idp.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Terminal input of key names, other keys are sent as typed
+KEYS = {
+    "up": "\x1b[A",
+    "down": "\x1b[B",
+    "right": "\x1b[C",
+    "left": "\x1b[D",
+    "home": "\x1b[H",
+    "end": "\x1b[F",
+    "pageup": "\x1b[5~",
+    "pagedown": "\x1b[6~",
+    "enter": "\r",
+    "tab": "\t",
+    "shift+tab": "\x1b[Z",
+    "escape": "\x1b",
+    "space": " ",
+}
+
+# Browse the tree, then the viewer profiles of the first entity
+DEFAULT_SCRIPT = [
+    {"label": "expand", "keys": ["tab", "space"]},
+    {"label": "browse", "keys": ["down"], "repeat": 200},
+    {"label": "switch", "keys": ["shift+tab", "shift+tab", "right"]},
+    {"label": "viewer", "keys": ["tab", "down", "space"]},
+    {"label": "profiles", "keys": ["down", "space"], "repeat": 5},
+]
+
+# Seconds without frames after which a screen is considered settled
+SETTLE_TIME = 1.0
+
+# Seconds without frames before a keystroke, as a user reading the screen
+KEY_PAUSE = 0.05
+
+# Seconds a new session may take to send its first frame
+SPAWN_TIMEOUT = 30.0
+
+
+# =============================================================
+# Sessions
+# =============================================================
+
+
+class Session:
+    """One simulated browser tab."""
+
+    def __init__(
+        self, number: int, url: str, width: int = 120, height: int = 40, pause: float = KEY_PAUSE
+    ):
+        self.number = number
+        self.url = url
+        self.pause = pause
+        self.width = width
+        self.height = height
+        self.websocket = None
+        self.reader = None
+        self.frames = 0
+        self.last_frame = 0.0
+        self.frame_event = asyncio.Event()
+        self.closed = False
+
+        self.spawn_first_frame: Optional[float] = None
+        self.spawn_ready: Optional[float] = None
+        self.latencies: Dict[str, List[float]] = {}
+        self.timeouts = 0
+        self.error: Optional[str] = None
+
+    async def _read(self) -> None:
+        async for message in self.websocket:
+            if message.type == aiohttp.WSMsgType.BINARY:
+                self.frames += 1
+                self.last_frame = time.monotonic()
+                self.frame_event.set()
+            elif message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.ERROR):
+                break
+        self.closed = True
+        self.frame_event.set()
+
+    async def wait_frame(self, timeout: float) -> Optional[float]:
+        """Wait for the next frame, return when it came or None on timeout."""
+        try:
+            await asyncio.wait_for(self.frame_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return None if self.closed else self.last_frame
+
+    async def settle(self, timeout: float, quiet_time: float = SETTLE_TIME) -> None:
+        """Wait until no frame came for quiet_time, at most timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while not self.closed and time.monotonic() < deadline:
+            quiet = time.monotonic() - self.last_frame
+            if quiet >= quiet_time:
+                return
+            await asyncio.sleep(quiet_time - quiet)
+
+    async def connect(self, http: aiohttp.ClientSession, timeout: float = SPAWN_TIMEOUT) -> None:
+        start = time.monotonic()
+        self.websocket = await http.ws_connect(
+            f"{self.url}/ws?width={self.width}&height={self.height}", heartbeat=15
+        )
+        self.reader = asyncio.create_task(self._read())
+        first = await self.wait_frame(timeout)
+        if first is None:
+            raise RuntimeError(f"No frame within {timeout}s")
+        self.spawn_first_frame = first - start
+        await self.settle(timeout)
+        self.spawn_ready = self.last_frame - start
+
+    async def press(self, key: str, label: str, timeout: float) -> None:
+        """Send a keystroke, and record the time to the next frame."""
+        await self.settle(timeout, self.pause)
+        self.frame_event.clear()
+        start = time.monotonic()
+        await self.websocket.send_json(["stdin", KEYS.get(key, key)])
+        frame = await self.wait_frame(timeout)
+        if frame is None:
+            self.timeouts += 1
+            return
+        self.latencies.setdefault(label, []).append(frame - start)
+
+    async def play(self, script: List[Dict[str, Any]], timeout: float) -> None:
+        for step in script:
+            if "wait" in step:
+                await asyncio.sleep(step["wait"])
+            keys = step.get("keys", [])
+            if isinstance(keys, str):
+                keys = [keys]
+            for _ in range(step.get("repeat", 1)):
+                for key in keys:
+                    if self.closed:
+                        raise RuntimeError("Session closed by the server")
+                    await self.press(key, step.get("label", "keys"), timeout)
+
+    async def close(self) -> None:
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self.reader is not None:
+            await self.reader
+
+
+async def run_session(
+    session: Session, http: aiohttp.ClientSession, script, delay: float, timeout: float
+) -> Session:
+    await asyncio.sleep(delay)
+    try:
+        await session.connect(http)
+        await session.play(script, timeout)
+    except (aiohttp.ClientError, RuntimeError, OSError) as err:
+        session.error = str(err) or type(err).__name__
+        logger.info(f"Session {session.number} failed: {session.error}")
+    finally:
+        await session.close()
+    return session
+
+
+# =============================================================
+# Server metrics
+# =============================================================
+
+
+def process_tree(pid: int) -> List[int]:
+    """Return a process and all its descendants, from /proc."""
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", encoding="utf-8") as stat:
+                # The command may hold spaces and parentheses, the ppid follows the last ")"
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+
+    tree, todo = [], [pid]
+    while todo:
+        current = todo.pop()
+        tree.append(current)
+        todo.extend(children.get(current, []))
+    return tree
+
+
+def memory_kb(pid: int, field: str) -> int:
+    """Return a field of /proc/PID/smaps_rollup (Pss) or status (VmRSS), in kB."""
+    path = f"/proc/{pid}/smaps_rollup" if field == "Pss" else f"/proc/{pid}/status"
+    try:
+        with open(path, encoding="utf-8") as stats:
+            for line in stats:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def tree_memory(pid: int) -> Dict[str, int]:
+    """Return the RSS and PSS of a process tree, and its process count.
+
+    RSS counts pages shared by forked workers once per process; PSS
+    splits them between the processes sharing them.
+    """
+    pids = process_tree(pid)
+    return {
+        "processes": len(pids),
+        "rss": sum(memory_kb(child, "VmRSS") for child in pids),
+        "pss": sum(memory_kb(child, "Pss") for child in pids),
+    }
+
+
+async def sample_memory(pid: int, samples: List[Dict[str, int]], interval: float = 1.0) -> None:
+    while True:
+        samples.append(tree_memory(pid))
+        await asyncio.sleep(interval)
+
+
+def monitor_operations() -> Optional[Dict[str, int]]:
+    """Return the completed operations per type of the LDAP server, from cn=Monitor."""
+    # pylint: disable=import-outside-toplevel
+    from ldap_idp.ldap_backend import SCOPE_SUBTREE, LDAPConfig, LDAPConnection
+
+    config = LDAPConfig(
+        uri=settings.authldap.uri,
+        bind_dn=settings.authldap.bind_dn,
+        bind_password=settings.authldap.bind_pass,
+    )
+    ldap_connection = LDAPConnection(config, base_dn="cn=Monitor")
+    try:
+        ldap_connection.connect()
+    except Exception:  # pylint: disable=broad-except
+        return None
+    try:
+        results = ldap_connection.search(
+            "cn=Operations,cn=Monitor", SCOPE_SUBTREE, attributes=["monitorOpCompleted"]
+        )
+    finally:
+        ldap_connection.disconnect()
+
+    operations = {}
+    for entry in results:
+        values = entry["attributes"].get("monitorOpCompleted")
+        if values:
+            name = entry["dn"].split(",", 1)[0].split("=", 1)[1]
+            operations[name] = int(values[0])
+    return operations or None
+
+
+# =============================================================
+# Report
+# =============================================================
+
+
+def percentiles(samples: List[float]) -> str:
+    """Format latency percentiles in milliseconds."""
+    if not samples:
+        return "n=0"
+    ordered = sorted(samples)
+
+    def pick(ratio):
+        return ordered[min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))] * 1000
+
+    return (
+        f"n={len(samples):<6} mean={statistics.mean(samples) * 1000:7.1f}ms "
+        f"p50={pick(0.5):7.1f}ms p90={pick(0.9):7.1f}ms "
+        f"p99={pick(0.99):7.1f}ms max={ordered[-1] * 1000:7.1f}ms"
+    )
+
+
+def report(sessions: List[Session], memory: List[Dict[str, int]], ops_before, ops_after, elapsed):
+    ok = [session for session in sessions if not session.error]
+    click.echo(f"Sessions: {len(ok)}/{len(sessions)} completed in {elapsed:.1f}s")
+    for session in sessions:
+        if session.error:
+            click.echo(f"  session {session.number}: {session.error}")
+
+    click.echo("Spawn:")
+    click.echo(f"  {'first frame':12} {percentiles([s.spawn_first_frame for s in ok])}")
+    click.echo(f"  {'ready':12} {percentiles([s.spawn_ready for s in ok])}")
+
+    click.echo("Keystroke to frame:")
+    labels = list(dict.fromkeys(label for session in ok for label in session.latencies))
+    everything = []
+    for label in labels:
+        samples = [value for session in ok for value in session.latencies.get(label, [])]
+        everything.extend(samples)
+        click.echo(f"  {label:12} {percentiles(samples)}")
+    click.echo(f"  {'all':12} {percentiles(everything)}")
+    timeouts = sum(session.timeouts for session in sessions)
+    if timeouts:
+        click.echo(f"  {timeouts} keystrokes without a frame")
+
+    if memory:
+        peak = max(memory, key=lambda sample: sample["pss"] or sample["rss"])
+        click.echo(
+            f"Server memory: peak {peak['rss'] / 1024:.0f} MB RSS, "
+            f"{peak['pss'] / 1024:.0f} MB PSS over {peak['processes']} processes, "
+            f"{(peak['pss'] or peak['rss']) / 1024 / max(1, len(sessions)):.1f} MB per session"
+        )
+
+    if ops_before is None or ops_after is None:
+        click.echo("LDAP operations: cn=Monitor not readable")
+        return
+    deltas = {
+        name: ops_after.get(name, 0) - ops_before.get(name, 0)
+        for name in ops_after
+        if ops_after.get(name, 0) - ops_before.get(name, 0)
+    }
+    total = sum(deltas.values())
+    click.echo(
+        f"LDAP operations: {total}, {total / max(1, len(sessions)):.1f} per session"
+    )
+    for name, delta in sorted(deltas.items()):
+        click.echo(f"  {name:12} {delta:8} {delta / max(1, len(sessions)):8.1f}/session")
+
+
+# =============================================================
+# Command line
+# =============================================================
+
+
+def wait_for_port(url: str, timeout: float = 60.0) -> None:
+    """Block until the server answers HTTP requests."""
+
+    async def probe():
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as http:
+            while time.monotonic() < deadline:
+                try:
+                    async with http.get(url):
+                        return
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.2)
+        raise RuntimeError(f"No server on {url} within {timeout}s")
+
+    asyncio.run(probe())
+
+
+async def load_test(
+    url: str, count: int, ramp: float, script, timeout: float, pause: float, server_pid
+):
+    memory: List[Dict[str, int]] = []
+    sampler = asyncio.create_task(sample_memory(server_pid, memory)) if server_pid else None
+    connector = aiohttp.TCPConnector(limit=0)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as http:
+            sessions = [Session(number, url, pause=pause) for number in range(count)]
+            await asyncio.gather(
+                *(
+                    run_session(session, http, script, ramp * number / max(1, count), timeout)
+                    for number, session in enumerate(sessions)
+                )
+            )
+    finally:
+        if sampler:
+            sampler.cancel()
+    return sessions, memory
+
+
+@click.command()
+@click.option("--url", default="http://localhost:8000", help="Base URL of ldapcp-serve")
+@click.option("--sessions", "count", default=10, type=int, help="Concurrent sessions")
+@click.option("--ramp", default=5.0, type=float, help="Seconds over which sessions start")
+@click.option(
+    "--script", "script_path", default=None, type=click.Path(exists=True, dir_okay=False),
+    help="YAML list of steps (keys, repeat, wait, label), default: browse and view",
+)
+@click.option(
+    "--timeout", default=2.0, type=float,
+    help="Seconds to wait for the frame of a keystroke, keys changing nothing on screen wait it all",
+)
+@click.option(
+    "--pause", default=KEY_PAUSE, type=float, help="Seconds without frames before each keystroke"
+)
+@click.option("--server-pid", default=None, type=int, help="Process of a running server, for memory")
+@click.option(
+    "--spawn", is_flag=True,
+    help="Start ldapcp-serve on the --url port for the run, and stop it after",
+)
+@click.option("--workers", default=0, type=int, help="--spawn: warm workers of the server")
+@click.option("--monitor/--no-monitor", default=True, help="Count LDAP operations with cn=Monitor")
+def main(
+    url: str, count: int, ramp: float, script_path: Optional[str], timeout: float, pause: float,
+    server_pid: Optional[int], spawn: bool, workers: int, monitor: bool,
+) -> None:
+    """Open concurrent web sessions against ldapcp-serve and report latencies."""
+    script = DEFAULT_SCRIPT
+    if script_path:
+        with open(script_path, encoding="utf-8") as script_file:
+            script = yaml.safe_load(script_file)
+
+    url = url.rstrip("/")
+    server = None
+    if spawn:
+        port = url.rsplit(":", 1)[1] if url.count(":") > 1 else "8000"
+        server = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", "ldap_idp.serve", "--port", port, "--workers", str(workers)]
+        )
+        server_pid = server.pid
+    try:
+        wait_for_port(url)
+        ops_before = monitor_operations() if monitor else None
+        start = time.monotonic()
+        sessions, memory = asyncio.run(
+            load_test(url, count, ramp, script, timeout, pause, server_pid)
+        )
+        elapsed = time.monotonic() - start
+        ops_after = monitor_operations() if monitor else None
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report(sessions, memory, ops_before, ops_after, elapsed)
+    sys.exit(1 if any(session.error for session in sessions) else 0)
+
+
+if __name__ == "__main__":
+    main()
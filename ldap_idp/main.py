@@ -232,6 +232,8 @@ def main():
         app_class=BigApp,
     )
     app.run()
+    app.report_watchdog()
+    return app.return_code
 
 
 if __name__ == "__main__":
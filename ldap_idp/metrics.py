@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Metrics - Performance counters of the session, shown in the debug panel
+
+A process-wide registry of counters, timers and gauges. Each web session
+runs in its own process, so the counters are those of one session.
+
+    counters   cache hits and misses, errors
+    timers     LDAP operations and view renders: count, total, percentiles
+    gauges     collections held in memory: size and estimated bytes
+"""
+
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from rich.console import Group
+from rich.table import Table
+
+# Durations kept per timer for percentiles
+TIMER_SAMPLES = 500
+
+# Items measured to estimate the size of a collection
+SIZE_SAMPLE = 50
+
+
+def estimate_size(obj: Any, sample: int = SIZE_SAMPLE) -> int:
+    """Estimate the bytes of a structure of dicts, lists, strings and bytes.
+
+    Collections larger than sample are estimated from their first items.
+    """
+    seen = set()
+
+    def size(item, depth=0):
+        if id(item) in seen or depth > 8:
+            return 0
+        seen.add(id(item))
+        total = sys.getsizeof(item)
+        if isinstance(item, dict):
+            items = list(item.items())
+            scale = max(1, len(items) / sample) if len(items) > sample else 1
+            total += scale * sum(
+                size(key, depth + 1) + size(value, depth + 1) for key, value in items[:sample]
+            )
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            items = list(item) if not isinstance(item, (list, tuple)) else item
+            scale = max(1, len(items) / sample) if len(items) > sample else 1
+            total += scale * sum(size(value, depth + 1) for value in items[:sample])
+        return int(total)
+
+    return size(obj)
+
+
+def percentile(ordered, ratio: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(ratio * (len(ordered) - 1))))]
+
+
+class Timer:
+    """Durations of one operation."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=TIMER_SAMPLES)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.samples.append(seconds)
+
+
+class MetricsRegistry:
+    """Counters, timers and gauges, safe to update from worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counters: Dict[str, int] = {}
+        self.timers: Dict[str, Timer] = {}
+        self.gauges: Dict[str, Callable[[], Any]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def hit(self, cache: str, hit: bool) -> None:
+        """Count a lookup of a cache."""
+        self.incr(f"{cache}.{'hit' if hit else 'miss'}")
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = Timer()
+            timer.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def gauge(self, name: str, collection: Callable[[], Any]) -> None:
+        """Register a callable returning a collection held in memory."""
+        self.gauges[name] = collection
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+            self.started = time.monotonic()
+
+    # Reports
+    # =============================================================
+
+    def cache_rates(self) -> Dict[str, tuple]:
+        """Return (hits, misses) per cache."""
+        with self.lock:
+            counters = dict(self.counters)
+        caches = {}
+        for name, value in counters.items():
+            cache, _, kind = name.rpartition(".")
+            if kind in ("hit", "miss"):
+                hits, misses = caches.get(cache, (0, 0))
+                caches[cache] = (hits + value, misses) if kind == "hit" else (hits, misses + value)
+        return caches
+
+    def render(self) -> Group:
+        """Return the metrics as Rich tables: timers, caches, memory and counters."""
+
+        def new_table(*columns):
+            table = Table(box=None, padding=(0, 1), expand=True)
+            table.add_column(columns[0])
+            for column in columns[1:]:
+                table.add_column(column, justify="right")
+            return table
+
+        with self.lock:
+            timers = {
+                name: (timer.count, sorted(timer.samples), timer.max)
+                for name, timer in self.timers.items()
+            }
+            counters = {
+                name: value for name, value in self.counters.items()
+                if not name.endswith((".hit", ".miss"))
+            }
+
+        timer_table = new_table("timer", "calls", "p50", "p95", "max")
+        for name, (count, ordered, longest) in sorted(timers.items()):
+            timer_table.add_row(
+                name,
+                str(count),
+                f"{percentile(ordered, 0.5) * 1000:.1f}ms",
+                f"{percentile(ordered, 0.95) * 1000:.1f}ms",
+                f"{longest * 1000:.0f}ms",
+            )
+
+        cache_table = new_table("cache", "lookups", "hit rate")
+        for cache, (hits, misses) in sorted(self.cache_rates().items()):
+            rate = hits / (hits + misses) if hits + misses else 0.0
+            cache_table.add_row(cache, str(hits + misses), f"{rate:.0%}")
+
+        memory_table = new_table("memory", "items", "bytes")
+        for name, collection in sorted(self.gauges.items()):
+            try:
+                items = collection()
+            except Exception:  # pylint: disable=broad-except
+                continue
+            memory_table.add_row(name, str(len(items)), f"~{format_bytes(estimate_size(items))}")
+
+        counter_table = new_table("counter", "value")
+        for name, value in sorted(counters.items()):
+            counter_table.add_row(name, str(value))
+
+        tables = [timer_table, cache_table, memory_table, counter_table]
+        return Group(*(table for table in tables if table.row_count))
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "kB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+METRICS = MetricsRegistry()
+
+
+def timed(name: str) -> Callable:
+    """Decorate a function to time its calls under name."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# =============================================================
+# LDAP transport
+# =============================================================
+
+# Synchronous calls are timed as they return, asynchronous ones until
+# their result3() returns
+SYNC_OPS = (
+    "simple_bind_s",
+    "search_s",
+    "modify_s",
+    "search_subschemasubentry_s",
+    "read_subschemasubentry_s",
+)
+ASYNC_OPS = ("search_ext", "modify_ext", "add_ext", "delete_ext", "rename")
+ABANDON_OPS = ("abandon", "abandon_ext")
+
+# Requests whose result is never read (abandoned searches, closed pagers)
+# would pile up: beyond this many in flight, the oldest ones are forgotten
+MAX_PENDING = 1000
+
+
+class MeteredLDAPObject:
+    """Transport wrapper timing the LDAP operations of another transport."""
+
+    def __init__(self, transport, metrics: MetricsRegistry = METRICS):
+        self.transport = transport
+        self.metrics = metrics
+        # msgid -> (op, start) of async requests awaiting their result,
+        # sent and read from different threads
+        self.pending: Dict[int, tuple] = {}
+        self.pending_lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.transport, name)
+        if name in SYNC_OPS:
+            return self._wrap_sync(name, attr)
+        if name in ASYNC_OPS:
+            return self._wrap_async(name, attr)
+        if name == "result3":
+            return self._wrap_result(attr)
+        if name in ABANDON_OPS:
+            return self._wrap_abandon(attr)
+        return attr
+
+    def _wrap_sync(self, op: str, method):
+        @wraps(method)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                self.metrics.incr("ldap.errors")
+                raise
+            finally:
+                self.metrics.observe(f"ldap.{op}", time.perf_counter() - start)
+
+        return call
+
+    def _wrap_async(self, op: str, method):
+        @wraps(method)
+        def send(*args, **kwargs):
+            msgid = method(*args, **kwargs)
+            with self.pending_lock:
+                self.pending[msgid] = (op, time.perf_counter())
+                while len(self.pending) > MAX_PENDING:
+                    del self.pending[next(iter(self.pending))]
+                    self.metrics.incr("ldap.pending_dropped")
+            return msgid
+
+        return send
+
+    def _wrap_abandon(self, method):
+        @wraps(method)
+        def abandon(msgid, *args, **kwargs):
+            with self.pending_lock:
+                self.pending.pop(msgid, None)
+            return method(msgid, *args, **kwargs)
+
+        return abandon
+
+    def _wrap_result(self, method):
+        @wraps(method)
+        def result(*args, **kwargs):
+            msgid: Optional[int] = None
+            try:
+                response = method(*args, **kwargs)
+                msgid = response[2]
+                return response
+            except Exception as err:
+                self.metrics.incr("ldap.errors")
+                info = err.args[0] if err.args and isinstance(err.args[0], dict) else {}
+                msgid = info.get("msgid")
+                raise
+            finally:
+                with self.pending_lock:
+                    request = self.pending.pop(msgid, None)
+                if request is not None:
+                    self.metrics.observe(f"ldap.{request[0]}", time.perf_counter() - request[1])
+
+        return result
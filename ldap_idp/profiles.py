@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Viewer profiles - Profile definitions and attribute projection
+
+Shared by the viewer TUI and the headless ldapcp-query, so both display
+the same columns and values for a profile.
+"""
+
+from typing import Any, Dict, List
+
+from ldap_idp.config import settings
+
+
+def profile_rule(rule_name: str, rule_conf: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the rule entry of a profile, as selected in the viewer menu."""
+    rule_data = {
+        "label": rule_name,
+        "config": rule_conf,
+        "type": "profile",
+        "ldap_filter": rule_conf.get("ldap_filter", None),
+    }
+    rule_data.update(rule_conf)
+    return rule_data
+
+
+def get_profile(entity: str, profile: str) -> Dict[str, Any]:
+    """Return the rule entry of an entity profile, raise KeyError if unknown."""
+    ent_conf = settings.viewer_entities.get(entity)
+    if ent_conf is None:
+        raise KeyError(f"Unknown entity: {entity}")
+    profiles = ent_conf.profiles.to_dict()
+    if profile not in profiles:
+        raise KeyError(f"Unknown profile for {entity}: {profile}")
+    return profile_rule(profile, profiles[profile])
+
+
+def profile_columns(rule_entry: Dict[str, Any]) -> List[str]:
+    """Return the lowercase columns of a profile."""
+    columns = rule_entry.get("attr") or ["dn"]
+    return [col.lower() for col in columns]
+
+
+def project_result(
+    columns: List[str], result: Dict[str, Any], all_values: bool = False
+) -> List[Any]:
+    """Return the cells of a result for columns.
+
+    A cell holds the first value of the attribute, or all of them as a list
+    with all_values. Missing attributes give the missing value placeholder.
+    """
+    missing_placeholder = settings.viewer.missing_value_placeholder
+
+    dn = result.get("dn")
+    attrs = {k.lower(): v for k, v in result.get("attributes").items()}
+
+    cells = []
+    for field in columns:
+        value = missing_placeholder
+
+        if field == "dn":
+            value = dn
+        elif field in attrs:
+            value = attrs[field]
+            if isinstance(value, list) and not all_values:
+                value = value[0] if value else missing_placeholder
+
+        cells.append(value)
+    return cells
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Query - Run viewer profiles headless, with streaming output
+
+The profile filter is searched page by page with the paged results
+control, and each page is written before the next one is requested, so
+memory use does not grow with the number of results.
+"""
+
+from typing import Any, Dict, Iterator, List, Optional
+
+import click
+
+from ldap_idp.config import settings
+from ldap_idp.export import WRITERS
+from ldap_idp.ldap_backend import SCOPE_SUBTREE
+from ldap_idp.profiles import get_profile, profile_columns, project_result
+
+
+def query_rows(
+    ldap_connection,
+    rule_entry: Dict[str, Any],
+    base_dn: str = None,
+    page_size: int = 500,
+    limit: int = 0,
+    all_values: bool = False,
+) -> Iterator[List[Any]]:
+    """Yield the rows of a profile, page by page, up to limit rows if set."""
+    columns = profile_columns(rule_entry)
+    attributes = [col for col in columns if col != "dn"] or ["1.1"]
+    if limit:
+        page_size = min(page_size, limit)
+
+    count = 0
+    for page in ldap_connection.iter_search(
+        base_dn=base_dn,
+        scope=SCOPE_SUBTREE,
+        filter_str=rule_entry["ldap_filter"],
+        attributes=attributes,
+        page_size=page_size,
+    ):
+        for result in page:
+            yield project_result(columns, result, all_values=all_values)
+            count += 1
+            if limit and count >= limit:
+                return
+
+
+@click.command()
+@click.argument("entity")
+@click.argument("profile")
+@click.option(
+    "--format", "output_format", default="csv", type=click.Choice(list(WRITERS)),
+    help="Output format",
+)
+@click.option("--limit", default=0, type=int, help="Stop after this many rows (0: all)")
+@click.option("--base-dn", default=None, help="Subtree to search (defaults to the base DN)")
+@click.option("--page-size", default=500, type=int, help="Paged search size")
+@click.option("--header/--no-header", default=True, help="Write a header line (CSV, TSV)")
+@click.option(
+    "--output", "-o", default="-", type=click.File("w", encoding="utf-8"),
+    help="Output file (default: stdout)",
+)
+def main(
+    entity: str, profile: str, output_format: str, limit: int,
+    base_dn: Optional[str], page_size: int, header: bool, output,
+) -> None:
+    """Run the PROFILE of a viewer ENTITY and write its rows as they arrive."""
+    # pylint: disable=import-outside-toplevel
+    from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+
+    try:
+        rule_entry = get_profile(entity, profile)
+    except KeyError as err:
+        raise click.UsageError(err.args[0]) from err
+    if not isinstance(rule_entry.get("ldap_filter"), str):
+        raise click.UsageError(f"Profile {entity}/{profile} has no ldap_filter")
+
+    config = LDAPConfig(
+        uri=settings.authldap.uri,
+        bind_dn=settings.authldap.bind_dn,
+        bind_password=settings.authldap.bind_pass,
+        base_dn=settings.authldap.base_dn,
+    )
+    ldap_connection = LDAPConnectionImproved(config, base_dn=base_dn)
+    ldap_connection.connect()
+
+    writer_class = WRITERS[output_format]
+    writer = writer_class(output, profile_columns(rule_entry), header=header)
+    count = 0
+    try:
+        for row in query_rows(
+            ldap_connection, rule_entry, base_dn=base_dn, page_size=page_size,
+            limit=limit, all_values=writer_class.all_values,
+        ):
+            writer.write(row)
+            count += 1
+    finally:
+        ldap_connection.disconnect()
+
+    click.echo(f"{count} rows", err=True)
+
+
+if __name__ == "__main__":
+    main()
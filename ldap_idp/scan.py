@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Directory scan - Integrity checks of the whole directory in one streaming pass
+
+Entries are streamed page by page with the paged results control. Pages are
+analyzed in a process pool, and only compact indexes (64-bit hashes of DNs
+and values, posix group ids) are kept in memory. Facts which can only be
+judged at the end of the pass are spooled to temporary files.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+import ldap.dn
+
+from ldap_idp.config import settings
+from ldap_idp.ldap_backend import SCOPE_SUBTREE
+from ldap_idp.ldap_groups import member_dn
+
+logger = logging.getLogger(__name__)
+
+CHECKS = {
+    "dangling_reference": "DN-valued attribute pointing at a missing entry",
+    "empty_group": "Group without any member",
+    "duplicate_value": "uid, uidNumber or gidNumber used more than once",
+    "orphan_gid": "posixAccount gidNumber matching no posixGroup",
+}
+
+# Group object classes and their member attribute
+GROUP_CLASSES = {
+    "groupofnames": "member",
+    "groupofuniquenames": "uniquemember",
+}
+
+# Attributes which must be unique, among entries of an object class if set
+UNIQUE_VALUES = [
+    ("uid", None),
+    ("uidNumber", "posixaccount"),
+    ("gidNumber", "posixgroup"),
+]
+
+
+# =============================================================
+# Page analysis, runs in worker processes
+# =============================================================
+
+
+def short_hash(text: str) -> int:
+    """Return a 64-bit hash of a string, stable across processes."""
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def dn_hash(dn: str) -> int:
+    """Return the hash of a DN, insensitive to case and spacing."""
+    try:
+        dn = ldap.dn.dn2str(ldap.dn.str2dn(dn))
+    except ldap.DECODING_ERROR:
+        pass
+    return short_hash(dn.lower())
+
+
+def analyze_page(page: List[Any], reference_attributes: List[str]) -> Dict[str, list]:
+    """Extract the facts the checks need from a page of raw entries."""
+    reference_attributes = {attr.lower() for attr in reference_attributes}
+    facts = {
+        "dns": [],
+        "refs": [],
+        "empty_groups": [],
+        "values": [],
+        "group_gids": [],
+        "account_gids": [],
+    }
+
+    for dn, raw_attrs in page:
+        attrs = {
+            name.lower(): [value.decode("utf-8", errors="replace") for value in values]
+            for name, values in raw_attrs.items()
+        }
+        classes = {oc.lower() for oc in attrs.get("objectclass", [])}
+        facts["dns"].append(dn_hash(dn))
+
+        for attr in reference_attributes.intersection(attrs):
+            for value in attrs[attr]:
+                target = member_dn(value)
+                if target:
+                    facts["refs"].append((dn_hash(target), dn, attr, target))
+
+        for group_class, member_attr in GROUP_CLASSES.items():
+            if group_class in classes:
+                if not any(value.strip() for value in attrs.get(member_attr, [])):
+                    facts["empty_groups"].append(dn)
+                break
+
+        for attr, object_class in UNIQUE_VALUES:
+            if object_class and object_class not in classes:
+                continue
+            for value in attrs.get(attr.lower(), []):
+                key = short_hash(f"{attr.lower()}={value.lower()}")
+                facts["values"].append((key, attr, value, dn))
+
+        if "posixgroup" in classes:
+            facts["group_gids"].extend(attrs.get("gidnumber", []))
+        if "posixaccount" in classes:
+            facts["account_gids"].extend((gid, dn) for gid in attrs.get("gidnumber", []))
+
+    return facts
+
+
+# =============================================================
+# Scanner
+# =============================================================
+
+
+def finding(check: str, dn: str, attribute: str = "", value: str = "") -> Dict[str, str]:
+    return {"check": check, "dn": dn, "attribute": attribute, "value": value}
+
+
+class DirectoryScanner:
+    """Run the integrity checks over a stream of raw entry pages.
+
+    With workers set, pages are analyzed in that many processes, with at
+    most two pages per worker in flight. Findings are yielded as soon as
+    they are known; most come at the end of the pass.
+    """
+
+    def __init__(self, reference_attributes: List[str], workers: int = 0, checks=None):
+        self.reference_attributes = list(reference_attributes)
+        self.workers = workers
+        self.checks = set(checks or CHECKS)
+
+        self.seen_dns = set()
+        self.value_counts: Dict[int, int] = {}
+        self.group_gids = set()
+        self.stats = {"entries": 0, "references": 0, "elapsed": 0.0}
+
+        self._pending_refs = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self._values = tempfile.TemporaryFile("w+", encoding="utf-8")
+        self._account_gids = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+    def scan(self, pages: Iterable[List[Any]]) -> Iterator[Dict[str, str]]:
+        """Analyze pages of raw (dn, attrs) entries, yield findings."""
+        start = time.monotonic()
+        if self.workers:
+            with ProcessPoolExecutor(self.workers) as pool:
+                in_flight = deque()
+                for page in pages:
+                    in_flight.append(
+                        pool.submit(analyze_page, page, self.reference_attributes)
+                    )
+                    if len(in_flight) >= 2 * self.workers:
+                        yield from self._merge(in_flight.popleft().result())
+                while in_flight:
+                    yield from self._merge(in_flight.popleft().result())
+        else:
+            for page in pages:
+                yield from self._merge(analyze_page(page, self.reference_attributes))
+
+        yield from self._finish()
+        self.stats["elapsed"] = time.monotonic() - start
+
+    @staticmethod
+    def _spool(spool, item) -> None:
+        spool.write(json.dumps(item))
+        spool.write("\n")
+
+    @staticmethod
+    def _unspool(spool) -> Iterator[list]:
+        spool.seek(0)
+        for line in spool:
+            yield json.loads(line)
+        spool.close()
+
+    def _merge(self, facts: Dict[str, list]) -> Iterator[Dict[str, str]]:
+        self.seen_dns.update(facts["dns"])
+        self.stats["entries"] += len(facts["dns"])
+        self.stats["references"] += len(facts["refs"])
+
+        # References to entries not seen yet are judged at the end
+        for ref in facts["refs"]:
+            if ref[0] not in self.seen_dns:
+                self._spool(self._pending_refs, ref)
+
+        if "empty_group" in self.checks:
+            for dn in facts["empty_groups"]:
+                yield finding("empty_group", dn)
+
+        for item in facts["values"]:
+            self.value_counts[item[0]] = self.value_counts.get(item[0], 0) + 1
+            self._spool(self._values, item)
+
+        self.group_gids.update(facts["group_gids"])
+        for item in facts["account_gids"]:
+            self._spool(self._account_gids, item)
+
+    def _finish(self) -> Iterator[Dict[str, str]]:
+        for target_hash, source_dn, attr, target in self._unspool(self._pending_refs):
+            if "dangling_reference" in self.checks and target_hash not in self.seen_dns:
+                yield finding("dangling_reference", source_dn, attr, target)
+
+        for key, attr, value, dn in self._unspool(self._values):
+            if "duplicate_value" in self.checks and self.value_counts[key] > 1:
+                yield finding("duplicate_value", dn, attr, value)
+
+        for gid, dn in self._unspool(self._account_gids):
+            if "orphan_gid" in self.checks and gid not in self.group_gids:
+                yield finding("orphan_gid", dn, "gidNumber", gid)
+
+
+def scan_directory(
+    ldap_connection, reference_attributes: List[str], workers: int = 0,
+    base_dn: str = None, page_size: int = 500, checks=None,
+) -> Tuple[DirectoryScanner, Iterator[Dict[str, str]]]:
+    """Return a scanner, and the generator of findings of a whole directory."""
+    scanner = DirectoryScanner(reference_attributes, workers=workers, checks=checks)
+    # Group members are needed to find empty groups, whatever the references
+    attributes = ["objectClass", "uid", "uidNumber", "gidNumber", *GROUP_CLASSES.values()]
+    requested = {attr.lower() for attr in attributes}
+    attributes += [attr for attr in reference_attributes if attr.lower() not in requested]
+    pages = ldap_connection.iter_search(
+        base_dn=base_dn,
+        scope=SCOPE_SUBTREE,
+        attributes=attributes,
+        page_size=page_size,
+        raw=True,
+    )
+    return scanner, scanner.scan(pages)
+
+
+# =============================================================
+# Command line
+# =============================================================
+
+
+@click.command()
+@click.option("--base-dn", default=None, help="Subtree to scan (defaults to the base DN)")
+@click.option("--page-size", default=500, type=int, help="Paged search size")
+@click.option(
+    "--workers", default=lambda: os.cpu_count() or 1, type=int,
+    help="Analysis processes, 0 to analyze in the main process",
+)
+@click.option(
+    "--check", "checks", multiple=True, type=click.Choice(list(CHECKS)),
+    help="Check to run, repeat for several (default: all)",
+)
+@click.option(
+    "--format", "output_format", default="text", type=click.Choice(["text", "jsonl"]),
+    help="Output format",
+)
+def main(
+    base_dn: Optional[str], page_size: int, workers: int, checks, output_format: str
+) -> None:
+    """Scan the whole directory for integrity problems, in one streaming pass."""
+    # pylint: disable=import-outside-toplevel
+    from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+    from ldap_idp.ldap_references import reference_attributes
+
+    config = LDAPConfig(
+        uri=settings.authldap.uri,
+        bind_dn=settings.authldap.bind_dn,
+        bind_password=settings.authldap.bind_pass,
+        base_dn=settings.authldap.base_dn,
+    )
+    ldap_connection = LDAPConnectionImproved(config, base_dn=base_dn)
+    ldap_connection.connect()
+
+    attributes = reference_attributes(ldap_connection, settings.browser.reference_attributes)
+    scanner, findings = scan_directory(
+        ldap_connection, attributes, workers=workers, base_dn=base_dn,
+        page_size=page_size, checks=checks,
+    )
+
+    counts = {check: 0 for check in CHECKS}
+    for item in findings:
+        counts[item["check"]] += 1
+        if output_format == "jsonl":
+            click.echo(json.dumps(item))
+        else:
+            click.echo(f"{item['check']}\t{item['dn']}\t{item['attribute']}\t{item['value']}")
+    ldap_connection.disconnect()
+
+    stats = scanner.stats
+    rate = stats["entries"] / stats["elapsed"] if stats["elapsed"] else 0
+    click.echo(
+        f"Scanned {stats['entries']} entries and {stats['references']} references "
+        f"in {stats['elapsed']:.1f}s ({rate:.0f} entries/s)",
+        err=True,
+    )
+    for check, count in counts.items():
+        click.echo(f"  {check}: {count}", err=True)
+    sys.exit(1 if any(counts.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,13 @@
+import os
+import subprocess
+import sys
+import tempfile
+
 import click
 from textual_serve.server import Server
 
+from ldap_idp.zygote import wait_for_socket
+
 
 @click.command()
 @click.option(
@@ -39,6 +46,17 @@ from textual_serve.server import Server
     is_flag=True,
     help="Enable textual devtools"
 )
+@click.option(
+    "--workers",
+    default=0,
+    type=int,
+    help="Size of the pre-forked warm worker pool (0 to disable)"
+)
+@click.option(
+    "--zygote-socket",
+    default=None,
+    help="Unix socket of the worker pool (defaults to a temporary path)"
+)
 def serve(
     # command: str,
     host: str,
@@ -46,6 +64,8 @@ def serve(
     # statics_path: str | None,
     # templates_path: str | None,
     debug: bool,
+    workers: int = 0,
+    zygote_socket: str | None = None,
     public_url: str | None = None,
     title: str | None = "LDAP Control Panel",
 ) -> None:
@@ -54,8 +74,25 @@ def serve(
     # if not public_url:
     #     public_url = f"http://{host}:{port}"
 
+    command = "python -m ldap_idp.main"
+    zygote = None
+    if workers > 0:
+        zygote_socket = zygote_socket or os.path.join(
+            tempfile.gettempdir(), f"ldapcp-zygote-{os.getpid()}.sock"
+        )
+        zygote = subprocess.Popen(
+            [
+                sys.executable, "-m", "ldap_idp.zygote", "server",
+                "--socket", zygote_socket,
+                "--pool-size", str(workers),
+            ]
+        )
+        wait_for_socket(zygote_socket)
+        command = f"{sys.executable} -m ldap_idp.zygote connect --socket {zygote_socket}"
+        click.echo(f"Warm worker pool ready ({workers} workers on {zygote_socket})")
+
     server = Server(
-        "python -m ldap_idp.main",
+        command,
         host=host,
         port=port,
         title=title,
@@ -65,7 +102,12 @@ def serve(
     )
     
     click.echo(f"Starting server at http://{host}:{port} ({public_url})")
-    server.serve(debug=debug)
+    try:
+        server.serve(debug=debug)
+    finally:
+        if zygote:
+            zygote.terminate()
+            zygote.wait()
 
 
 
@@ -1,16 +1,26 @@
 import logging
+import time
 from typing import Any, Dict
 
+import ldap
 import yaml
+from rich.text import Text
 from textual.app import ComposeResult
+from textual.binding import Binding
 from textual.containers import ScrollableContainer
-from textual.widgets import DataTable, Static, Markdown
+from textual.message import Message
+from textual.widgets import DataTable, Input, Static, Markdown
 from textual.widget import Widget
 from textual.reactive import reactive
-from textual.widgets import Pretty
+from textual import work
 
 
-from ldap_idp.ldap_backend import get_rdn
+from ldap_idp.config import settings
+from ldap_idp.ldap_backend import entry_modlist, error_text, get_rdn
+from ldap_idp.ldap_groups import DYNAMIC_MEMBER_ATTRIBUTE, MEMBER_ATTRIBUTES, MembershipGraph
+from ldap_idp.ldap_references import ReferenceIndex, reference_attributes
+from ldap_idp.lib_textual.wid_json import JSONView
+from ldap_idp.metrics import timed
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +57,7 @@ objectClass: {object_class}
 
         self.update("Please select entry")
 
+    @timed("render.browser.header")
     def render(self) -> str:
         if self.current_ldap_entry:
             # Build data
@@ -80,9 +91,10 @@ class ContentViewBase(ScrollableContainer, can_focus=False):
     current_ldap_entry: reactive[dict | None] = reactive(None)
     content_widget = None
     styles = None
+    ldap_connection = None
 
 
-class ContentViewJSON(ContentViewBase, can_focus=True):
+class ContentViewJSON(ContentViewBase):
     """Right pane for the app."""
 
     DEFAULT_CSS = """
@@ -100,10 +112,11 @@ class ContentViewJSON(ContentViewBase, can_focus=True):
 
     def compose(self) -> ComposeResult:
         """Create child widgets for the scrollable container."""
-        self.content_widget = Pretty(self.current_ldap_entry, id="content-static")
+        self.content_widget = JSONView(self.current_ldap_entry, id="content-static")
 
         yield self.content_widget
 
+    @timed("render.browser.json")
     def watch_current_ldap_entry(self, ldap_entry):
         """Update the content view with LDAP entry information."""
         if self.content_widget and self.current_ldap_entry:
@@ -117,25 +130,70 @@ class ContentViewTable(ContentViewBase):
     ContentViewTable {
         border: solid $primary;
     }
+    ContentViewTable #value-editor {
+        dock: bottom;
+    }
     """
 
     BORDER_TITLE = "Table view"
 
+    # Active in edit mode only, when the table has the focus
+    BINDINGS = [
+        Binding("a", "add_value", "Add value"),
+        Binding("d", "delete_value", "Delete value"),
+        Binding("ctrl+s", "save_entry", "Save"),
+        Binding("escape", "discard_edits", "Discard"),
+    ]
+    EDIT_ACTIONS = {"add_value", "delete_value", "save_entry", "discard_edits"}
+
+    class EntryModified(Message):
+        """Message sent once an edited entry is saved on the server."""
+
+        def __init__(self, dn: str, modlist: list):
+            self.dn = dn
+            self.modlist = modlist
+            super().__init__()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.loading = False
         self.content_widget = None
+        self.editor = None
         self.current_sort_column = None
         self.current_sort_reverse = False
 
+        # Edit mode: rows by key, values deleted, and rows of values added
+        self.edit_mode = False
+        self.row_values = {}
+        self.deleted_values = set()
+        self.added_rows = {}
+        self.editor_row = None
+
+        # Paged value model: (attribute, value) rows, the first shown_rows of
+        # them are in the table. Ranges are values left on the server.
+        self.page_size = settings.browser.values_page_size
+        self.value_rows = []
+        self.shown_rows = 0
+        self.value_ranges = {}
+        self.longuest_value = 0
+
     def compose(self) -> ComposeResult:
         """Create child widgets for the scrollable container."""
         self.content_widget = DataTable(id="table-container")
         self.content_widget.can_focus = False
         # Add columns with proper names
-        self.content_widget.add_columns("Attribute", "Values")
+        self.column_keys = self.content_widget.add_columns("Attribute", "Values")
         yield self.content_widget
 
+        self.editor = Input(id="value-editor", select_on_focus=False)
+        self.editor.display = False
+        yield self.editor
+
+    def on_mount(self) -> None:
+        """Load the next page of values when scrolled near the end."""
+        self.watch(self.content_widget, "scroll_y", self._on_table_scroll, init=False)
+
+    @timed("render.browser.table")
     def watch_current_ldap_entry(self, ldap_entry):
         """Update the content view with LDAP entry information."""
 
@@ -150,39 +208,91 @@ class ContentViewTable(ContentViewBase):
             self.current_sort_column = None
             self.current_sort_reverse = False
 
-            # Add rows for each attribute
-            longuest_value = 0
-            if "attributes" in ldap_entry:
-                for attr_name, attr_values in ldap_entry["attributes"].items():
-
-                    if attr_name in ["objectClass"]:
-                        # Skip since already displayed in header
-                        continue
-
-                    # Handle multiple values - create separate row for each value
-                    if isinstance(attr_values, list):
-                        for value in attr_values:
-                            self.content_widget.add_row(attr_name, str(value))
-                            longuest_value = (
-                                longuest_value
-                                if longuest_value > len(value)
-                                else len(value)
-                            )
-                    else:
-                        self.content_widget.add_row(attr_name, str(attr_values))
-                        longuest_value = (
-                            longuest_value
-                            if longuest_value > len(attr_values)
-                            else len(attr_values)
-                        )
-
-            logger.info(f"DEBUG: longuest_value={longuest_value}")
-            self.content_widget.ordered_columns[1].content_width = longuest_value  # + 1
+            # Build rows for each attribute, multiple values get a row each
+            self.value_rows = []
+            for attr_name, attr_values in ldap_entry.get("attributes", {}).items():
+
+                if attr_name in ["objectClass"]:
+                    # Skip since already displayed in header
+                    continue
+
+                if isinstance(attr_values, list):
+                    self.value_rows.extend((attr_name, str(value)) for value in attr_values)
+                else:
+                    self.value_rows.append((attr_name, str(attr_values)))
+
+            self.value_ranges = dict(ldap_entry.get("ranges", {}))
+            self.shown_rows = 0
+            self.longuest_value = 0
+            self.row_values = {}
+            self.deleted_values = set()
+            self.added_rows = {}
+            self.editor.display = False
+
+            # Show the first page right away
+            self.show_next_page()
+
+    def show_next_page(self) -> None:
+        """Add the next page of rows, fetching values from the server if needed."""
+        end = min(self.shown_rows + self.page_size, len(self.value_rows))
+        if end > self.shown_rows:
+            rows = self.value_rows[self.shown_rows : end]
+            self.row_values.update(zip(self.content_widget.add_rows(rows), rows))
+            self.shown_rows = end
+
+            self.longuest_value = max(
+                [self.longuest_value] + [len(value) for _attr, value in rows]
+            )
+            logger.info(f"DEBUG: longuest_value={self.longuest_value}")
+            self.content_widget.ordered_columns[1].content_width = self.longuest_value  # + 1
+
+            if self.current_sort_column is not None:
+                self.content_widget.sort(
+                    self.current_sort_column, reverse=self.current_sort_reverse
+                )
+        elif self.value_ranges and self.ldap_connection:
+            self.fetch_value_range(self.current_ldap_entry["dn"])
+
+        self.update_value_count()
+
+    def update_value_count(self) -> None:
+        """Show how many values are displayed, out of how many."""
+        total = f"{len(self.value_rows)}+" if self.value_ranges else len(self.value_rows)
+        self.border_subtitle = f"{self.shown_rows} of {total} values"
+        changes = len(self.deleted_values) + len(self.added_rows)
+        if changes:
+            self.border_subtitle += f", {changes} unsaved changes"
+
+    def _on_table_scroll(self, scroll_y: float) -> None:
+        table = self.content_widget
+        if scroll_y >= table.max_scroll_y - self.page_size // 10:
+            if self.shown_rows < len(self.value_rows) or self.value_ranges:
+                self.show_next_page()
+
+    @work(thread=True, exclusive=True, group="value-range")
+    def fetch_value_range(self, dn: str) -> None:
+        """Fetch the next range of the first attribute with values left."""
+        attr, start = next(iter(self.value_ranges.items()))
+        values, next_start = self.ldap_connection.get_attribute_range(dn, attr, start)
+        self.app.call_from_thread(self._add_value_range, dn, attr, values, next_start)
+
+    def _add_value_range(self, dn, attr, values, next_start) -> None:
+        if not self.current_ldap_entry or self.current_ldap_entry["dn"] != dn:
+            return
+        self.value_rows.extend((attr, str(value)) for value in values)
+        if next_start is None:
+            self.value_ranges.pop(attr, None)
+        else:
+            self.value_ranges[attr] = next_start
+        self.show_next_page()
 
     def on_content_widget_header_selected(
         self, event: DataTable.HeaderSelected
     ) -> None:
         """Handle header click for sorting using built-in sort method."""
+        if self.edit_mode:
+            # Edited cells hold styled text, which does not sort with strings
+            return
         column_key = event.column_key
 
         # Toggle sort direction if same column, otherwise start ascending
@@ -194,3 +304,332 @@ class ContentViewTable(ContentViewBase):
 
         # Use built-in sort method
         self.content_widget.sort(column_key, reverse=self.current_sort_reverse)
+
+
+    # Edit mode
+    # =============================================================
+
+    def check_action(self, action: str, parameters: tuple[object, ...]) -> bool | None:
+        """Disable the edit bindings outside edit mode."""
+        if action in self.EDIT_ACTIONS and not self.edit_mode:
+            return False
+        return True
+
+    def set_edit_mode(self, enabled: bool) -> None:
+        """Start editing the values of the displayed entry, or stop and discard edits."""
+        if enabled and not (self.current_ldap_entry and self.ldap_connection):
+            self.notify("Select an entry to edit")
+            return
+
+        self.edit_mode = enabled
+        table = self.content_widget
+        table.can_focus = enabled
+        table.cursor_type = "row"
+        if enabled:
+            table.focus()
+            self.border_title = f"{self.BORDER_TITLE} (editing)"
+        else:
+            # The table keeps the focus when it can no longer take it
+            if table.has_focus or self.editor.has_focus:
+                self.app.set_focus(None)
+            self.editor.display = False
+            self.border_title = self.BORDER_TITLE
+            self.watch_current_ldap_entry(self.current_ldap_entry)
+
+    def _cursor_row_key(self):
+        table = self.content_widget
+        if not table.row_count:
+            return None
+        return table.coordinate_to_cell_key(table.cursor_coordinate).row_key
+
+    def _open_editor(self, text: str, row_key=None) -> None:
+        self.editor_row = row_key
+        self.editor.value = text
+        self.editor.cursor_position = len(text)
+        self.editor.display = True
+        self.editor.focus()
+
+    def action_add_value(self) -> None:
+        """Add a value, as "attribute: value", to the attribute under the cursor by default."""
+        row_key = self._cursor_row_key()
+        attr = ""
+        if row_key in self.row_values:
+            attr = self.row_values[row_key][0]
+        elif row_key in self.added_rows:
+            attr = self.added_rows[row_key][0]
+        self._open_editor(f"{attr}: " if attr else "")
+
+    def action_delete_value(self) -> None:
+        """Mark the value under the cursor as deleted, or restore it."""
+        row_key = self._cursor_row_key()
+        if row_key is not None:
+            self._delete_row(row_key)
+            self.update_value_count()
+
+    def on_data_table_row_selected(self, event: DataTable.RowSelected) -> None:
+        """Edit the selected value."""
+        event.stop()
+        if not self.edit_mode:
+            return
+        row = self.row_values.get(event.row_key) or self.added_rows.get(event.row_key)
+        if row and row not in self.deleted_values:
+            self._open_editor(row[1], row_key=event.row_key)
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        """Apply the value typed in the editor."""
+        event.stop()
+        self.editor.display = False
+        self.content_widget.focus()
+
+        if self.editor_row is not None:
+            attr, value = (
+                self.row_values.get(self.editor_row) or self.added_rows[self.editor_row]
+            )
+            if event.value != value:
+                self._delete_row(self.editor_row)
+                self._add_value(attr, event.value)
+        else:
+            attr, sep, value = event.value.partition(":")
+            if not sep or not attr.strip():
+                self.notify("Type the value as attribute: value")
+                return
+            self._add_value(attr.strip(), value.strip())
+        self.update_value_count()
+
+    def _add_value(self, attr: str, value: str) -> None:
+        if (attr, value) in self.deleted_values:
+            # Added back: restore the deleted row
+            row_key = next(key for key, row in self.row_values.items() if row == (attr, value))
+            self._delete_row(row_key)
+            return
+        if (attr, value) in self.row_values.values() or (attr, value) in self.added_rows.values():
+            self.notify(f"{attr} already has this value")
+            return
+        row_key = self.content_widget.add_row(attr, Text(value, style="green"))
+        self.added_rows[row_key] = (attr, value)
+        self.content_widget.move_cursor(row=self.content_widget.get_row_index(row_key))
+
+    def _delete_row(self, row_key) -> None:
+        if row_key in self.added_rows:
+            del self.added_rows[row_key]
+            self.content_widget.remove_row(row_key)
+            return
+
+        row = self.row_values[row_key]
+        if row in self.deleted_values:
+            self.deleted_values.remove(row)
+            cell = row[1]
+        else:
+            self.deleted_values.add(row)
+            cell = Text(row[1], style="strike red")
+        self.content_widget.update_cell(row_key, self.column_keys[1], cell)
+
+    def action_discard_edits(self) -> None:
+        """Close the editor, or drop all unsaved changes."""
+        if self.editor.display:
+            self.editor.display = False
+            self.content_widget.focus()
+            return
+        self.watch_current_ldap_entry(self.current_ldap_entry)
+
+    def pending_modlist(self) -> list:
+        """Return the smallest modlist saving the edits, value by value."""
+        old, new = {}, {}
+        for attr, value in self.value_rows:
+            if attr == DYNAMIC_MEMBER_ATTRIBUTE:
+                # Virtual attribute, evaluated from memberURL
+                continue
+            old.setdefault(attr, []).append(value)
+            if (attr, value) not in self.deleted_values:
+                new.setdefault(attr, []).append(value)
+        for attr, value in self.added_rows.values():
+            new.setdefault(attr, []).append(value)
+        # Values left on the server are unknown: never delete them as a whole
+        return entry_modlist(old, new, partial=self.value_ranges)
+
+    def action_save_entry(self) -> None:
+        """Send the edits to the server."""
+        modlist = self.pending_modlist()
+        if not modlist:
+            self.notify("No changes to save")
+            return
+        self.save_entry(self.current_ldap_entry["dn"], modlist)
+
+    @work(thread=True, exclusive=True, group="entry-save")
+    def save_entry(self, dn: str, modlist: list) -> None:
+        """Apply a modlist on the server, then tell the app to update its caches."""
+        try:
+            self.ldap_connection.modify_entry(dn, modlist)
+        except (ldap.LDAPError, RuntimeError) as err:
+            logger.error(f"Saving {dn} failed: {err}")
+            self.app.call_from_thread(
+                self.notify, f"Save failed: {error_text(err)}", severity="error"
+            )
+            return
+        self.app.call_from_thread(self.post_message, self.EntryModified(dn, modlist))
+
+
+class ContentViewGroups(ContentViewBase):
+    """Right pane for the app displaying the effective groups of an entry."""
+
+    DEFAULT_CSS = """
+    ContentViewGroups {
+        border: solid $primary;
+    }
+    """
+
+    BORDER_TITLE = "Groups view"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loading = False
+        self.content_widget = None
+        self.membership = MembershipGraph()
+        self.building = False
+
+    def compose(self) -> ComposeResult:
+        """Create child widgets for the scrollable container."""
+        self.content_widget = DataTable(id="groups-container")
+        self.content_widget.can_focus = False
+        self.content_widget.add_columns("Group", "Membership")
+        yield self.content_widget
+
+    @timed("render.browser.groups")
+    def watch_current_ldap_entry(self, ldap_entry):
+        """Show the effective groups, building the membership graph first if needed."""
+        if not ldap_entry or "dn" not in ldap_entry:
+            return
+
+        if self.membership.built:
+            # Partial member values would drop edges, skip ranged entries
+            ranged = {attr.lower() for attr in ldap_entry.get("ranges", {})}
+            if not ranged.intersection(attr.lower() for attr in MEMBER_ATTRIBUTES):
+                self.membership.update_entry(ldap_entry["dn"], ldap_entry["attributes"])
+            self.show_groups(ldap_entry["dn"])
+        elif self.ldap_connection:
+            # One build at a time, it shows the entry selected when done
+            self.loading = True
+            if not self.building:
+                self.building = True
+                self.build_membership(self.ldap_connection)
+
+    @work(thread=True, exclusive=True, group="membership-build")
+    def build_membership(self, ldap_connection) -> None:
+        """Load the membership graph of the directory."""
+        try:
+            self.membership.build(ldap_connection)
+        except ldap.LDAPError as err:
+            logger.error(f"Membership graph build failed: {err}")
+            self.app.call_from_thread(self._membership_failed, err)
+            return
+        self.app.call_from_thread(self._membership_built)
+
+    def _membership_failed(self, err) -> None:
+        self.building = False
+        self.loading = False
+        self.notify(f"Membership graph build failed: {error_text(err)}", severity="error")
+
+    def _membership_built(self) -> None:
+        self.building = False
+        self.loading = False
+        self.notify(
+            f"Membership graph built in {self.membership.build_time:.1f}s: "
+            f"{self.membership.edge_count} memberships"
+        )
+        if self.current_ldap_entry:
+            self.show_groups(self.current_ldap_entry["dn"])
+
+    def show_groups(self, dn: str) -> None:
+        """Render the effective groups of an entry."""
+        start = time.monotonic()
+        groups = self.membership.effective_groups(dn)
+        elapsed = (time.monotonic() - start) * 1000
+
+        self.content_widget.clear()
+        for group_dn, direct in groups:
+            self.content_widget.add_row(group_dn, "direct" if direct else "nested")
+        for cycle in self.membership.cycles_of(dn):
+            self.content_widget.add_row(" → ".join(cycle + cycle[:1]), "⚠ cycle")
+
+        self.border_subtitle = f"{len(groups)} groups, resolved in {elapsed:.1f} ms"
+
+
+class ContentViewReferences(ContentViewBase):
+    """Right pane for the app displaying the entries referencing an entry."""
+
+    DEFAULT_CSS = """
+    ContentViewReferences {
+        border: solid $primary;
+    }
+    """
+
+    BORDER_TITLE = "Referenced by"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loading = False
+        self.content_widget = None
+        self.references = ReferenceIndex()
+        self.building = False
+
+    def compose(self) -> ComposeResult:
+        """Create child widgets for the scrollable container."""
+        self.content_widget = DataTable(id="references-container")
+        self.content_widget.can_focus = False
+        self.content_widget.add_columns("Attribute", "Entry")
+        yield self.content_widget
+
+    @timed("render.browser.references")
+    def watch_current_ldap_entry(self, ldap_entry):
+        """Show the referencing entries, building the index first if needed."""
+        if not ldap_entry or "dn" not in ldap_entry:
+            return
+
+        if self.references.built:
+            # Partial values would drop references, skip ranged entries
+            if not ldap_entry.get("ranges"):
+                self.references.update_entry(ldap_entry["dn"], ldap_entry["attributes"])
+            self.show_references(ldap_entry["dn"])
+        elif self.ldap_connection:
+            # One build at a time, it shows the entry selected when done
+            self.loading = True
+            if not self.building:
+                self.building = True
+                self.build_references(self.ldap_connection)
+
+    @work(thread=True, exclusive=True, group="references-build")
+    def build_references(self, ldap_connection) -> None:
+        """Index the DN-valued attributes of the directory."""
+        attributes = reference_attributes(
+            ldap_connection, settings.browser.reference_attributes
+        )
+        try:
+            self.references.build(ldap_connection, attributes)
+        except ldap.LDAPError as err:
+            logger.error(f"Reference index build failed: {err}")
+            self.app.call_from_thread(self._references_failed, err)
+            return
+        self.app.call_from_thread(self._references_built)
+
+    def _references_failed(self, err) -> None:
+        self.building = False
+        self.loading = False
+        self.notify(f"Reference index build failed: {error_text(err)}", severity="error")
+
+    def _references_built(self) -> None:
+        self.building = False
+        self.loading = False
+        self.notify(
+            f"Reference index built in {self.references.build_time:.1f}s: "
+            f"{self.references.reference_count} references"
+        )
+        if self.current_ldap_entry:
+            self.show_references(self.current_ldap_entry["dn"])
+
+    def show_references(self, dn: str) -> None:
+        """Render the entries pointing at an entry."""
+        referrers = self.references.referenced_by(dn)
+        self.content_widget.clear()
+        for source_dn, attr in referrers:
+            self.content_widget.add_row(attr, source_dn)
+        self.border_subtitle = f"{len(referrers)} references"
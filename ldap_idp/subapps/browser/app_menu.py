@@ -1,15 +1,26 @@
+import asyncio
+import bisect
 import logging
 from typing import Any, Dict
 
+import ldap
+
+from textual import work
 from textual.message import Message
 from textual.widgets import Tree
 from textual.reactive import reactive
 
 from ldap_idp.config import settings
+from ldap_idp.ldap_backend import get_parent_dn
+from ldap_idp.ldap_cache import fetch_tree_stamps, stamps_changed
 from ldap_idp.lib_textual.wid_tree import TreeDataDir
+from ldap_idp.metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
+# Nodes created per event loop tick when loading a chunk of children
+TICK_BATCH = 100
+
 # =============================================================
 # Menu panel
 # =============================================================
@@ -61,17 +72,41 @@ class TreeView(TreeDataDir):
             self.node_data = node_data
             super().__init__()
 
+    class EntriesChanged(Message):
+        """Message sent when a refresh found changed or removed entries."""
+
+        def __init__(self, changes: list, removed_dns: list):
+            self.changes = changes
+            self.removed_dns = removed_dns
+            super().__init__()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.containers_first = settings.browser.containers_first
         self.display_mode = settings.browser.display_mode
         self.auto_expand = settings.browser.auto_expand
+        self.max_depth = 3
+        self.chunk_size = settings.browser.chunk_size
+        self.persistent_cache = None
+
+        # Refresh state: watermark of the last sync and nodes by lowercase DN
+        self.watermark = None
+        self._nodes_by_dn = {}
+
+    def on_mount(self) -> None:
+        METRICS.gauge(
+            "memory.browser.tree", lambda: [node.data for node in self._tree_nodes.values()]
+        )
 
     def on_tree_node_selected(self, event: Tree.NodeSelected) -> None:
         """Handle tree node selection and send message to parent."""
         node = event.node
         node_data = node.data
 
+        if node_data and node_data.get("load_more"):
+            self.load_more(node)
+            return
+
         logger.info("Tree node selected: %s", node_data)
         self.post_message(self.LdapEntrySelection(node_data=node_data))
 
@@ -83,11 +118,222 @@ class TreeView(TreeDataDir):
             self.clear()
             return
 
+        if self.persistent_cache:
+            self.revalidate_tree(ldap_connection)
+            return
+
         # Get the LDAP tree data recursively
-        tree_data = ldap_connection.get_tree_recursive(max_depth=3, display_mode=self.display_mode)
+        tree_data = ldap_connection.get_tree_recursive(
+            max_depth=self.max_depth, display_mode=self.display_mode
+        )
+        self.render_tree(tree_data)
+
+    # Persistent cache
+    # =============================================================
+
+    @property
+    def tree_cache_key(self):
+        """Key of the tree in the persistent cache."""
+        return [self.display_mode, self.max_depth]
+
+    def show_cached_tree(self) -> bool:
+        """Render the tree from the persistent cache, if any."""
+        if not self.persistent_cache:
+            return False
+        cached = self.persistent_cache.get("tree", self.tree_cache_key)
+        if cached is None:
+            return False
+
+        logger.info("Rendering tree from persistent cache")
+        self.render_tree(cached[0])
+        return True
+
+    @work(thread=True, exclusive=True, group="tree-revalidate")
+    def revalidate_tree(self, ldap_connection) -> None:
+        """Compare cached stamps with the server, reload the tree if they differ."""
+        cached = self.persistent_cache.get("tree", self.tree_cache_key)
+        try:
+            if cached is not None and not stamps_changed(
+                cached[1], fetch_tree_stamps(ldap_connection, cached[0])
+            ):
+                logger.info("Cached tree is up to date")
+                return
+        except ldap.LDAPError as err:
+            logger.error("Tree revalidation failed: %s", err)
+            return
+
+        tree_data = ldap_connection.get_tree_recursive(
+            max_depth=self.max_depth, display_mode=self.display_mode
+        )
+        try:
+            stamps = fetch_tree_stamps(ldap_connection, tree_data)
+        except ldap.LDAPError as err:
+            logger.error("Tree stamps unavailable, not caching the tree: %s", err)
+        else:
+            self.persistent_cache.put("tree", self.tree_cache_key, tree_data, stamps)
+        self.app.call_from_thread(self.render_tree, tree_data)
+
+    # Incremental refresh
+    # =============================================================
+
+    def refresh_tree(self) -> None:
+        """Fetch the entries changed since the last sync and patch the tree."""
+        if not self.current_ldap_connection or not self.watermark:
+            self.notify("Tree is not loaded yet")
+            return
+
+        expanded_dns = [
+            node.data["dn"] if node.data else self.current_ldap_connection.base_dn
+            for node in self._nodes_by_dn.values()
+            if node.is_expanded
+        ]
+        self.fetch_tree_delta(self.current_ldap_connection, self.watermark, expanded_dns)
+
+    @work(thread=True, exclusive=True, group="tree-refresh")
+    def fetch_tree_delta(self, ldap_connection, watermark: str, expanded_dns) -> None:
+        """Query changed entries, and current children of expanded containers.
+
+        Containers whose listing failed are left out, so their nodes are kept.
+        """
+        try:
+            changes, watermark = ldap_connection.get_changes_since(
+                watermark, display_mode=self.display_mode
+            )
+        except ldap.LDAPError as err:
+            logger.error("Tree refresh failed: %s", err)
+            self.app.call_from_thread(self.notify, f"Tree refresh failed: {err}", severity="error")
+            return
+
+        children_dns = {}
+        for dn in expanded_dns:
+            try:
+                children = ldap_connection.get_children_dns(dn)
+            except ldap.LDAPError as err:
+                logger.warning("Could not list the children of %s: %s", dn, err)
+                continue
+            children_dns[dn.lower()] = {child.lower() for child in children}
+        self.app.call_from_thread(self.apply_tree_delta, changes, children_dns, watermark)
+
+    def apply_tree_delta(self, changes, children_dns, watermark: str) -> None:
+        """Add, remove or relabel the affected nodes in place."""
+        added = updated = 0
+        removed_dns = []
+
+        # Children gone from expanded containers were deleted or moved
+        for parent_key, present in children_dns.items():
+            parent_node = self._nodes_by_dn.get(parent_key)
+            if parent_node is None:
+                continue
+            for child_node in list(parent_node.children):
+                if child_node.data and child_node.data.get("load_more"):
+                    removed_dns.extend(self._filter_pending(child_node, present))
+                elif child_node.data and child_node.data["dn"].lower() not in present:
+                    self._unregister_subtree(child_node)
+                    child_node.remove()
+                    removed_dns.append(child_node.data["dn"])
+        removed = len(removed_dns)
+
+        for child_data in changes:
+            key = child_data["dn"].lower()
+            node = self._nodes_by_dn.get(key)
+            if node is self.root:
+                continue
+            if node is not None:
+                self._relabel_node(node, child_data)
+                updated += 1
+                continue
+
+            parent_node = self._nodes_by_dn.get(get_parent_dn(child_data["dn"]).lower())
+            if parent_node is None:
+                # Parent not loaded, the entry shows up when it is
+                continue
+            self._insert_node(parent_node, child_data)
+            added += 1
+
+        self.watermark = watermark
+        if changes or removed_dns:
+            self.post_message(self.EntriesChanged(changes, removed_dns))
+        logger.info("Tree refreshed: %d added, %d updated, %d removed", added, updated, removed)
+        self.notify(f"Tree refreshed: {added} added, {updated} updated, {removed} removed")
+
+    def update_entry(self, child_data) -> None:
+        """Relabel the node of an entry modified from this session."""
+        node = self._nodes_by_dn.get(child_data["dn"].lower())
+        if node is not None and node is not self.root:
+            self._relabel_node(node, child_data)
+        self.post_message(self.EntriesChanged([child_data], []))
+
+    @staticmethod
+    def _relabel_node(node, child_data) -> None:
+        node.set_label(child_data["label"])
+        node.data.update(
+            attributes=child_data["attributes"],
+            has_children=node.data["has_children"] or child_data["has_children"],
+        )
+
+    @staticmethod
+    def _sort_key(child_data):
+        """Return the containers first sort key used by _build_tree_recursive."""
+        return (not child_data["has_children"], child_data["label"].lower())
+
+    def _insert_node(self, parent_node, child_data) -> None:
+        """Add a node among already rendered siblings, keeping their order."""
+        load_more_node = self._get_load_more_node(parent_node)
+        depth = parent_node.data["depth"] + 1 if parent_node.data else 1
+
+        before = load_more_node
+        if self.containers_first:
+            key = self._sort_key(child_data)
+            for sibling in parent_node.children:
+                if sibling is load_more_node:
+                    break
+                if sibling.data and self._sort_key(
+                    {"label": str(sibling.label), "has_children": sibling.data["has_children"]}
+                ) > key:
+                    before = sibling
+                    break
+
+        if load_more_node is not None and before is load_more_node:
+            # Sorts after the rendered chunks, wait in the pending children
+            data = load_more_node.data
+            if self.containers_first:
+                bisect.insort(data["children"], child_data, lo=data["offset"], key=self._sort_key)
+            else:
+                data["children"].append(child_data)
+            self._update_load_more_label(load_more_node)
+            return
+
+        self._add_child_node(parent_node, child_data, depth, before=before)
+        parent_node.allow_expand = True
+
+    def _filter_pending(self, load_more_node, present) -> list:
+        """Drop pending children which are gone, return their DNs."""
+        data = load_more_node.data
+        pending = data["children"][data["offset"] :]
+        kept = [child for child in pending if child["dn"].lower() in present]
+        data["children"], data["offset"] = kept, 0
+        if not kept:
+            load_more_node.remove()
+        else:
+            self._update_load_more_label(load_more_node)
+        return [child["dn"] for child in pending if child["dn"].lower() not in present]
+
+    def _unregister_subtree(self, node) -> None:
+        for child_node in node.children:
+            self._unregister_subtree(child_node)
+        if node.data and "dn" in node.data:
+            self._nodes_by_dn.pop(node.data["dn"].lower(), None)
+
+    # Tree rendering
+    # =============================================================
+
+    def render_tree(self, tree_data):
+        "Replace the tree content with LDAP tree data"
 
         # Clear existing tree content
         self.clear()
+        self._nodes_by_dn = {}
+        self.watermark = tree_data.get("watermark")
 
         if "error" in tree_data["root"]:
             # Handle error case
@@ -100,6 +346,7 @@ class TreeView(TreeDataDir):
 
         # Set root label
         self.root.label = root_data["label"]
+        self._nodes_by_dn[root_data["dn"].lower()] = self.root
 
         # Recursively build the tree structure
         self._build_tree_recursive(
@@ -121,54 +368,98 @@ class TreeView(TreeDataDir):
     def _build_tree_recursive(
         self, parent_node, children_data, containers_first=False, depth=0
     ):
-        """Recursively build tree nodes from LDAP data."""
+        """Recursively build tree nodes from LDAP data, one chunk per level."""
         if not children_data:
             return
 
         # Sort children if containers_first is enabled
         sorted_children = children_data
         if containers_first:
-            # Separate containers (with children) and leaves (without children)
-            containers = []
-            leaves = []
-
-            for child_data in children_data:
-                if child_data["has_children"]:
-                    containers.append(child_data)
-                else:
-                    leaves.append(child_data)
-
-            # Sort each group alphabetically by label
-            containers.sort(key=lambda x: x["label"].lower())
-            leaves.sort(key=lambda x: x["label"].lower())
-
-            # Combine: containers first, then leaves
-            sorted_children = containers + leaves
-            logger.debug(
-                "Sorted %d containers and %d leaves", len(containers), len(leaves)
-            )
+            # Containers first, then leaves, each group alphabetically by label.
+            # Keys are computed once per child, not once per comparison.
+            keys = [self._sort_key(child_data) for child_data in children_data]
+            order = sorted(range(len(children_data)), key=keys.__getitem__)
+            sorted_children = [children_data[idx] for idx in order]
+            logger.debug("Sorted %d children", len(sorted_children))
+
+        end = min(self.chunk_size, len(sorted_children))
+        for child_data in sorted_children[:end]:
+            self._add_child_node(parent_node, child_data, depth)
+        self._add_load_more_node(parent_node, sorted_children, end, depth)
+
+    def _add_child_node(self, parent_node, child_data, depth, before=None):
+        """Add the node of an entry, and the nodes of its loaded children."""
+        # Store DN and attributes in node data for future reference
+        node_data = {
+            "dn": child_data["dn"],
+            "attributes": child_data["attributes"],
+            "has_children": child_data["has_children"],
+            "depth": depth,
+        }
+
+        if child_data["has_children"]:
+            # Entry has children - add as expandable node
+            child_node = parent_node.add(child_data["label"], node_data, before=before)
+
+            # Recursively add children if they exist
+            if child_data.get("children"):
+                self._build_tree_recursive(
+                    child_node, child_data["children"], self.containers_first, depth + 1
+                )
+        else:
+            # Entry has no children - add as leaf
+            child_node = parent_node.add_leaf(child_data["label"], node_data, before=before)
 
-        # Add children recursively
-        for child_data in sorted_children:
-            # Store DN and attributes in node data for future reference
-            node_data = {
-                "dn": child_data["dn"],
-                "attributes": child_data["attributes"],
-                "has_children": child_data["has_children"],
-                "depth": depth,
-            }
-
-            if child_data["has_children"]:
-                # Entry has children - add as expandable node
-                child_node = parent_node.add(child_data["label"])
-                child_node.data = node_data
-
-                # Recursively add children if they exist
-                if child_data.get("children"):
-                    self._build_tree_recursive(
-                        child_node, child_data["children"], containers_first, depth + 1
-                    )
-            else:
-                # Entry has no children - add as leaf
-                child_node = parent_node.add_leaf(child_data["label"])
-                child_node.data = node_data
+        self._nodes_by_dn[child_data["dn"].lower()] = child_node
+        return child_node
+
+    # Chunked loading
+    # =============================================================
+
+    def _add_load_more_node(self, parent_node, sorted_children, offset, depth):
+        """Add the placeholder of the children not rendered yet, if any."""
+        if offset >= len(sorted_children):
+            return
+        node_data = {
+            "load_more": True,
+            "children": sorted_children,
+            "offset": offset,
+            "depth": depth,
+        }
+        node = parent_node.add_leaf("", node_data)
+        self._update_load_more_label(node)
+
+    @staticmethod
+    def _update_load_more_label(node):
+        remaining = len(node.data["children"]) - node.data["offset"]
+        node.set_label(f"… {remaining} more")
+
+    @staticmethod
+    def _get_load_more_node(parent_node):
+        children = parent_node.children
+        if children and children[-1].data and children[-1].data.get("load_more"):
+            return children[-1]
+        return None
+
+    @work(exclusive=False, group="tree-chunks")
+    async def load_more(self, node) -> None:
+        """Replace a placeholder with the next chunk of children.
+
+        Nodes are added TICK_BATCH at a time, yielding to the event loop in
+        between, so the UI stays responsive while a chunk loads.
+        """
+        data = node.data
+        if node.parent is None or not data.get("load_more"):
+            return
+        parent_node = node.parent
+        node.remove()
+
+        sorted_children, offset = data["children"], data["offset"]
+        end = min(offset + self.chunk_size, len(sorted_children))
+        for start in range(offset, end, TICK_BATCH):
+            for child_data in sorted_children[start : min(start + TICK_BATCH, end)]:
+                self._add_child_node(parent_node, child_data, data["depth"])
+            await asyncio.sleep(0)
+
+        self._add_load_more_node(parent_node, sorted_children, end, data["depth"])
+        logger.info("Loaded %d more children", end - offset)
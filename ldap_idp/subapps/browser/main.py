@@ -14,13 +14,31 @@ from textual.binding import Binding
 from textual.widgets import ContentSwitcher
 from textual import work
 from textual.reactive import reactive
-
-from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+from textual.worker import get_current_worker
+
+from ldap_idp.export import ExportCancelled, export_path, write_ldif
+from ldap_idp.ldap_backend import (
+    LDAPConfig,
+    LDAPConnectionImproved,
+    SCOPE_BASE,
+    SCOPE_SUBTREE,
+    apply_modlist,
+    get_rdn,
+)
+from ldap_idp.ldap_cache import PersistentCache, fetch_stamps, stamps_changed
+from ldap_idp.ldap_groups import (
+    DYNAMIC_MEMBER_ATTRIBUTE,
+    MEMBERURL_ATTRIBUTE,
+    DynamicGroupResolver,
+)
 from ldap_idp.lib_textual.app_base import AppWrapper, WrappedAppBase
 from ldap_idp.lib_textual.layouts import LayoutUI1
 from ldap_idp.subapps.browser.app_menu import TreeView
 from ldap_idp.subapps.browser.app_content import (
+    ContentViewBase,
+    ContentViewGroups,
     ContentViewJSON,
+    ContentViewReferences,
     ContentViewTable,
     HeaderView,
 )
@@ -39,6 +57,8 @@ logging.basicConfig(level=logging.INFO)
 VIEWS = {
     "view-table": ContentViewTable,
     "view-json": ContentViewJSON,
+    "view-groups": ContentViewGroups,
+    "view-references": ContentViewReferences,
 }
 
 
@@ -72,6 +92,8 @@ class SubAppBrowserMixin:
 
     current_ldap_connection = reactive(None)
     current_ldap_entry = reactive(None)
+    selected_dn = None
+    dynamic_groups = None
 
     @work
     async def load_ldap_session(self) -> None:
@@ -114,8 +136,15 @@ class SubAppBrowserMixin:
     def watch_current_ldap_connection(self, value):
         "Update UI when current LDAP connection changes"
 
+        self.dynamic_groups = (
+            DynamicGroupResolver(value, ttl=settings.cache.dynamic_groups_ttl)
+            if value else None
+        )
+
         # Update sub elements
         self.query_one("TreeView").current_ldap_connection = value
+        for view in self.query(ContentViewBase):
+            view.ldap_connection = value
 
     def watch_current_ldap_entry(self, ldap_entry):
         "Update UI when current LDAP entry changes"
@@ -144,7 +173,13 @@ class SubAppBrowserMixin:
 
             # Fetch LDAP entry
             dn = message.node_data["dn"]
-            ldap_entry = self.current_ldap_connection.get_ldap_entry(dn)
+            self.selected_dn = dn
+            if self.persistent_cache:
+                cached = self.persistent_cache.get("entry", dn.lower())
+                ldap_entry = cached[0] if cached else None
+                self.revalidate_entry(self.current_ldap_connection, dn)
+            else:
+                ldap_entry = self.current_ldap_connection.get_ldap_entry(dn)
             logger.info("LDAP entry: %s", ldap_entry)
 
             self.query_one(ContentSwitcher).display = True
@@ -152,6 +187,138 @@ class SubAppBrowserMixin:
             self.query_one(ContentSwitcher).display = False
 
         self.current_ldap_entry = ldap_entry
+        if ldap_entry and MEMBERURL_ATTRIBUTE in ldap_entry["attributes"]:
+            self.resolve_dynamic_members(ldap_entry)
+
+    @work(thread=True, exclusive=True, group="dynamic-members")
+    def resolve_dynamic_members(self, ldap_entry) -> None:
+        """Show the members of a dynamic group as a virtual attribute."""
+        ldap_entry = self.add_dynamic_members(ldap_entry)
+        if DYNAMIC_MEMBER_ATTRIBUTE in ldap_entry["attributes"]:
+            self.app.call_from_thread(self._patch_current_entry, ldap_entry["dn"], ldap_entry)
+
+    def add_dynamic_members(self, ldap_entry):
+        """Return an entry with the members of its dynamic group, if it is one."""
+        if not ldap_entry or MEMBERURL_ATTRIBUTE not in ldap_entry["attributes"]:
+            return ldap_entry
+        [ldap_entry] = self.dynamic_groups.add_dynamic_members([ldap_entry])
+        return ldap_entry
+
+    def on_tree_view_entries_changed(self, message: TreeView.EntriesChanged) -> None:
+        """Keep the membership graph and reference index in line with refreshed tree entries."""
+        indexes = [
+            self.query_one(ContentViewGroups).membership,
+            self.query_one(ContentViewReferences).references,
+        ]
+        for index in indexes:
+            if not index.built:
+                continue
+            for entry in message.changes:
+                index.update_entry(entry["dn"], entry["attributes"])
+            for dn in message.removed_dns:
+                index.remove_entry(dn)
+
+    @work(thread=True, exclusive=True, group="entry-revalidate")
+    def revalidate_entry(self, ldap_connection, dn: str) -> None:
+        """Refetch a cached entry if its stamps changed on the server."""
+        try:
+            stamps = fetch_stamps(ldap_connection, dn, scope=SCOPE_BASE)
+        except ldap.LDAPError as err:
+            logger.error("Entry revalidation failed for %s: %s", dn, err)
+            return
+        cached = self.persistent_cache.get("entry", dn.lower())
+        if not stamps_changed(cached[1] if cached else None, stamps):
+            return
+
+        ldap_entry = ldap_connection.get_ldap_entry(dn)
+        if ldap_entry is None:
+            self.persistent_cache.delete("entry", dn.lower())
+        else:
+            self.persistent_cache.put("entry", dn.lower(), ldap_entry, stamps)
+            # The virtual members are not cached, they are resolved for display
+            ldap_entry = self.add_dynamic_members(ldap_entry)
+        self.app.call_from_thread(self._patch_current_entry, dn, ldap_entry)
+
+    def _patch_current_entry(self, dn: str, ldap_entry) -> None:
+        """Display a refreshed entry, unless the selection moved meanwhile."""
+        if self.selected_dn and self.selected_dn.lower() == dn.lower():
+            self.current_ldap_entry = ldap_entry
+
+    def action_toggle_edit(self) -> None:
+        """Edit the values of the selected entry in the table view."""
+        table_view = self.query_one(ContentViewTable)
+        if self.query_one(ContentSwitcher).current != table_view.id:
+            self.notify("Editing is done in the table view")
+            return
+        table_view.set_edit_mode(not table_view.edit_mode)
+
+    def on_content_view_table_entry_modified(self, message: ContentViewTable.EntryModified) -> None:
+        """Apply a saved modification to the displayed entry, caches and tree, without reload."""
+        entry = self.current_ldap_entry
+        if entry and entry["dn"].lower() == message.dn.lower():
+            entry = dict(entry, attributes=apply_modlist(entry["attributes"], message.modlist))
+            self.current_ldap_entry = entry
+            display_mode = self.query_one("TreeView").display_mode
+            self.update_modified_entry(self.current_ldap_connection, entry, display_mode)
+        self.notify(f"Saved {len(message.modlist)} modifications to {message.dn}")
+
+    @work(thread=True, exclusive=True, group="entry-modified")
+    def update_modified_entry(self, ldap_connection, ldap_entry, display_mode) -> None:
+        """Store a modified entry in the persistent cache and relabel its tree node."""
+        dn = ldap_entry["dn"]
+        if self.persistent_cache:
+            try:
+                stamps = fetch_stamps(ldap_connection, dn, scope=SCOPE_BASE)
+            except ldap.LDAPError as err:
+                logger.error("Entry stamps unavailable for %s: %s", dn, err)
+                self.persistent_cache.delete("entry", dn.lower())
+            else:
+                # The virtual members are not cached, they are resolved for display
+                attributes = dict(ldap_entry["attributes"])
+                attributes.pop(DYNAMIC_MEMBER_ATTRIBUTE, None)
+                cached_entry = dict(ldap_entry, attributes=attributes)
+                self.persistent_cache.put("entry", dn.lower(), cached_entry, stamps)
+
+        node_data = ldap_connection._make_node_data(ldap_entry, display_mode=display_mode)
+        self.app.call_from_thread(lambda: self.query_one("TreeView").update_entry(node_data))
+
+    def action_refresh_tree(self) -> None:
+        """Patch the tree with the entries changed since the last sync."""
+        self.query_one("TreeView").refresh_tree()
+
+    def action_export(self) -> None:
+        """Export the subtree of the selected entry to LDIF."""
+        if not self.current_ldap_connection:
+            self.notify("Waiting for LDAP connection...")
+            return
+        base_dn = self.selected_dn or self.current_ldap_connection.base_dn
+        path = export_path(settings.export.directory, get_rdn({"dn": base_dn}) or "root", "ldif")
+        self.export_subtree(self.current_ldap_connection, base_dn, path)
+
+    @work(thread=True, exclusive=True, group="export")
+    def export_subtree(self, ldap_connection, base_dn: str, path: str) -> None:
+        """Stream a subtree to an LDIF file, page by page."""
+        worker = get_current_worker()
+        tree_view = self.query_one("TreeView")
+
+        def progress(count):
+            self.app.call_from_thread(
+                setattr, tree_view, "border_subtitle", f"Exporting: {count} entries"
+            )
+
+        pages = ldap_connection.iter_search(base_dn=base_dn, scope=SCOPE_SUBTREE, raw=True)
+        try:
+            count = write_ldif(
+                path, pages, progress=progress, should_stop=lambda: worker.is_cancelled
+            )
+            message_text = f"Exported {count} entries to {path}"
+        except ExportCancelled:
+            message_text = "Export cancelled"
+        except (ldap.LDAPError, OSError) as err:
+            logger.error("Export to %s failed: %s", path, err)
+            message_text = f"Export failed: {err}"
+        self.app.call_from_thread(setattr, tree_view, "border_subtitle", "")
+        self.app.call_from_thread(self.notify, message_text)
 
     def action_cycle_views(self) -> None:
         """Action triggered when 't' key is pressed."""
@@ -185,6 +352,9 @@ class SubAppWidget(WrappedAppBase, SubAppBrowserMixin):
     # Key bindings
     BINDINGS = [
         Binding("v", "cycle_views", "Cycle views"),
+        Binding("r", "refresh_tree", "Refresh"),
+        Binding("x", "export", "Export"),
+        Binding("e", "toggle_edit", "Edit"),
     ]
 
     id = "app-browser"
@@ -192,6 +362,7 @@ class SubAppWidget(WrappedAppBase, SubAppBrowserMixin):
     def __init__(self, *args, **kwargs):
         self.app_config = None
         self.ldap_config = None
+        self.persistent_cache = None
         super().__init__(*args, **kwargs)
 
     def compose(self) -> ComposeResult:
@@ -202,6 +373,11 @@ class SubAppWidget(WrappedAppBase, SubAppBrowserMixin):
             "bind_dn": settings.authldap.bind_dn,
             "bind_password": settings.authldap.bind_pass,
             "base_dn": settings.authldap.base_dn,
+            "cache_socket": settings.cache.daemon_socket,
+            "snapshot_path": settings.cache.snapshot_path,
+            "record_path": settings.recording.record_path,
+            "replay_path": settings.recording.replay_path,
+            "replay_latency": settings.recording.replay_latency,
         }
         self.ldap_config = LDAPConfig(**new_conf)
 
@@ -230,6 +406,12 @@ class SubAppWidget(WrappedAppBase, SubAppBrowserMixin):
 
     def on_mount(self) -> None:
         """Ensure ldap widgets can load data"""
+        self.persistent_cache = PersistentCache.from_settings(self.ldap_config)
+        if self.persistent_cache:
+            tree_view = self.query_one("TreeView")
+            tree_view.persistent_cache = self.persistent_cache
+            tree_view.show_cached_tree()
+
         self.load_ldap_session()
 
 
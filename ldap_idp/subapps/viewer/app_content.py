@@ -2,17 +2,33 @@ import logging
 from types import SimpleNamespace
 from typing import Any, Dict
 
+import ldap
 
+from rich.markup import escape
+from rich.text import Text
 from textual.app import ComposeResult
+from textual.binding import Binding
 from textual.containers import ScrollableContainer
-from textual.widgets import DataTable, Static, Markdown
+from textual.widgets import Input, Static, Markdown, Tree
 from textual.widget import Widget
 from textual.reactive import reactive
-from textual.widgets import Pretty
 from textual import work
+from textual.worker import get_current_worker
 
+from ldap_idp.columnar import ResultStore
+from ldap_idp.facets import count_facets, profile_facets, scan_facets
 from ldap_idp.lib_textual.decorators import message, action, watch
+from ldap_idp.lib_textual.wid_json import JSONView
+from ldap_idp.lib_textual.wid_table import VirtualTable
 from ldap_idp.ldap_backend import get_rdn, SCOPE_SUBTREE
+from ldap_idp.ldap_cache import fetch_stamps, stamps_changed
+from ldap_idp.ldap_diff import DirectoryDiff, iter_source_entries
+from ldap_idp.ldap_groups import DYNAMIC_MEMBER_ATTRIBUTE, MEMBERURL_ATTRIBUTE
+from ldap_idp.ldap_live import LiveWatcher
+from ldap_idp.ldap_references import reference_attributes
+from ldap_idp.metrics import METRICS, timed
+from ldap_idp.profiles import profile_columns
+from ldap_idp.scan import scan_directory
 from ldap_idp.config import settings
 
 logger = logging.getLogger(__name__)
@@ -58,6 +74,7 @@ Children: {data.children}
 
         self.update("Please select entry")
 
+    @timed("render.viewer.header")
     def render(self) -> str:
         rule_entry = self.current_rule_entry
 
@@ -129,6 +146,52 @@ Children: {data.children}
 # Content panels
 # =============================================================
 
+class DirectoryJobs:
+    """Results of whole-directory jobs (integrity scan, diffs), shared by the views of an app.
+
+    Each job runs once at a time: views asking for it while it runs wait
+    for it, and are refreshed when it completes.
+    """
+
+    SCAN = "scan"
+
+    def __init__(self):
+        self.results: Dict[Any, list] = {}
+        self.running = set()
+
+    def start(self, key) -> bool:
+        """Mark a job as running, return False if it already is."""
+        if key in self.running:
+            return False
+        self.running.add(key)
+        return True
+
+    def finish(self, key, results=None) -> None:
+        """Store the results of a job, or nothing if it failed."""
+        self.running.discard(key)
+        if results is not None:
+            self.results[key] = results
+
+    @classmethod
+    def key_of(cls, rule_entry):
+        """Return the key of the job whose results a rule displays, if any.
+
+        Diffs are keyed by their (old, new) sources.
+        """
+        if rule_entry and rule_entry.get("scan"):
+            return cls.SCAN
+        if rule_entry and rule_entry.get("diff"):
+            return (rule_entry["diff"]["old"], rule_entry["diff"].get("new", "live"))
+        return None
+
+    def clear(self, key=None) -> None:
+        """Forget the results of a job, or of all of them, to run them again."""
+        if key is None:
+            self.results.clear()
+        else:
+            self.results.pop(key, None)
+
+
 class ContentViewBase(ScrollableContainer, can_focus=False):
     """Base class for content views."""
 
@@ -140,6 +203,16 @@ class ContentViewBase(ScrollableContainer, can_focus=False):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._pending_rule_entry = None
+        self.persistent_cache = None
+        self.dynamic_groups = None
+        self.jobs = DirectoryJobs()
+
+        # Live mode: displayed results by lowercase DN, patched by a LiveWatcher
+        self.live = False
+        self.live_results = {}
+
+    def on_mount(self) -> None:
+        METRICS.gauge(f"memory.viewer.{self.id}", lambda: self.live_results)
 
     @watch("current_rule_entry")
     def watch_current_rule_entry_____(self, rule_entry):
@@ -151,21 +224,47 @@ class ContentViewBase(ScrollableContainer, can_focus=False):
         if not rule_entry:
             logger.info("No rule entry provided, returning early")
             return
+
+        # Render cached results first, even before being connected
+        query = rule_entry.get("ldap_filter")
+        cached = None
+        if self.persistent_cache and isinstance(query, str):
+            cached = self.persistent_cache.get("query", query)
+            if cached is not None:
+                logger.info("Rendering results from persistent cache")
+                self.loading = False
+                self.display_results(rule_entry, cached[0])
         
         if not self.current_ldap_connection:
             # Store the rule entry to process when connection becomes available
             self._pending_rule_entry = rule_entry
             logger.info("No LDAP connection available, storing pending rule entry")
-            self.notify("Waiting for LDAP connection...")
-            self.loading = True
+            if cached is None:
+                self.notify("Waiting for LDAP connection...")
+                self.loading = True
             return
         
         # Clear any pending rule entry since we have a connection
         self._pending_rule_entry = None
         logger.info("LDAP connection available, processing rule entry")
+
+        if rule_entry.get("scan"):
+            self.show_scan_findings(rule_entry)
+            return
+
+        if rule_entry.get("diff"):
+            # The live directory may have changed since the last comparison
+            sources = DirectoryJobs.key_of(rule_entry)
+            if "live" in sources and sources not in self.jobs.running:
+                self.jobs.clear(sources)
+            self.show_diff_changes(rule_entry)
+            return
+
+        if self.persistent_cache and isinstance(query, str):
+            self.revalidate_results(rule_entry, self.current_ldap_connection)
+            return
         
         # Query data
-        query = rule_entry.get("ldap_filter")
         # if not query:
         #     assert False, "TOFIX: no query"
         results = []
@@ -176,7 +275,7 @@ class ContentViewBase(ScrollableContainer, can_focus=False):
 
 
         # Process widget data ...
-        self.view_result_process(rule_entry, results)
+        self.display_results(rule_entry, results)
 
     @work
     async def watch_current_ldap_connection(self, connection):
@@ -189,6 +288,248 @@ class ContentViewBase(ScrollableContainer, can_focus=False):
             self.watch_current_rule_entry(self._pending_rule_entry)
 
 
+    @work(thread=True, exclusive=True, group="results-revalidate")
+    def revalidate_results(self, rule_entry, ldap_connection):
+        """Refetch cached results if their stamps changed on the server."""
+        query = rule_entry["ldap_filter"]
+        try:
+            stamps = fetch_stamps(ldap_connection, scope=SCOPE_SUBTREE, filter_str=query)
+        except ldap.LDAPError as err:
+            logger.error("Results revalidation failed for %s: %s", query, err)
+            self.app.call_from_thread(setattr, self, "loading", False)
+            return
+        cached = self.persistent_cache.get("query", query)
+        if not stamps_changed(cached[1] if cached else None, stamps):
+            logger.info("Cached results are up to date for %s", query)
+            self.app.call_from_thread(setattr, self, "loading", False)
+            return
+
+        results = ldap_connection.search(scope=SCOPE_SUBTREE, filter_str=query)
+        self.persistent_cache.put("query", query, results, stamps)
+        self.app.call_from_thread(self._patch_results, rule_entry, results)
+
+    def _patch_results(self, rule_entry, results):
+        """Display refreshed results, unless another rule got selected meanwhile."""
+        if self.current_rule_entry is not rule_entry:
+            return
+        self.loading = False
+        self.display_results(rule_entry, results)
+
+    # Live mode
+    # =============================================================
+
+    @timed("render.viewer.results")
+    def display_results(self, rule_entry, results):
+        """Render results, then follow their changes if live mode is on."""
+        self.live_results = {result["dn"].lower(): result for result in results}
+        self.view_result_process(rule_entry, results)
+        if self.dynamic_groups and self.wants_dynamic_members(rule_entry):
+            self.resolve_dynamic_members(rule_entry, results)
+        if self.live:
+            self.start_live(rule_entry)
+
+    # Integrity scan
+    # =============================================================
+
+    def show_scan_findings(self, rule_entry) -> None:
+        """Display the findings of a scan profile, scanning once for all profiles."""
+        findings = self.jobs.results.get(DirectoryJobs.SCAN)
+        if findings is None:
+            self.loading = True
+            if self.jobs.start(DirectoryJobs.SCAN):
+                self.run_scan(self.current_ldap_connection)
+            return
+
+        self.loading = False
+        checks = rule_entry["scan"]
+        checks = [checks] if isinstance(checks, str) else list(checks)
+        results = [
+            {
+                "dn": item["dn"],
+                "attributes": {
+                    "check": [item["check"]],
+                    "attribute": [item["attribute"]],
+                    "value": [item["value"]],
+                },
+            }
+            for item in findings
+            if item["check"] in checks
+        ]
+        self.display_results(rule_entry, results)
+
+    @work(thread=True, exclusive=True, group="scan")
+    def run_scan(self, ldap_connection) -> None:
+        """Scan the directory in this thread, a process pool would fork the app."""
+        try:
+            attributes = reference_attributes(
+                ldap_connection, settings.browser.reference_attributes
+            )
+            scanner, findings = scan_directory(ldap_connection, attributes)
+            findings = list(findings)
+        except (ldap.LDAPError, OSError) as err:
+            logger.error("Integrity scan failed: %s", err)
+            self.app.call_from_thread(self.notify, f"Scan failed: {err}", severity="error")
+            self.app.call_from_thread(self._job_done, DirectoryJobs.SCAN, None)
+            return
+
+        stats = scanner.stats
+        self.app.call_from_thread(
+            self.notify,
+            f"Scanned {stats['entries']} entries in {stats['elapsed']:.1f}s",
+        )
+        self.app.call_from_thread(self._job_done, DirectoryJobs.SCAN, findings)
+
+    def _job_done(self, key, results) -> None:
+        """Store the results of a job, and refresh the views waiting for it."""
+        self.jobs.finish(key, results)
+        for view in self.parent.children:
+            if not isinstance(view, ContentViewBase) or not view.loading:
+                continue
+            if DirectoryJobs.key_of(view.current_rule_entry) != key:
+                continue
+            if results is None:
+                view.loading = False
+            elif key == DirectoryJobs.SCAN:
+                view.show_scan_findings(view.current_rule_entry)
+            else:
+                view.show_diff_changes(view.current_rule_entry)
+
+    def rerun_rule(self, rule_entry) -> None:
+        """Display a rule again, running its job or querying its results again."""
+        key = DirectoryJobs.key_of(rule_entry)
+        if key is not None and key not in self.jobs.running:
+            self.jobs.clear(key)
+        self.watch_current_rule_entry(rule_entry)
+
+    # Directory diff
+    # =============================================================
+
+    def show_diff_changes(self, rule_entry) -> None:
+        """Display the differences of two directory states, comparing them once for all views."""
+        sources = DirectoryJobs.key_of(rule_entry)
+        changes = self.jobs.results.get(sources)
+        if changes is None:
+            self.loading = True
+            if self.jobs.start(sources):
+                self.run_diff(sources, self.current_ldap_connection)
+            return
+
+        self.loading = False
+        self.display_results(rule_entry, changes)
+
+    @work(thread=True, group="diff")
+    def run_diff(self, sources, ldap_connection) -> None:
+        """Compare the sources in this thread, keeping a summary row per change."""
+        differ = DirectoryDiff()
+        old_entries, new_entries = (
+            iter_source_entries(source, ldap_connection=ldap_connection) for source in sources
+        )
+        changes = []
+        try:
+            for kind, dn, payload in differ.diff(old_entries, new_entries):
+                if kind == "add":
+                    names = list(payload)
+                elif kind == "modify":
+                    names = list(dict.fromkeys(attr for _op, attr, _values in payload))
+                else:
+                    names = []
+                changes.append(
+                    {"dn": dn, "attributes": {"change": [kind], "attributes": [", ".join(names)]}}
+                )
+        except (ldap.LDAPError, OSError, ValueError) as err:
+            logger.error("Diff of %s failed: %s", sources, err)
+            self.app.call_from_thread(self.notify, f"Diff failed: {err}", severity="error")
+            self.app.call_from_thread(self._job_done, sources, None)
+            return
+
+        stats = differ.stats
+        self.app.call_from_thread(
+            self.notify,
+            f"Compared {stats['old']} and {stats['new']} entries in {stats['elapsed']:.1f}s: "
+            f"{stats['add']} added, {stats['modify']} modified, {stats['delete']} deleted",
+        )
+        self.app.call_from_thread(self._job_done, sources, changes)
+
+    # Dynamic groups
+    # =============================================================
+
+    @staticmethod
+    def wants_dynamic_members(rule_entry) -> bool:
+        """Tell whether a profile displays the members of dynamic groups."""
+        columns = [col.lower() for col in rule_entry.get("attr") or []]
+        return DYNAMIC_MEMBER_ATTRIBUTE.lower() in columns
+
+    @work(thread=True, exclusive=True, group="dynamic-members")
+    def resolve_dynamic_members(self, rule_entry, results):
+        """Evaluate the memberURL of all displayed groups, in batched queries."""
+        results = self.dynamic_groups.add_dynamic_members(results)
+        self.app.call_from_thread(self._show_dynamic_members, rule_entry, results)
+
+    def _show_dynamic_members(self, rule_entry, results):
+        if self.current_rule_entry is not rule_entry:
+            return
+        self.live_results = {result["dn"].lower(): result for result in results}
+        self.view_result_process(rule_entry, results)
+
+    def set_live(self, enabled: bool) -> None:
+        """Turn live updates of the displayed results on or off."""
+        self.live = enabled
+        if enabled:
+            self.start_live(self.current_rule_entry)
+        else:
+            self.workers.cancel_group(self, "live-watch")
+            self.border_subtitle = ""
+
+    def start_live(self, rule_entry) -> None:
+        """Start following the results of a rule, replacing any other watch."""
+        self.workers.cancel_group(self, "live-watch")
+        query = rule_entry.get("ldap_filter") if rule_entry else None
+        if not isinstance(query, str) or not self.current_ldap_connection:
+            self.border_subtitle = ""
+            return
+        self.live_watch(rule_entry, self.current_ldap_connection, list(self.live_results.values()))
+
+    @work(thread=True, exclusive=True, group="live-watch")
+    def live_watch(self, rule_entry, ldap_connection, known_results):
+        """Apply syncrepl or polling deltas to the results until cancelled."""
+        worker = get_current_worker()
+        watcher = LiveWatcher(
+            ldap_connection,
+            rule_entry["ldap_filter"],
+            known_results,
+            on_change=lambda kind, dn, attributes: self.app.call_from_thread(
+                self.apply_live_change, rule_entry, kind, dn, attributes
+            ),
+            on_status=lambda text: self.app.call_from_thread(
+                setattr, self, "border_subtitle", text
+            ),
+            poll_interval=settings.viewer.live_poll_interval,
+            use_syncrepl=settings.viewer.live_syncrepl,
+        )
+        watcher.run(lambda: worker.is_cancelled)
+
+    def apply_live_change(self, rule_entry, kind, dn, attributes):
+        """Patch the displayed results with one change."""
+        if self.current_rule_entry is not rule_entry:
+            return
+        key = dn.lower()
+        if kind == "delete":
+            self.live_results.pop(key, None)
+            result = None
+        else:
+            result = {"dn": dn, "attributes": attributes}
+            self.live_results[key] = result
+        self.patch_result(rule_entry, kind, key, result)
+
+        # Changed dynamic groups come without their virtual members
+        if result and self.dynamic_groups and self.wants_dynamic_members(rule_entry):
+            if any(name.lower() == MEMBERURL_ATTRIBUTE.lower() for name in attributes):
+                self.resolve_dynamic_members(rule_entry, list(self.live_results.values()))
+
+    def patch_result(self, rule_entry, kind, key, result):
+        """Apply a change to the widget, by rendering all results again."""
+        self.view_result_process(rule_entry, list(self.live_results.values()))
+
     def view_result_process(self, rule_entry, results):
         """Process the results and update the content view."""
         # self.notify(f"results: {results}", markup=False)
@@ -223,7 +564,7 @@ class ContentViewBase(ScrollableContainer, can_focus=False):
 
 
 
-class ContentViewJSON(ContentViewBase, can_focus=True):
+class ContentViewJSON(ContentViewBase):
     """Right pane for the app."""
 
     DEFAULT_CSS = """
@@ -241,7 +582,7 @@ class ContentViewJSON(ContentViewBase, can_focus=True):
 
     def compose(self) -> ComposeResult:
         """Create child widgets for the scrollable container."""
-        self.content_widget = Pretty(self.current_rule_entry, id="content-static")
+        self.content_widget = JSONView(self.current_rule_entry, id="content-static")
 
         yield self.content_widget
 
@@ -259,20 +600,31 @@ class ContentViewTable(ContentViewBase):
     ContentViewTable {
         border: solid $primary;
     }
+    ContentViewTable #table-filter {
+        dock: top;
+    }
     """
 
     BORDER_TITLE = "Table view"
 
+    BINDINGS = [
+        Binding("escape", "close_filter", "Clear filter", show=False),
+    ]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.loading = False
         self.content_widget = None
-        self.current_sort_column = None
-        self.current_sort_reverse = False
+        self.filter_input = None
+        self.current_columns = []
+        self.store = None
 
     def compose(self) -> ComposeResult:
         """Create child widgets for the scrollable container."""
-        self.content_widget = DataTable(id="table-container")
+        self.filter_input = Input(placeholder="Filter rows", id="table-filter")
+        self.filter_input.display = False
+        yield self.filter_input
+        self.content_widget = VirtualTable(id="table-container")
         self.content_widget.can_focus = False
         yield self.content_widget
 
@@ -294,70 +646,274 @@ class ContentViewTable(ContentViewBase):
     def _render_results(self, rule_entry, results):
         """Render the entity."""
 
-        # Reset table and remove all columns
-        self.content_widget.clear()
-        for col in list(self.content_widget.columns):
-            self.content_widget.remove_column(col)
-
         # Early quit and hide table if no results
         if not results:
+            self.store = None
+            self.content_widget.clear()
             self.notify("No results found for this query")
             self.display = False
             return
         
         self.display = True
 
+        # Results are stored by column, the table renders the visible rows
+        self.current_columns = profile_columns(rule_entry)
+        self.store = ResultStore.from_results(
+            self.current_columns, results, settings.viewer.missing_value_placeholder
+        )
+        if self.filter_input.value:
+            self.store.filter(self.filter_input.value)
+        self.content_widget.set_store(self.store)
+        self._update_filter_title()
+
+    def patch_result(self, rule_entry, kind, key, result):
+        """Add, update or remove a single row, without rebuilding the store."""
+        if self.store is None:
+            # Table was empty and hidden, render it
+            self.view_result_process(rule_entry, list(self.live_results.values()))
+            return
+
+        if kind == "delete":
+            self.store.delete(key)
+        else:
+            self.store.upsert(result)
+        self.content_widget.refresh_view()
+        self._update_filter_title()
 
-        # Clear existing table and reset sorting
-        self.current_sort_column = None
-        self.current_sort_reverse = False
-        columns = rule_entry.get("attr") or ["dn"]
-        columns = [col.lower() for col in columns]
-        self.content_widget.add_columns(*columns)
-        missing_placeholder = settings.viewer.missing_value_placeholder
-
-        for result in results:
-
-            dn = result.get("dn")
-            attrs = result.get("attributes")
-            attrs = {k.lower(): v for k, v in attrs.items()}
-
-            fields2 = []
-            for field in columns:
-                value = missing_placeholder
-
-                if field == "dn":
-                    value = dn
-                elif field in attrs:
-                    value = attrs[field]
-
-                    # # TOFIX HERE
-                    if isinstance(value, list):
-                        if len(value) > 0:
-                            value = value[0]
-                        else:
-                            value = missing_placeholder
-
-                fields2.append(value)
-            
-            
-            # self.content_widget.add_row(str(dn), *fields)
-            self.content_widget.add_row(*fields2)
- 
-            
-    @message(DataTable.HeaderSelected)
+    @message(VirtualTable.HeaderSelected)
     def on_content_widget_header_selected999(
-        self, event: DataTable.HeaderSelected
+        self, event: VirtualTable.HeaderSelected
     ) -> None:
-        """Handle header click for sorting using built-in sort method."""
+        """Handle header click for sorting the store."""
         column_key = event.column_key
 
         # Toggle sort direction if same column, otherwise start ascending
-        if self.current_sort_column == column_key:
-            self.current_sort_reverse = not self.current_sort_reverse
+        if self.store.sort_column == column_key:
+            reverse = not self.store.sort_reverse
         else:
-            self.current_sort_column = column_key
-            self.current_sort_reverse = False
+            reverse = False
+
+        with METRICS.timer("render.viewer.sort"):
+            self.store.sort(column_key, reverse=reverse)
+        self.content_widget.refresh_view()
+
+    # Filter
+    # =============================================================
+
+    def open_filter(self) -> None:
+        self.filter_input.display = True
+        self.filter_input.focus()
+        if self.store is not None:
+            # Build the index now rather than on the first key
+            self.store.search_index()
+
+    def action_close_filter(self) -> None:
+        """Clear the filter and hide its input."""
+        self.filter_input.value = ""
+        self.filter_input.display = False
+        self.app.set_focus(None)
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        """Filter the fetched rows as the query is typed."""
+        event.stop()
+        if self.store is None:
+            return
+        METRICS.observe("render.viewer.filter", self.store.filter(event.value))
+        self.content_widget.refresh_view()
+        self.content_widget.scroll_to(y=0, animate=False)
+        self._update_filter_title()
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        """Keep the filter, and leave its input."""
+        event.stop()
+        if not event.value:
+            self.filter_input.display = False
+        self.app.set_focus(None)
+
+    def _update_filter_title(self) -> None:
+        if self.store is not None and self.store.query:
+            self.border_title = f"{self.BORDER_TITLE}: {len(self.store)} of {self.store.size} rows"
+        else:
+            self.border_title = self.BORDER_TITLE
+
+
+class ContentViewFacets(ContentViewBase):
+    """Right pane counting the values of the profile facets, to drill down."""
+
+    DEFAULT_CSS = """
+    ContentViewFacets {
+        border: solid $primary;
+    }
+    """
+
+    BORDER_TITLE = "Facets view"
+
+    BINDINGS = [
+        Binding("backspace", "drill_up", "Drill up", show=False),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loading = False
+        self.content_widget = None
+
+        # Results counted in memory, None when counted by a paged search
+        self.results = None
+        self.drills = []
+        self.counted_rule_entry = None
+
+    def compose(self) -> ComposeResult:
+        """Create child widgets for the scrollable container."""
+        self.content_widget = Tree("Facets", id="facets-tree")
+        yield self.content_widget
 
-        # Use built-in sort method
-        self.content_widget.sort(column_key, reverse=self.current_sort_reverse)
+    @watch("current_rule_entry")
+    def watch_current_rule_entry_facets(self, rule_entry):
+        """Count results already fetched in memory, or count with a paged search."""
+        self.workers.cancel_group(self, "facets")
+        if rule_entry is not self.counted_rule_entry:
+            self.counted_rule_entry = rule_entry
+            self.results = None
+            self.drills = []
+        if not rule_entry:
+            return
+
+        query = rule_entry.get("ldap_filter")
+        if rule_entry.get("scan") or rule_entry.get("diff") or not isinstance(query, str):
+            super().watch_current_rule_entry(rule_entry)
+            return
+
+        # Results displayed by another view, or cached, are counted in one pass
+        results = self.shared_results(rule_entry)
+        if results is not None:
+            self.loading = False
+            self.display_results(rule_entry, results)
+            return
+        if self.persistent_cache and self.persistent_cache.get("query", query) is not None:
+            super().watch_current_rule_entry(rule_entry)
+            return
+
+        if not self.current_ldap_connection:
+            self._pending_rule_entry = rule_entry
+            self.notify("Waiting for LDAP connection...")
+            self.loading = True
+            return
+        self._pending_rule_entry = None
+        self.start_count(rule_entry)
+
+    def shared_results(self, rule_entry):
+        """Return the results of rule_entry displayed by another view, if any."""
+        for view in self.siblings:
+            if (
+                isinstance(view, ContentViewBase)
+                and view.current_rule_entry is rule_entry
+                and view.live_results
+                and not view.loading
+            ):
+                return list(view.live_results.values())
+        return None
+
+    def view_result_process(self, rule_entry, results):
+        """Count the facets of results in memory."""
+        self.results = results
+        with METRICS.timer("render.viewer.facets"):
+            counter = count_facets(results, profile_facets(rule_entry), self.drills)
+        self.show_counts(counter)
+
+    def start_live(self, rule_entry) -> None:
+        # Counts of a paged search hold no result to patch
+        if self.results is None:
+            self.border_subtitle = ""
+            return
+        super().start_live(rule_entry)
+
+    # Paged count
+    # =============================================================
+
+    def start_count(self, rule_entry) -> None:
+        self.loading = True
+        self.count_results(rule_entry, self.current_ldap_connection, list(self.drills))
+
+    @work(thread=True, exclusive=True, group="facets")
+    def count_results(self, rule_entry, ldap_connection, drills) -> None:
+        """Count the facets page by page, fetching the facet attributes only."""
+        worker = get_current_worker()
+
+        def progress(count):
+            self.app.call_from_thread(
+                setattr, self, "border_subtitle", f"Counting: {count} entries"
+            )
+
+        try:
+            counter = scan_facets(
+                ldap_connection,
+                rule_entry["ldap_filter"],
+                profile_facets(rule_entry),
+                drills,
+                progress=progress,
+                should_stop=lambda: worker.is_cancelled,
+            )
+        except ldap.LDAPError as err:
+            logger.error("Facet count of %s failed: %s", rule_entry["ldap_filter"], err)
+            self.app.call_from_thread(self.notify, f"Facet count failed: {err}", severity="error")
+            self.app.call_from_thread(self._count_done, rule_entry, drills, None)
+            return
+        if counter is not None:
+            self.app.call_from_thread(self._count_done, rule_entry, drills, counter)
+
+    def _count_done(self, rule_entry, drills, counter) -> None:
+        """Display counts, unless another rule or drill down got selected meanwhile."""
+        if self.current_rule_entry is not rule_entry or self.drills != drills:
+            return
+        self.loading = False
+        self.border_subtitle = ""
+        if counter is not None:
+            self.show_counts(counter)
+
+    # Drill down
+    # =============================================================
+
+    def show_counts(self, counter) -> None:
+        """Display the most common values of each facet, with their counts."""
+        limit = settings.viewer.facet_limit
+        tree = self.content_widget
+        tree.clear()
+        tree.root.set_label(Text(f"{counter.total} entries"))
+        for facet in counter.facets:
+            counts = counter.counts[facet]
+            node = tree.root.add(Text(f"{facet} ({len(counts)} values)"), expand=True)
+            for value, count in counter.top(facet, limit):
+                leaf = node.add_leaf(Text.assemble((f"{count:>7}", "bold"), f"  {value}"))
+                leaf.data = (facet, value)
+            if len(counts) > limit:
+                node.add_leaf(Text(f"… {len(counts) - limit} more values", style="dim"))
+        tree.root.expand()
+
+        title = " > ".join(f"{facet}={value}" for facet, value in self.drills)
+        self.border_title = f"{self.BORDER_TITLE}: {escape(title)}" if title else self.BORDER_TITLE
+
+    def update_counts(self) -> None:
+        """Count again after a drill down changed."""
+        rule_entry = self.current_rule_entry
+        if not rule_entry:
+            return
+        if self.results is not None:
+            self.view_result_process(rule_entry, self.results)
+        elif self.current_ldap_connection:
+            self.start_count(rule_entry)
+
+    @message(Tree.NodeSelected)
+    def on_tree_node_selected999(self, event: Tree.NodeSelected) -> None:
+        """Drill down on the selected facet value."""
+        event.stop()
+        if not isinstance(event.node.data, tuple) or event.node.data in self.drills:
+            return
+        self.drills.append(event.node.data)
+        self.update_counts()
+
+    def action_drill_up(self) -> None:
+        """Remove the last drill down."""
+        if not self.drills:
+            return
+        self.drills.pop()
+        self.update_counts()
@@ -9,6 +9,7 @@ from ldap_idp.config import settings
 from ldap_idp.lib_textual.decorators import message, action, watch
 from ldap_idp.lib_textual.comp_config import AppConfigMixin
 from ldap_idp.lib_textual.wid_tree import TreeDataDir
+from ldap_idp.profiles import profile_rule
 
 logger = logging.getLogger(__name__)
 
@@ -84,14 +85,7 @@ class TreeView(TreeDataDir, AppConfigMixin):
             # Add rules
             profiles = ent_conf.profiles.to_dict()
             for rule_name, rule_conf in profiles.items():
-                rule_data = {
-                    "label": rule_name,
-                    "config": rule_conf,
-                    "type": "profile",
-
-                    "ldap_filter": rule_conf.get('ldap_filter',None),
-                }
-                rule_data.update(rule_conf)
+                rule_data = profile_rule(rule_name, rule_conf)
 
                 rule_node = entity_node.add_leaf(rule_data["label"])
                 rule_node.data = rule_data
@@ -14,17 +14,25 @@ from textual.binding import Binding
 from textual.widgets import ContentSwitcher
 from textual import work
 from textual.reactive import reactive
+from textual.worker import get_current_worker
 
 from ldap_idp.lib_textual.decorators import message, action, watch
+from ldap_idp.export import WRITERS, ExportCancelled, export_path, write_rows
 from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+from ldap_idp.ldap_cache import PersistentCache
+from ldap_idp.ldap_groups import DynamicGroupResolver
 from ldap_idp.lib_textual.app_base import AppWrapper, WrappedAppBase
 from ldap_idp.lib_textual.comp_store import AppStoreServerMixin
 from ldap_idp.lib_textual.layouts import LayoutUI1
+from ldap_idp.profiles import profile_columns
+from ldap_idp.query import query_rows
 from ldap_idp.subapps.viewer.app_menu import TreeView
 from ldap_idp.subapps.viewer.app_content import (
+    ContentViewFacets,
     ContentViewJSON,
     ContentViewTable,
     ContentViewBase,
+    DirectoryJobs,
     HeaderView,
     # ContentViewBeta,
 )
@@ -45,6 +53,7 @@ VIEWS = {
     # "view-table": ContentViewTable,
     "view-default": ContentViewTable,
     "view-json": ContentViewJSON,
+    "view-facets": ContentViewFacets,
     # "view-default": ContentViewBeta,
 }
 
@@ -82,6 +91,7 @@ class SubAppViewerMixin:
     current_ldap_connection = reactive(None)
     # current_ldap_entry = reactive(None)
     current_rule_entry = reactive(None)
+    live = False
 
     @work
     async def load_ldap_session(self) -> None:
@@ -129,6 +139,13 @@ class SubAppViewerMixin:
 
         # Update sub elements
         self.query_one("TreeView").current_ldap_connection = value
+        dynamic_groups = (
+            DynamicGroupResolver(value, ttl=settings.cache.dynamic_groups_ttl)
+            if value else None
+        )
+        self.jobs.clear()
+        for view in self.query(ContentViewBase):
+            view.dynamic_groups = dynamic_groups
 
     @watch("current_rule_entry")
     def watch_current_rule_entry444(self, rule_entry):
@@ -180,10 +197,13 @@ class SubAppViewerMixin:
         next_index = (current_index + 1) % len(views)
         content_switcher.current = views[next_index]
 
+        # Hand live mode over to the new view
+        self.query_one(f"#{current_view}").set_live(False)
+        active_view = self.query_one("ContentView").get_active_view()
+        active_view.live = self.live
+
         # Refresh content switcher
-        self.query_one("ContentView").get_active_view().current_rule_entry = (
-            self.current_rule_entry
-        )
+        active_view.current_rule_entry = self.current_rule_entry
 
         # Notify user
         logger.info(f"Switched from {current_view} to {views[next_index]}")
@@ -191,6 +211,82 @@ class SubAppViewerMixin:
         self.refresh_bindings()
 
 
+    @action("toggle_live")
+    def action_toggle_live222(self) -> None:
+        """Follow changes of the displayed results, or stop following them."""
+        self.live = not self.live
+        self.query_one("ContentView").get_active_view().set_live(self.live)
+        self.notify("Live updates enabled" if self.live else "Live updates disabled")
+
+    @action("refresh")
+    def action_refresh222(self) -> None:
+        """Display the selected profile again, rerunning its scan if any."""
+        rule_entry = self.current_rule_entry
+        if not rule_entry:
+            self.notify("Select a profile to refresh")
+            return
+        self.query_one("ContentView").get_active_view().rerun_rule(rule_entry)
+
+    @action("filter")
+    def action_filter222(self) -> None:
+        """Filter the rows of the table view by typing."""
+        active_view = self.query_one("ContentView").get_active_view()
+        if not hasattr(active_view, "open_filter"):
+            self.notify("Filtering is available in the table view")
+            return
+        active_view.open_filter()
+
+    @action("export")
+    def action_export222(self) -> None:
+        """Export the entries of the selected profile to a file."""
+        rule_entry = self.current_rule_entry
+        if not rule_entry or not isinstance(rule_entry.get("ldap_filter"), str):
+            self.notify("Select a profile to export")
+            return
+        if not self.current_ldap_connection:
+            self.notify("Waiting for LDAP connection...")
+            return
+
+        output_format = settings.export.viewer_format
+        if output_format not in WRITERS:
+            self.notify(
+                f"Unknown export.viewer_format: {output_format}, "
+                f"use one of {', '.join(WRITERS)}",
+                severity="error",
+            )
+            return
+        path = export_path(settings.export.directory, rule_entry["label"], output_format)
+        self.export_profile(rule_entry, self.current_ldap_connection, path, output_format)
+
+    @work(thread=True, exclusive=True, group="export")
+    def export_profile(self, rule_entry, ldap_connection, path, output_format) -> None:
+        """Stream the profile rows to a file, page by page."""
+        worker = get_current_worker()
+        tree_view = self.query_one("TreeView")
+
+        def progress(count):
+            self.app.call_from_thread(
+                setattr, tree_view, "border_subtitle", f"Exporting: {count} rows"
+            )
+
+        rows = query_rows(
+            ldap_connection, rule_entry, all_values=WRITERS[output_format].all_values
+        )
+        try:
+            count = write_rows(
+                path, profile_columns(rule_entry), rows, output_format,
+                progress=progress, should_stop=lambda: worker.is_cancelled,
+            )
+            message_text = f"Exported {count} rows to {path}"
+        except ExportCancelled:
+            message_text = "Export cancelled"
+        except (ldap.LDAPError, OSError) as err:
+            logger.error("Export to %s failed: %s", path, err)
+            message_text = f"Export failed: {err}"
+        self.app.call_from_thread(setattr, tree_view, "border_subtitle", "")
+        self.app.call_from_thread(self.notify, message_text)
+
+
 class SubAppWidget(WrappedAppBase, SubAppViewerMixin, AppStoreServerMixin):
     """Main container compound widget for the app."""
 
@@ -199,6 +295,10 @@ class SubAppWidget(WrappedAppBase, SubAppViewerMixin, AppStoreServerMixin):
     # Key bindings
     BINDINGS = [
         Binding("v", "cycle_views", "Cycle views"),
+        Binding("l", "toggle_live", "Live"),
+        Binding("r", "refresh", "Refresh"),
+        Binding("x", "export", "Export"),
+        Binding("slash", "filter", "Filter"),
     ]
 
     id = "app-viewer"
@@ -206,6 +306,8 @@ class SubAppWidget(WrappedAppBase, SubAppViewerMixin, AppStoreServerMixin):
     def __init__(self, *args, **kwargs):
         self.app_config = None
         self.ldap_config = None
+        self.persistent_cache = None
+        self.jobs = DirectoryJobs()
         super().__init__(*args, **kwargs)
 
 
@@ -218,6 +320,11 @@ class SubAppWidget(WrappedAppBase, SubAppViewerMixin, AppStoreServerMixin):
             "bind_dn": settings.authldap.bind_dn,
             "bind_password": settings.authldap.bind_pass,
             "base_dn": settings.authldap.base_dn,
+            "cache_socket": settings.cache.daemon_socket,
+            "snapshot_path": settings.cache.snapshot_path,
+            "record_path": settings.recording.record_path,
+            "replay_path": settings.recording.replay_path,
+            "replay_latency": settings.recording.replay_latency,
         }
         self.ldap_config = LDAPConfig(**new_conf)
 
@@ -248,6 +355,11 @@ class SubAppWidget(WrappedAppBase, SubAppViewerMixin, AppStoreServerMixin):
 
     def on_mount(self) -> None:
         """Ensure ldap widgets can load data"""
+        self.persistent_cache = PersistentCache.from_settings(self.ldap_config)
+        for view in self.query(ContentViewBase):
+            view.persistent_cache = self.persistent_cache
+            view.jobs = self.jobs
+
         self.load_ldap_session()
 
 
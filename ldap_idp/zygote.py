@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Session zygote - Pre-forked warm workers for ldapcp-serve
+
+A zygote process preloads Textual, python-ldap, the settings and the LDAP
+schema once, then keeps a pool of forked workers waiting for sessions.
+Each web session runs a tiny `connect` client which hands its stdio file
+descriptors to the zygote over a Unix socket; an idle worker adopts them
+and runs the app, so no session pays the interpreter and import cost.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import importlib
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/ldapcp-zygote.sock"
+DEFAULT_TARGET = "ldap_idp.main:main"
+
+# Header of each message: payload length, as network order uint32
+HEADER = struct.Struct("!I")
+MAX_FDS = 8
+
+# Seconds a client may take to send its session request once connected, and
+# to finish sending it once it started: the dispatch loop never waits longer
+REQUEST_DEADLINE = 10.0
+REQUEST_TIMEOUT = 1.0
+
+
+# =============================================================
+# Wire helpers
+# =============================================================
+
+
+def send_message(sock: socket.socket, payload: Dict[str, Any], fds: List[int] = None):
+    """Send a JSON payload, with optional file descriptors attached."""
+    data = json.dumps(payload).encode("utf-8")
+    data = HEADER.pack(len(data)) + data
+    if fds:
+        sent = socket.send_fds(sock, [data], list(fds))
+        data = data[sent:]
+    if data:
+        sock.sendall(data)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Optional[Dict[str, Any]], List[int]]:
+    """Receive a JSON payload and its file descriptors, if any.
+
+    Returns (None, []) when the peer closed the socket.
+    """
+    data, fds, _flags, _addr = socket.recv_fds(sock, 65536, MAX_FDS)
+    if not data:
+        return None, fds
+
+    while len(data) < HEADER.size:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return None, fds
+        data += chunk
+    (size,) = HEADER.unpack(data[: HEADER.size])
+
+    data = data[HEADER.size :]
+    while len(data) < size:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return None, fds
+        data += chunk
+
+    return json.loads(data[:size].decode("utf-8")), fds
+
+
+def settings_environ(environ: Dict[str, str]) -> Dict[str, str]:
+    """Return the environment variables the settings are read from."""
+    return {
+        name: value
+        for name, value in environ.items()
+        if name.startswith("LDAPCP_") or name.endswith("_FOR_DYNACONF")
+    }
+
+
+def load_target(target: str):
+    """Return the callable designated by a 'module:function' string."""
+    module_name, _, func_name = target.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, func_name or "main")
+
+
+def run_target(target_func) -> int:
+    """Run the app and return its exit code, 1 if it raised."""
+    try:
+        result = target_func()
+    except SystemExit as err:
+        if err.code is None or isinstance(err.code, int):
+            return err.code or 0
+        # sys.exit("message") prints the message and fails
+        print(err.code, file=sys.stderr)
+        return 1
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Session failed")
+        return 1
+    # Entry points may return their exit code, as for console scripts
+    return result if isinstance(result, int) else 0
+
+
+# =============================================================
+# Zygote server
+# =============================================================
+
+
+class Zygote:
+    """Preloading parent process that forks session workers from a warm pool."""
+
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_SOCKET,
+        pool_size: int = 2,
+        target: str = DEFAULT_TARGET,
+        preload_schema: bool = True,
+    ):
+        assert pool_size >= 1, f"Pool size must be at least 1, not {pool_size}"
+
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.target = target
+        self.preload_schema = preload_schema
+
+        self.listener: Optional[socket.socket] = None
+        self.pool: List[Tuple[int, socket.socket]] = []
+        # Connections whose request is not read yet, with their deadline,
+        # and sessions read, waiting for an idle worker
+        self.accepted: Dict[socket.socket, float] = {}
+        self.waiting: List[Tuple[socket.socket, Dict[str, Any], List[int]]] = []
+        self.running = False
+        self.target_func = None
+        # Working directory and environment the settings were read with
+        self.settings_state: Optional[Tuple[str, Dict[str, str]]] = None
+
+    def preload(self) -> None:
+        """Import the app, read settings and fetch the schema before any fork."""
+        start = time.perf_counter()
+        self.target_func = load_target(self.target)
+
+        # pylint: disable=import-outside-toplevel
+        from ldap_idp.config import settings
+
+        # Dynaconf is lazy, force it to read the settings files now
+        settings.as_dict()
+        self.settings_state = (os.getcwd(), settings_environ(os.environ))
+
+        if self.preload_schema:
+            self._preload_schema(settings)
+
+        logger.info(
+            f"Zygote preloaded {self.target} in {time.perf_counter() - start:.3f}s"
+        )
+
+    def _preload_schema(self, settings) -> None:
+        """Fetch the schema with a throw-away connection, closed before forking."""
+        # pylint: disable=import-outside-toplevel
+        from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+
+        config = LDAPConfig(
+            uri=settings.authldap.uri,
+            bind_dn=settings.authldap.bind_dn,
+            bind_password=settings.authldap.bind_pass,
+            base_dn=settings.authldap.base_dn,
+            cache_socket=settings.cache.daemon_socket,
+        )
+        ldap_connection = LDAPConnectionImproved(config)
+        try:
+            ldap_connection.connect()
+            ldap_connection.get_schema()
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning(f"Schema preload skipped: {err}")
+        finally:
+            try:
+                ldap_connection.disconnect()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    # Pool management
+    # ---------------------------
+
+    def _spawn_worker(self) -> None:
+        """Fork one worker which waits for a session on its private socket."""
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Nothing buffered may be duplicated into the child
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                parent_sock.close()
+                if self.listener:
+                    self.listener.close()
+                for _pid, sock in self.pool:
+                    sock.close()
+                # Other sessions are not the worker's to hold open
+                for conn in self.accepted:
+                    conn.close()
+                for conn, _payload, fds in self.waiting:
+                    for fd in fds:
+                        os.close(fd)
+                    conn.close()
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                code = self._worker_main(child_sock)
+            finally:
+                os._exit(code)  # pylint: disable=protected-access
+
+        child_sock.close()
+        self.pool.append((pid, parent_sock))
+        logger.debug(f"Spawned zygote worker {pid}")
+
+    def _fill_pool(self) -> None:
+        while len(self.pool) < self.pool_size:
+            self._spawn_worker()
+
+    def _reap_children(self) -> None:
+        """Collect exited workers, dropping dead ones from the idle pool."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            logger.debug(f"Worker {pid} exited with status {status}")
+            for item in list(self.pool):
+                if item[0] == pid:
+                    item[1].close()
+                    self.pool.remove(item)
+
+    # Session dispatch
+    # ---------------------------
+
+    def _accept(self) -> None:
+        conn, _addr = self.listener.accept()
+        conn.settimeout(REQUEST_TIMEOUT)
+        self.accepted[conn] = time.monotonic() + REQUEST_DEADLINE
+
+    def _read_request(self, conn: socket.socket) -> None:
+        """Read the session request of a client, queuing it for a worker."""
+        del self.accepted[conn]
+        try:
+            payload, fds = recv_message(conn)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Unreadable session request: {err}")
+            conn.close()
+            return
+
+        if payload is None or len(fds) != 3:
+            if payload is not None:
+                logger.warning(f"Invalid session request: {len(fds)} fds received")
+            # Otherwise a probe connection, see wait_for_socket()
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            return
+        # The worker adopts the connection as a blocking socket
+        conn.settimeout(None)
+        self.waiting.append((conn, payload, fds))
+
+    def _expire_requests(self) -> None:
+        now = time.monotonic()
+        for conn in [conn for conn, deadline in self.accepted.items() if deadline <= now]:
+            logger.warning("Session request not received in time, closing")
+            del self.accepted[conn]
+            conn.close()
+
+    def _dispatch_waiting(self) -> None:
+        """Hand waiting sessions over to idle workers, as long as there are some."""
+        while self.waiting and self.pool:
+            conn, payload, fds = self.waiting[0]
+            pid, worker_sock = self.pool.pop(0)
+            try:
+                send_message(worker_sock, payload, fds + [conn.fileno()])
+            except OSError as err:
+                logger.warning(f"Worker {pid} unusable ({err}), trying next one")
+                continue
+            finally:
+                worker_sock.close()
+
+            self.waiting.pop(0)
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+            logger.info(f"Session dispatched to worker {pid}")
+
+    def serve_forever(self) -> None:
+        """Preload, fill the pool and dispatch sessions until terminated.
+
+        Requests are read as they arrive, never waiting on a slow client.
+        Workers are forked one per turn of the loop, so sessions keep being
+        accepted while the pool refills.
+        """
+        self.preload()
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        self.listener.listen(64)
+
+        signal.signal(signal.SIGTERM, self._on_terminate)
+        self._fill_pool()
+
+        logger.info(
+            f"Zygote listening on {self.socket_path} with {self.pool_size} workers"
+        )
+        self.running = True
+        try:
+            while self.running:
+                refill = len(self.pool) < self.pool_size
+                readable, _, _ = select.select(
+                    [self.listener, *self.accepted], [], [], 0 if refill else 1.0
+                )
+                for sock in readable:
+                    if sock is self.listener:
+                        self._accept()
+                    else:
+                        self._read_request(sock)
+                self._expire_requests()
+                self._reap_children()
+                self._dispatch_waiting()
+                if self.running and len(self.pool) < self.pool_size:
+                    self._spawn_worker()
+                    self._dispatch_waiting()
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        """Close the listener and release idle workers."""
+        self.running = False
+        for _pid, sock in self.pool:
+            sock.close()
+        self.pool = []
+        for conn in self.accepted:
+            conn.close()
+        self.accepted = {}
+        for conn, _payload, fds in self.waiting:
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+        self.waiting = []
+        if self.listener:
+            self.listener.close()
+            self.listener = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _on_terminate(self, _signum, _frame) -> None:
+        self.running = False
+
+    # Worker side
+    # ---------------------------
+
+    def _worker_main(self, sock: socket.socket) -> int:
+        """Wait for a session, adopt its stdio and run the app."""
+        payload, fds = recv_message(sock)
+        sock.close()
+        if payload is None:
+            # Zygote went away while we were idle
+            return 0
+
+        stdin_fd, stdout_fd, stderr_fd, conn_fd = fds
+        for src, dst in ((stdin_fd, 0), (stdout_fd, 1), (stderr_fd, 2)):
+            os.dup2(src, dst)
+            os.close(src)
+        conn = socket.socket(fileno=conn_fd)
+
+        os.setsid()
+        os.chdir(payload.get("cwd") or os.getcwd())
+        os.environ.clear()
+        os.environ.update(payload.get("env", {}))
+        sys.argv = [sys.argv[0]] + payload.get("argv", [])
+
+        # Sessions with their own LDAPCP_* variables, or started where other
+        # settings files are, must not run with the zygote settings
+        # pylint: disable=import-outside-toplevel
+        from ldap_idp.config import settings
+
+        if (os.getcwd(), settings_environ(os.environ)) != self.settings_state:
+            settings.reload()
+
+        # Textual reads its driver and FPS settings at import time
+        # pylint: disable=import-outside-toplevel
+        import textual.constants
+
+        importlib.reload(textual.constants)
+
+        conn.sendall(f"pid {os.getpid()}\n".encode("utf-8"))
+
+        try:
+            code = run_target(self.target_func)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            try:
+                conn.sendall(f"exit {code}\n".encode("utf-8"))
+            except OSError:
+                pass
+        return code
+
+
+# =============================================================
+# Session client
+# =============================================================
+
+
+def run_client(socket_path: str, target: str = DEFAULT_TARGET) -> int:
+    """Run one session through the zygote and return the app exit code.
+
+    Falls back to running the app in-process if the zygote is unreachable.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError as err:
+        logger.warning(f"Zygote unavailable on {socket_path} ({err}), cold start")
+        sock.close()
+        return run_target(load_target(target))
+
+    payload = {
+        "env": dict(os.environ),
+        "cwd": os.getcwd(),
+        "argv": sys.argv[1:],
+    }
+    send_message(sock, payload, [0, 1, 2])
+
+    worker_pid = None
+
+    def forward_signal(signum, _frame):
+        if worker_pid:
+            os.killpg(worker_pid, signum)
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward_signal)
+
+    code = 1
+    for line in sock.makefile("r", encoding="utf-8"):
+        kind, _, value = line.strip().partition(" ")
+        if kind == "pid":
+            worker_pid = int(value)
+        elif kind == "exit":
+            code = int(value)
+            break
+    sock.close()
+    return code
+
+
+# =============================================================
+# Spawn latency benchmark
+# =============================================================
+
+
+def measure_spawn(command: str, env: Dict[str, str], timeout: float = 30.0) -> float:
+    """Return seconds until a web-driver app process writes its first byte."""
+    start = time.perf_counter()
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        command,
+        shell=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=env,
+        start_new_session=True,
+    )
+    try:
+        readable, _, _ = select.select([process.stdout], [], [], timeout)
+        if not readable or not os.read(process.stdout.fileno(), 1):
+            raise RuntimeError(f"No output from '{command}' within {timeout}s")
+        return time.perf_counter() - start
+    finally:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+
+def bench_report(label: str, samples: List[float]) -> str:
+    """Format spawn latency statistics in milliseconds."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return (
+        f"{label:<8} n={len(samples):<4} "
+        f"mean={statistics.mean(samples) * 1000:8.1f}ms "
+        f"p50={statistics.median(samples) * 1000:8.1f}ms "
+        f"p95={p95 * 1000:8.1f}ms"
+    )
+
+
+# =============================================================
+# CLI
+# =============================================================
+
+
+@click.group()
+def main():
+    """Pre-forked session workers for ldapcp-serve."""
+
+
+@main.command()
+@click.option("--socket", "socket_path", default=DEFAULT_SOCKET, help="Unix socket path")
+@click.option("--pool-size", default=2, type=int, help="Number of warm workers")
+@click.option("--target", default=DEFAULT_TARGET, help="App entry point (module:func)")
+@click.option("--no-schema", is_flag=True, help="Skip LDAP schema preloading")
+def server(socket_path: str, pool_size: int, target: str, no_schema: bool) -> None:
+    """Run the zygote process."""
+    zygote = Zygote(
+        socket_path=socket_path,
+        pool_size=pool_size,
+        target=target,
+        preload_schema=not no_schema,
+    )
+    zygote.serve_forever()
+
+
+@main.command()
+@click.option("--socket", "socket_path", default=DEFAULT_SOCKET, help="Unix socket path")
+@click.option("--target", default=DEFAULT_TARGET, help="Fallback entry point")
+def connect(socket_path: str, target: str) -> None:
+    """Run one app session inside a warm worker."""
+    sys.exit(run_client(socket_path, target=target))
+
+
+@main.command()
+@click.option("--socket", "socket_path", default=DEFAULT_SOCKET, help="Unix socket path")
+@click.option("--pool-size", default=4, type=int, help="Number of warm workers")
+@click.option("--runs", default=10, type=int, help="Spawns per mode")
+def bench(socket_path: str, pool_size: int, runs: int) -> None:
+    """Compare cold and zygote session spawn latency."""
+    env = dict(os.environ)
+    env["TEXTUAL_DRIVER"] = "textual.drivers.web_driver:WebDriver"
+    env["COLUMNS"] = "80"
+    env["ROWS"] = "24"
+
+    python = sys.executable
+    cold = [measure_spawn(f"{python} -m ldap_idp.main", env) for _ in range(runs)]
+    click.echo(bench_report("cold", cold))
+
+    zygote_proc = subprocess.Popen(  # pylint: disable=consider-using-with
+        [python, "-m", "ldap_idp.zygote", "server",
+         "--socket", socket_path, "--pool-size", str(pool_size)],
+    )
+    try:
+        wait_for_socket(socket_path)
+        warm = []
+        for _ in range(runs):
+            warm.append(
+                measure_spawn(f"{python} -m ldap_idp.zygote connect --socket {socket_path}", env)
+            )
+            # Let the zygote refill its pool, as between real sessions
+            time.sleep(0.2)
+        click.echo(bench_report("zygote", warm))
+    finally:
+        zygote_proc.terminate()
+        zygote_proc.wait()
+
+
+def wait_for_socket(socket_path: str, timeout: float = 60.0) -> None:
+    """Block until the zygote accepts connections."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Zygote did not start on {socket_path} within {timeout}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Tests of the columnar result store of the viewer table."""
+
+from ldap_idp.columnar import (
+    DictColumn,
+    NumberColumn,
+    ResultStore,
+    SearchIndex,
+    StringColumn,
+)
+
+
+def result(dn, **attributes):
+    return {"dn": dn, "attributes": {name: [value] for name, value in attributes.items()}}
+
+
+def make_store(results, columns=("dn", "uid", "uidnumber")):
+    return ResultStore.from_results(list(columns), results, placeholder="-")
+
+
+def dns(store):
+    return [store.keys[row] for row in store.view]
+
+
+# =============================================================
+# Sort
+# =============================================================
+
+
+def test_numeric_sort_puts_missing_values_first():
+    store = make_store([
+        result("uid=a", uid="a", uidNumber="10"),
+        result("uid=b", uid="b", uidNumber="2"),
+        result("uid=c", uid="c"),
+        result("uid=d", uid="d", uidNumber="-33"),
+    ])
+    assert isinstance(store.columns["uidnumber"], NumberColumn)
+
+    store.sort("uidnumber")
+    assert dns(store) == ["uid=c", "uid=d", "uid=b", "uid=a"]
+    assert store.cell(store.view[0], "uidnumber") == "-"
+
+    store.sort("uidnumber", reverse=True)
+    assert dns(store) == ["uid=a", "uid=b", "uid=d", "uid=c"]
+
+
+def test_numbers_with_leading_zeros_stay_strings():
+    store = make_store([result(f"uid={i}", uidNumber=value) for i, value in enumerate(["010", "9", "100"])])
+    assert not isinstance(store.columns["uidnumber"], NumberColumn)
+    assert store.cell(0, "uidnumber") == "010"
+
+
+def test_dict_column_sort_is_stable():
+    results = [result(f"uid={i:02}", ou="b" if i % 2 else "a") for i in range(20)]
+    store = make_store(results, columns=("dn", "ou"))
+    assert isinstance(store.columns["ou"], DictColumn)
+
+    store.sort("ou")
+    assert dns(store) == [f"uid={i:02}" for i in range(0, 20, 2)] + [f"uid={i:02}" for i in range(1, 20, 2)]
+
+    # Reversed order of values, rows of a value keep their order
+    store.sort("ou", reverse=True)
+    assert dns(store) == [f"uid={i:02}" for i in range(1, 20, 2)] + [f"uid={i:02}" for i in range(0, 20, 2)]
+
+
+# =============================================================
+# Live changes
+# =============================================================
+
+
+def test_upsert_demotes_number_column():
+    store = make_store([result("uid=a", uid="a", uidNumber="1"), result("uid=b", uid="b", uidNumber="2")])
+    store.filter("b")
+    assert dns(store) == ["uid=b"]
+
+    row = store.upsert(result("uid=a", uid="a", uidNumber="n/a"))
+
+    column = store.columns["uidnumber"]
+    assert isinstance(column, StringColumn)
+    assert [column.get(i) for i in range(len(column))] == ["n/a", "2"]
+    assert store.cell(row, "uidnumber") == "n/a"
+    # The index is rebuilt from the demoted column
+    store.filter("n/a")
+    assert dns(store) == ["uid=a"]
+
+
+def test_upsert_adds_rows_to_sorted_and_filtered_views():
+    store = make_store([result("uid=alice", uid="alice", uidNumber="2")])
+    store.sort("uidnumber")
+    store.filter("ali")
+
+    store.upsert(result("uid=alison", uid="alison", uidNumber="1"))
+    store.upsert(result("uid=bob", uid="bob", uidNumber="3"))
+
+    assert store.size == 3
+    assert sorted(dns(store)) == ["uid=alice", "uid=alison"]
+
+
+def test_delete_drops_row_until_upserted_again():
+    store = make_store([result("uid=a", uid="a"), result("uid=b", uid="b")])
+
+    assert store.delete("uid=a") == 0
+    assert store.delete("uid=a") is None
+    assert dns(store) == ["uid=b"]
+    assert store.size == 1
+    assert store.equals("uid", "a") == []
+    store.filter("a")
+    assert dns(store) == []
+
+    store.upsert(result("uid=a", uid="a"))
+    assert dns(store) == ["uid=a"]
+    assert store.size == 2
+
+
+# =============================================================
+# Filter
+# =============================================================
+
+
+def test_search_index_rows_among_candidates():
+    store = make_store([
+        result("uid=alice", uid="alice"),
+        result("uid=bob", uid="bob"),
+        result("uid=alina", uid="alina"),
+    ])
+    index = SearchIndex(store)
+
+    assert index.rows("ali") == {0, 2}
+    assert index.rows("ali", {1, 2}) == {2}
+    assert index.rows("ali", set()) == set()
+    # Rows appended after the index was built are not in it
+    assert index.rows("ali", {0, 7}) == {0}
+
+
+def test_extended_query_checks_previous_matches_and_changed_rows():
+    store = make_store([
+        result("uid=alice", uid="alice"),
+        result("uid=alina", uid="alina"),
+        result("uid=bob", uid="bob"),
+    ])
+    store.filter("al")
+    assert sorted(dns(store)) == ["uid=alice", "uid=alina"]
+
+    # Changed after the index was built: checked without it
+    store.upsert(result("uid=bob", uid="alibob"))
+    assert sorted(dns(store)) == ["uid=alice", "uid=alina", "uid=bob"]
+
+    store.filter("ali")
+    assert sorted(dns(store)) == ["uid=alice", "uid=alina", "uid=bob"]
+    store.filter("alic")
+    assert dns(store) == ["uid=alice"]
+
+    # A shorter query is not an extension: all rows are searched again
+    store.filter("b")
+    assert dns(store) == ["uid=bob"]
+    store.filter("")
+    assert len(store) == 3
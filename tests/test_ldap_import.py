@@ -0,0 +1,204 @@
+"""Tests of the pipelined LDIF import engine, with a fake asynchronous connection."""
+
+import io
+import json
+
+import ldap
+import pytest
+
+from ldap_idp import ldap_import
+from ldap_idp.ldap_import import CheckpointError, ImportEngine, file_fingerprint
+from ldap_idp.ldif_stream import iter_ldif_records
+
+
+class FakeConnection:
+    """Asynchronous python-ldap calls, completing the newest operation first."""
+
+    def __init__(self, fail_dns=(), crash_after=None):
+        self.fail_dns = {dn.lower() for dn in fail_dns}
+        self.crash_after = crash_after
+        self.pending = []
+        self.sent = []
+        self.results = 0
+        self.max_in_flight = 0
+        # DNs in flight when each operation was sent
+        self.in_flight_at = {}
+
+    def _send(self, op, dn):
+        msgid = len(self.sent) + 1
+        self.in_flight_at[(op, dn)] = [item[2] for item in self.pending]
+        self.sent.append((op, dn))
+        self.pending.append((msgid, op, dn))
+        self.max_in_flight = max(self.max_in_flight, len(self.pending))
+        return msgid
+
+    def add_ext(self, dn, modlist):
+        return self._send("add", dn)
+
+    def modify_ext(self, dn, modlist):
+        return self._send("modify", dn)
+
+    def delete_ext(self, dn):
+        return self._send("delete", dn)
+
+    def rename(self, dn, newrdn, newsuperior=None, delold=1):
+        return self._send("modrdn", dn)
+
+    def result3(self, msgid=ldap.RES_ANY, all=1):
+        if self.crash_after is not None and self.results >= self.crash_after:
+            raise RuntimeError("connection lost")
+        self.results += 1
+        msgid, _op, dn = self.pending.pop()
+        if dn.lower() in self.fail_dns:
+            raise ldap.ALREADY_EXISTS({"desc": "Already exists", "msgid": msgid})
+        return 105, [], msgid, []
+
+
+def records_of(text):
+    return list(iter_ldif_records(io.StringIO(text)))
+
+
+def adds(*dns):
+    return records_of("".join(f"dn: {dn}\nobjectClass: top\n\n" for dn in dns))
+
+
+# =============================================================
+# Dependencies
+# =============================================================
+
+
+def test_children_wait_for_their_parent():
+    conn = FakeConnection()
+    records = adds("ou=a,dc=x", "cn=1,ou=a,dc=x", "ou=b,dc=x", "cn=2,ou=a,dc=x")
+
+    stats = ImportEngine(conn, window=8).run(records)
+
+    assert stats["completed"] == 4 and stats["errors"] == 0
+    assert "ou=a,dc=x" not in conn.in_flight_at[("add", "cn=1,ou=a,dc=x")]
+    # Unrelated entries are pipelined
+    assert conn.in_flight_at[("add", "ou=b,dc=x")] != []
+
+
+def test_deletes_and_renames_wait_for_their_children():
+    conn = FakeConnection()
+    records = records_of(
+        "dn: cn=1,ou=a,dc=x\nchangetype: modify\nreplace: cn\ncn: 1\n-\n\n"
+        "dn: ou=a,dc=x\nchangetype: delete\n\n"
+        "dn: cn=2,ou=b,dc=x\nchangetype: delete\n\n"
+        "dn: ou=b,dc=x\nchangetype: modrdn\nnewrdn: ou=c\ndeleteoldrdn: 1\n"
+    )
+
+    ImportEngine(conn, window=8).run(records)
+
+    assert conn.in_flight_at[("delete", "ou=a,dc=x")] == []
+    assert "cn=2,ou=b,dc=x" not in conn.in_flight_at[("modrdn", "ou=b,dc=x")]
+
+
+def test_window_bounds_operations_in_flight():
+    conn = FakeConnection()
+    ImportEngine(conn, window=3).run(adds(*[f"cn={i},dc=x" for i in range(20)]))
+    assert conn.max_in_flight == 3
+    assert len(conn.sent) == 20
+
+
+def test_failed_records_are_reported():
+    conn = FakeConnection(fail_dns=["cn=1,dc=x"])
+    failed = []
+    engine = ImportEngine(conn, window=4, on_error=lambda record, err: failed.append(record.dn))
+
+    stats = engine.run(adds("cn=0,dc=x", "cn=1,dc=x", "cn=2,dc=x"))
+
+    assert failed == ["cn=1,dc=x"]
+    assert (stats["completed"], stats["errors"]) == (3, 1)
+
+
+def test_needs_asynchronous_connection():
+    with pytest.raises(RuntimeError):
+        ImportEngine(object())
+
+
+# =============================================================
+# Checkpoints
+# =============================================================
+
+
+@pytest.fixture
+def ldif_file(tmp_path):
+    path = tmp_path / "changes.ldif"
+    path.write_text("".join(f"dn: cn={i},dc=x\nobjectClass: top\n\n" for i in range(6)))
+    return path
+
+
+def test_resume_applies_remaining_records_once(tmp_path, ldif_file, monkeypatch):
+    monkeypatch.setattr(ldap_import, "CHECKPOINT_INTERVAL", 0)
+    checkpoint = tmp_path / "changes.checkpoint"
+    source = file_fingerprint(str(ldif_file))
+
+    # Records complete out of order, then the connection is lost
+    conn = FakeConnection(crash_after=3)
+    engine = ImportEngine(conn, window=3, checkpoint_path=str(checkpoint), source=source)
+    with pytest.raises(RuntimeError):
+        engine.run(iter_ldif_records(io.StringIO(ldif_file.read_text())))
+    state = json.loads(checkpoint.read_text())
+    assert (state["next"], state["done"]) == (0, [2, 3, 4])
+
+    conn = FakeConnection()
+    engine = ImportEngine(
+        conn, window=3, checkpoint_path=str(checkpoint), source=source, resume=True
+    )
+    stats = engine.run(iter_ldif_records(io.StringIO(ldif_file.read_text())))
+
+    assert conn.sent == [("add", "cn=0,dc=x"), ("add", "cn=1,dc=x"), ("add", "cn=5,dc=x")]
+    assert stats["skipped"] == 3
+    assert not checkpoint.exists()
+
+
+def test_stopped_import_keeps_its_checkpoint(tmp_path, ldif_file):
+    checkpoint = tmp_path / "changes.checkpoint"
+    conn = FakeConnection()
+    engine = ImportEngine(
+        conn, window=2, checkpoint_path=str(checkpoint), source=file_fingerprint(str(ldif_file))
+    )
+
+    records = iter_ldif_records(io.StringIO(ldif_file.read_text()))
+    engine.run(records, should_stop=lambda: len(conn.sent) >= 2)
+
+    assert json.loads(checkpoint.read_text())["next"] == 2
+
+
+def test_record_stopping_the_import_is_retried_on_resume(tmp_path, ldif_file):
+    checkpoint = tmp_path / "changes.checkpoint"
+    source = file_fingerprint(str(ldif_file))
+
+    conn = FakeConnection(fail_dns=["cn=1,dc=x"])
+    engine = ImportEngine(
+        conn, window=1, checkpoint_path=str(checkpoint), source=source, stop_on_error=True
+    )
+    engine.run(iter_ldif_records(io.StringIO(ldif_file.read_text())))
+    assert json.loads(checkpoint.read_text())["next"] == 1
+
+    conn = FakeConnection()
+    engine = ImportEngine(conn, window=1, checkpoint_path=str(checkpoint), source=source, resume=True)
+    engine.run(iter_ldif_records(io.StringIO(ldif_file.read_text())))
+
+    assert conn.sent[0] == ("add", "cn=1,dc=x")
+    assert not checkpoint.exists()
+
+
+def test_checkpoint_is_only_resumed_on_request_and_for_the_same_file(tmp_path, ldif_file):
+    checkpoint = tmp_path / "changes.checkpoint"
+    source = file_fingerprint(str(ldif_file))
+    checkpoint.write_text(json.dumps({"source": source, "next": 2, "done": []}))
+
+    with pytest.raises(CheckpointError, match="unfinished import"):
+        ImportEngine(FakeConnection(), checkpoint_path=str(checkpoint), source=source)
+
+    ldif_file.write_text(ldif_file.read_text() + "dn: cn=6,dc=x\nobjectClass: top\n")
+    with pytest.raises(CheckpointError, match="another version"):
+        ImportEngine(
+            FakeConnection(),
+            checkpoint_path=str(checkpoint),
+            source=file_fingerprint(str(ldif_file)),
+            resume=True,
+        )
+    assert checkpoint.exists()
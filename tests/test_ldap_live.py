@@ -0,0 +1,177 @@
+"""Tests of the live watcher, with the syncrepl events a syncprov provider sends.
+
+test_syncrepl_server runs against a real server, e.g. the openldap service
+of docker-compose.yml:
+
+    docker-compose --profile syncrepl up -d openldap
+    LDAPCP_TEST_SYNCREPL_URI=ldap://localhost:1389 pytest tests/test_ldap_live.py
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from ldap_idp.ldap_backend import LDAPConfig, LDAPConnectionImproved
+from ldap_idp.ldap_live import LiveWatcher, SyncreplConnection
+
+BASE_DN = "dc=example,dc=org"
+ALICE = f"uid=alice,ou=users,{BASE_DN}"
+BOB = f"uid=bob,ou=users,{BASE_DN}"
+
+
+def make_watcher(known_results, **config):
+    backend = LDAPConnectionImproved(
+        LDAPConfig(uri="ldap://localhost", bind_dn="", bind_password="", base_dn=BASE_DN, **config)
+    )
+    changes = []
+    watcher = LiveWatcher(
+        backend,
+        "(objectClass=inetOrgPerson)",
+        known_results,
+        on_change=lambda kind, dn, attributes: changes.append((kind, dn, attributes)),
+    )
+    return watcher, changes
+
+
+def alice(description="admin"):
+    return {"dn": ALICE, "attributes": {"uid": ["alice"], "description": [description]}}
+
+
+def raw(result):
+    return {name: [value.encode() for value in values] for name, values in result["attributes"].items()}
+
+
+# =============================================================
+# Syncrepl events
+# =============================================================
+
+
+def test_refresh_reports_changes_against_displayed_entries():
+    watcher, changes = make_watcher([alice(), {"dn": BOB, "attributes": {"uid": ["bob"]}}])
+    consumer = SyncreplConnection("ldap://localhost", watcher)
+    watcher._refresh_seen = set()
+
+    # Unchanged alice, then a new entry; bob is not sent: deleted meanwhile
+    consumer.syncrepl_entry(ALICE, raw(alice()), "uuid-alice")
+    consumer.syncrepl_entry(f"uid=carol,ou=users,{BASE_DN}", {"uid": [b"carol"]}, "uuid-carol")
+    consumer.syncrepl_refreshdone()
+
+    assert [(kind, dn) for kind, dn, _ in changes] == [
+        ("add", f"uid=carol,ou=users,{BASE_DN}"),
+        ("delete", BOB.lower()),
+    ]
+
+
+def test_persist_phase_modify_rename_and_delete():
+    watcher, changes = make_watcher([alice()])
+    consumer = SyncreplConnection("ldap://localhost", watcher)
+    watcher._refresh_seen = set()
+    consumer.syncrepl_entry(ALICE, raw(alice()), "uuid-alice")
+    consumer.syncrepl_refreshdone()
+
+    consumer.syncrepl_entry(ALICE, raw(alice("ops")), "uuid-alice")
+    renamed = f"uid=alice2,ou=users,{BASE_DN}"
+    consumer.syncrepl_entry(renamed, raw(alice("ops")), "uuid-alice")
+    consumer.syncrepl_delete(["uuid-alice"])
+
+    assert [(kind, dn) for kind, dn, _ in changes] == [
+        ("modify", ALICE),
+        ("delete", ALICE),
+        ("add", renamed),
+        ("delete", renamed),
+    ]
+    assert changes[0][2] == {"uid": ["alice"], "description": ["ops"]}
+
+
+def test_dynamic_members_are_not_a_change():
+    group_dn = f"cn=admins,ou=groups,{BASE_DN}"
+    group = {"objectClass": ["groupOfURLs"], "memberURL": [f"ldap:///{BASE_DN}??sub?(uid=*)"]}
+    displayed = {"dn": group_dn, "attributes": dict(group, dynamicMember=[ALICE])}
+    watcher, changes = make_watcher([displayed])
+
+    watcher.emit_entry(group_dn, {name: [v.encode() for v in values] for name, values in group.items()})
+
+    assert changes == []
+
+
+def test_poll_once_reports_modified_and_deleted_entries(monkeypatch):
+    watcher, changes = make_watcher([alice(), {"dn": BOB, "attributes": {"uid": ["bob"]}}])
+    modified = dict(alice("ops"))
+    modified["attributes"] = dict(modified["attributes"], modifyTimestamp=["20260101000000Z"])
+
+    def iter_search(scope, filter_str, attributes):
+        if "modifyTimestamp" in filter_str:
+            yield [modified]
+        else:
+            yield [{"dn": ALICE, "attributes": {}}]
+
+    monkeypatch.setattr(watcher.ldap_connection, "iter_search", iter_search)
+    watermark = watcher.poll_once("20250101000000Z")
+
+    assert watermark == "20260101000000Z"
+    assert [(kind, dn) for kind, dn, _ in changes] == [("modify", ALICE), ("delete", BOB.lower())]
+
+
+@pytest.mark.parametrize("transport", ["snapshot_path", "cache_socket", "replay_path"])
+def test_indirect_transports_poll(monkeypatch, transport):
+    watcher, _ = make_watcher([], **{transport: "/nonexistent"})
+    ran = []
+    monkeypatch.setattr(watcher, "_run_syncrepl", lambda should_stop: ran.append("syncrepl"))
+    monkeypatch.setattr(watcher, "_run_polling", lambda should_stop: ran.append("polling"))
+
+    watcher.run(lambda: True)
+
+    assert ran == ["polling"]
+
+
+# =============================================================
+# Server
+# =============================================================
+
+
+SYNCREPL_URI = os.environ.get("LDAPCP_TEST_SYNCREPL_URI")
+
+
+@pytest.mark.skipif(not SYNCREPL_URI, reason="LDAPCP_TEST_SYNCREPL_URI is not set")
+def test_syncrepl_server():
+    config = LDAPConfig(
+        uri=SYNCREPL_URI,
+        bind_dn=os.environ.get("LDAPCP_TEST_BIND_DN", f"cn=admin,{BASE_DN}"),
+        bind_password=os.environ.get("LDAPCP_TEST_BIND_PASSWORD", "admin"),
+        base_dn=os.environ.get("LDAPCP_TEST_BASE_DN", BASE_DN),
+    )
+    backend = LDAPConnectionImproved(config)
+    backend.connect()
+    results = backend.search(filter_str="(objectClass=inetOrgPerson)")
+    assert results, "the server needs inetOrgPerson entries"
+    dn = results[0]["dn"]
+
+    changes, statuses = [], []
+    watcher = LiveWatcher(
+        backend,
+        "(objectClass=inetOrgPerson)",
+        results,
+        on_change=lambda kind, dn, attributes: changes.append((kind, dn)),
+        on_status=statuses.append,
+    )
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop.is_set,))
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while "live (syncrepl)" not in statuses and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert "live (syncrepl)" in statuses, f"syncrepl unavailable: {statuses}"
+
+        description = f"live test {time.time()}".encode()
+        backend.connection.modify_s(dn, [(2, "description", [description])])  # MOD_REPLACE
+        while ("modify", dn) not in changes and time.monotonic() < deadline:
+            time.sleep(0.1)
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+        backend.disconnect()
+
+    assert ("modify", dn) in changes
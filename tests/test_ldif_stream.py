@@ -0,0 +1,137 @@
+"""Tests of the streaming LDIF parser."""
+
+import base64
+import io
+
+import ldap
+import pytest
+
+from ldap_idp.ldif_stream import LDIFChangeWriter, LDIFError, iter_ldif_records
+
+
+def parse(text):
+    return list(iter_ldif_records(io.StringIO(text)))
+
+
+def test_content_records_are_adds_numbered_in_order():
+    records = parse(
+        "# people\n"
+        "dn: uid=a,dc=x\n"
+        "objectClass: person\n"
+        "objectClass: top\n"
+        "uid: a\n"
+        "\n"
+        "\n"
+        "dn: uid=b,dc=x\n"
+        "uid: b\n"
+    )
+    assert [(r.number, r.line, r.dn, r.changetype) for r in records] == [
+        (0, 2, "uid=a,dc=x", "add"),
+        (1, 8, "uid=b,dc=x", "add"),
+    ]
+    assert records[0].modlist == [("objectClass", [b"person", b"top"]), ("uid", [b"a"])]
+
+
+def test_folded_lines():
+    records = parse(
+        "dn: cn=a very long,\n"
+        " ou=people,dc=x\n"
+        "description: first\n"
+        "  second\n"
+        "# comment\n"
+        "cn: a very long\n"
+    )
+    assert records[0].dn == "cn=a very long,ou=people,dc=x"
+    assert records[0].modlist == [("description", [b"first second"]), ("cn", [b"a very long"])]
+
+
+def test_base64_values():
+    encoded = base64.b64encode("Zoë\n".encode()).decode()
+    records = parse(f"dn:: {base64.b64encode(b'cn=zo,dc=x').decode()}\ndescription:: {encoded}\n")
+    assert records[0].dn == "cn=zo,dc=x"
+    assert records[0].modlist == [("description", ["Zoë\n".encode()])]
+
+    with pytest.raises(LDIFError, match="Line 2"):
+        parse("dn: cn=a,dc=x\ndescription:: not base64!\n")
+
+
+def test_version_line():
+    # Alone in its block, or before the dn of the first record
+    for text in ("version: 1\n\ndn: cn=a,dc=x\ncn: a\n", "version: 1\ndn: cn=a,dc=x\ncn: a\n"):
+        records = parse(text)
+        assert [(r.number, r.dn) for r in records] == [(0, "cn=a,dc=x")]
+
+
+def test_modify_blocks():
+    records = parse(
+        "dn: cn=a,dc=x\n"
+        "changetype: modify\n"
+        "add: mail\n"
+        "mail: a@x\n"
+        "mail: b@x\n"
+        "-\n"
+        "delete: description\n"
+        "-\n"
+        "replace: cn\n"
+        "cn: A\n"
+        "-\n"
+    )
+    assert records[0].changetype == "modify"
+    assert records[0].modlist == [
+        (ldap.MOD_ADD, "mail", [b"a@x", b"b@x"]),
+        (ldap.MOD_DELETE, "description", None),
+        (ldap.MOD_REPLACE, "cn", [b"A"]),
+    ]
+
+    with pytest.raises(LDIFError, match="Value of cn in a add of mail"):
+        parse("dn: cn=a,dc=x\nchangetype: modify\nadd: mail\ncn: b\n-\n")
+    with pytest.raises(LDIFError, match="Invalid modify operation"):
+        parse("dn: cn=a,dc=x\nchangetype: modify\nincrement: uidNumber\n-\n")
+
+
+def test_delete_and_modrdn():
+    records = parse(
+        "dn: cn=a,dc=x\n"
+        "changetype: delete\n"
+        "\n"
+        "dn: cn=b,dc=x\n"
+        "changetype: modrdn\n"
+        "newrdn: cn=c\n"
+        "deleteoldrdn: 0\n"
+        "newsuperior: ou=old,dc=x\n"
+        "\n"
+        "dn: cn=d,dc=x\n"
+        "changetype: moddn\n"
+        "newrdn: cn=e\n"
+    )
+    assert [r.changetype for r in records] == ["delete", "modrdn", "moddn"]
+    assert (records[1].newrdn, records[1].deleteoldrdn, records[1].newsuperior) == (
+        "cn=c", False, "ou=old,dc=x"
+    )
+    assert (records[2].newrdn, records[2].deleteoldrdn, records[2].newsuperior) == ("cn=e", True, None)
+
+    with pytest.raises(LDIFError, match="Missing newrdn"):
+        parse("dn: cn=b,dc=x\nchangetype: modrdn\ndeleteoldrdn: 1\n")
+
+
+def test_malformed_records():
+    with pytest.raises(LDIFError, match="Record does not start with dn:"):
+        parse("cn: a\n")
+    with pytest.raises(LDIFError, match="Invalid changetype"):
+        parse("dn: cn=a,dc=x\nchangetype: rename\n")
+    with pytest.raises(LDIFError, match="Missing ':'"):
+        parse("dn: cn=a,dc=x\ncn\n")
+
+
+def test_writer_output_parses_back():
+    stream = io.StringIO()
+    writer = LDIFChangeWriter(stream, cols=20)
+    writer.add("cn=a,dc=x", {"cn": [b"a"], "description": [b" leading space", b"x" * 50]})
+    writer.modify("cn=a,dc=x", [(ldap.MOD_REPLACE, "cn", [b"b"]), (ldap.MOD_DELETE, "mail", None)])
+    writer.delete("cn=a,dc=x")
+
+    assert all(len(line) <= 20 for line in stream.getvalue().splitlines())
+    records = parse(stream.getvalue())
+    assert [r.changetype for r in records] == ["add", "modify", "delete"]
+    assert records[0].modlist == [("cn", [b"a"]), ("description", [b" leading space", b"x" * 50])]
+    assert records[1].modlist == [(ldap.MOD_REPLACE, "cn", [b"b"]), (ldap.MOD_DELETE, "mail", None)]
@@ -0,0 +1,83 @@
+"""Tests of the virtual table rendering a columnar result store."""
+
+import asyncio
+
+from textual.app import App, ComposeResult
+
+from ldap_idp.columnar import ResultStore
+from ldap_idp.lib_textual.wid_table import MAX_COLUMN_WIDTH, VirtualTable, fit
+
+
+class TableApp(App):
+    def __init__(self):
+        super().__init__()
+        self.selected = []
+
+    def compose(self) -> ComposeResult:
+        yield VirtualTable()
+
+    def on_virtual_table_header_selected(self, message: VirtualTable.HeaderSelected) -> None:
+        self.selected.append(message.column_key)
+
+
+def make_store():
+    results = [
+        {"dn": "uid=b", "attributes": {"uidNumber": ["20"]}},
+        {"dn": "uid=a", "attributes": {"uidNumber": ["3"]}},
+        {"dn": "uid=c", "attributes": {}},
+    ]
+    return ResultStore.from_results(["dn", "uidnumber"], results, placeholder="-")
+
+
+def line_text(table, y):
+    return "".join(segment.text for segment in table.render_line(y)).rstrip()
+
+
+def test_fit():
+    assert fit("abc", 5) == "abc  "
+    assert fit("abcdef", 4) == "abc…"
+
+
+def test_renders_store_view_and_sort_marker():
+    async def run():
+        app = TableApp()
+        async with app.run_test(size=(60, 10)) as pilot:
+            table = app.query_one(VirtualTable)
+            store = make_store()
+            table.set_store(store)
+            store.sort("uidnumber")
+            table.refresh_view()
+            await pilot.pause()
+
+            assert table.row_count == 3
+            assert line_text(table, 0).split() == ["dn", "uidnumber", "▲"]
+            rows = [line_text(table, y).split() for y in (1, 2, 3)]
+            assert rows == [["uid=c", "-"], ["uid=a", "3"], ["uid=b", "20"]]
+            assert line_text(table, 4) == ""
+
+            store.delete("uid=a")
+            table.refresh_view()
+            assert table.row_count == 2
+            assert line_text(table, 2).split() == ["uid=b", "20"]
+
+    asyncio.run(run())
+
+
+def test_column_widths_and_header_clicks():
+    async def run():
+        app = TableApp()
+        async with app.run_test(size=(60, 10)) as pilot:
+            table = app.query_one(VirtualTable)
+            store = ResultStore.from_results(
+                ["dn", "cn"], [{"dn": "uid=a", "attributes": {"cn": ["x" * 80]}}]
+            )
+            table.set_store(store)
+            assert table.widths == {"dn": len("uid=a"), "cn": MAX_COLUMN_WIDTH}
+
+            # dn takes 5 + 2 padding cells, cn starts after
+            await pilot.click(VirtualTable, offset=(2, 0))
+            await pilot.click(VirtualTable, offset=(12, 0))
+            await pilot.click(VirtualTable, offset=(12, 1))
+            assert app.selected == ["dn", "cn"]
+
+    asyncio.run(run())